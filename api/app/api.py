@@ -1,24 +1,355 @@
+import asyncio
+import json
 import os
 import uuid
-from typing import Optional
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Depends, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 import supabase
 from dotenv import load_dotenv
 
 # Import local modules
-from .inference import run_inference
-from .llama_prompt import llama_prompt
-from .utils.image_utils import preprocess_image, save_image_locally
-from .utils.heatmap import generate_heatmap
+from .batching import run_inference_async, get_batching_stats, get_batch_settings, InferenceQueueFullError
+from .embedding_cache import embedding_cache
+from .enrichment import enrichment_tracker, ENRICHED_FIELDS, READY
+from .executor import run_cpu_bound
+from .idempotency import (
+    idempotency_store,
+    request_fingerprint,
+    upload_id_for_key,
+    IdempotencyConflictError,
+    IdempotencyInterruptedError,
+    MAX_KEY_LENGTH,
+)
+from .job_queue import JobQueue, get_job_queue, get_job_queue_stats, is_transient_error
+from .lifecycle import model_lifecycle
+from .inference import get_model_runtime_stats, run_inference_batch, AUTO_CROP
+from .inference_server import InferenceServerError, get_inference_client, get_served_model_version
+from .runtime_profile import get_runtime_profile_info
+from .result_cache import get_result_cache, get_result_cache_stats, hash_image, make_cache_key, normalize_crop_name
+from .llama_prompt import request_llama_diagnosis
+from .pipeline import Pipeline, upload_pipeline_stats
+from .utils.image_utils import preprocess_image, read_upload, decode_image, get_decode_size, make_storage_image
+from .utils.heatmap import generate_heatmap, get_heatmap_extension
 from .utils.heatmap_simple import generate_heatmap_simple
 from .utils.disease_descriptions import generate_diagnosis_summary, format_disease_name
 
 # Import config here to avoid circular imports
-from .config import SUPABASE_URL, SUPABASE_KEY, STORAGE_BUCKET
+from .config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    STORAGE_BUCKET,
+    INFERENCE_SERVER,
+    PIPELINE_STORAGE_TIMEOUT_SECONDS,
+    PIPELINE_HEATMAP_TIMEOUT_SECONDS,
+    PIPELINE_LLAMA_TIMEOUT_SECONDS,
+    PIPELINE_DATABASE_TIMEOUT_SECONDS,
+    SSE_KEEPALIVE_SECONDS,
+    ENRICHMENT_POLL_SECONDS,
+    BATCH_UPLOAD_MAX_FILES,
+    BATCH_UPLOAD_CONCURRENCY,
+    BATCH_INSERT_SIZE,
+    BATCH_INSERT_INTERVAL_SECONDS,
+)
 
-# Initialize Supabase client
-supabase_client = supabase.create_client(SUPABASE_URL, SUPABASE_KEY)
+# Async Supabase client - created on first use inside each worker's event loop
+_supabase_client = None
+_supabase_client_pid = None
+_supabase_client_lock = asyncio.Lock()
+
+
+async def get_supabase_client() -> supabase.AsyncClient:
+    """Get or create the shared async Supabase client"""
+    global _supabase_client, _supabase_client_pid
+    
+    # A client inherited through a fork shares its parent's connections
+    if _supabase_client is None or _supabase_client_pid != os.getpid():
+        async with _supabase_client_lock:
+            if _supabase_client is None or _supabase_client_pid != os.getpid():
+                _supabase_client = await supabase.acreate_client(SUPABASE_URL, SUPABASE_KEY)
+                _supabase_client_pid = os.getpid()
+    return _supabase_client
+
+
+async def get_storage_url(path_in_bucket: str) -> str:
+    """Public URL of an object in Supabase Storage (built locally, the object need not exist yet)"""
+    client = await get_supabase_client()
+    return await client.storage.from_(STORAGE_BUCKET).get_public_url(path_in_bucket)
+
+
+async def upload_to_storage(path_in_bucket: str, data: bytes, upsert: bool = False) -> str:
+    """Upload bytes to Supabase Storage and return the public URL
+    
+    upsert=True overwrites an existing object instead of failing on it.
+    """
+    client = await get_supabase_client()
+    options = {"upsert": "true"} if upsert else None
+    await client.storage.from_(STORAGE_BUCKET).upload(path_in_bucket, data, options)
+    return await get_storage_url(path_in_bucket)
+
+
+async def lookup_cached_result(image_data: bytes, crop_name: str):
+    """Hash an upload and look up its stored result
+    
+    The image hash also keys the embedding cache, so a retry with another
+    crop skips the backbone forward pass.
+    
+    Returns:
+        (image_hash, cache_key, cached_response) - the last two are None when
+        result caching is disabled or the model version is unknown
+    """
+    image_hash = await run_cpu_bound(hash_image, image_data)
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return image_hash, None, None
+    try:
+        model_version = await get_served_model_version()
+    except InferenceServerError as e:
+        print(f"⚠️ Model version unavailable, skipping the result cache: {e}")
+        return image_hash, None, None
+    cache_key = make_cache_key(image_hash, crop_name, model_version)
+    return image_hash, cache_key, await run_cpu_bound(result_cache.get, cache_key)
+
+
+def combine_diagnosis(diagnosis: str, llama_diagnosis: Optional[str]) -> str:
+    """Append the LLaMA insights to the description-based diagnosis when there are any"""
+    if llama_diagnosis and "Unable to generate" not in llama_diagnosis:
+        return f"{diagnosis}\n\n**AI-Generated Additional Insights:**\n{llama_diagnosis}"
+    return diagnosis
+
+
+def build_upload_pipeline(upload_id: str, image_data: bytes, image, image_tensor,
+                          prediction_results: dict, crop_name: str, on_stage=None,
+                          use_llama: bool = True, insert: bool = True, idempotent: bool = False) -> Pipeline:
+    """Stages that turn a prediction into a stored detection
+    
+    Storing the image, rendering and storing the heatmap, and the LLaMA call
+    all run at once - the LLaMA prompt uses the image's public URL, which is
+    known before the upload finishes. Only the insert waits for everything.
+    
+    With the job queue enabled, an upload or insert that hits an outage (or a
+    LLaMA call that times out) is queued for retry instead of failing the
+    request; errors a retry would not fix, like a rejected row, still fail it.
+    
+    use_llama=False skips the LLaMA call; insert=False leaves the final
+    "detection" stage returning the row for the caller to insert in bulk.
+    idempotent=True (the upload ID comes from an Idempotency-Key) upserts the
+    storage objects and the row, so a repeat run of the key overwrites what
+    an earlier, partly failed run already wrote.
+    """
+    pest_name = prediction_results["label"]
+    confidence = prediction_results["confidence"]
+    image_path = f"images/{upload_id}.jpg"
+    heatmap_path = f"heatmaps/{upload_id}.{get_heatmap_extension()}"
+    job_queue = get_job_queue()
+    # Bytes a failed upload needs to be queued with
+    staged = {}
+    
+    async def store_image(results):
+        # The original image (or its downscaled derivative)
+        staged["image"] = await run_cpu_bound(make_storage_image, image_data, image)
+        return await upload_to_storage(image_path, staged["image"], upsert=idempotent)
+    
+    async def heatmap(results):
+        return await run_cpu_bound(render_heatmap, image, image_tensor, prediction_results)
+    
+    async def store_heatmap(results):
+        if not results["heatmap"]:
+            return None
+        return await upload_to_storage(heatmap_path, results["heatmap"], upsert=idempotent)
+    
+    async def diagnosis(results):
+        # Comprehensive diagnosis from the disease descriptions
+        return generate_diagnosis_summary(pest_name, confidence, crop_name)
+    
+    async def llama(results):
+        if not use_llama:
+            return None
+        try:
+            llama_diagnosis = await request_llama_diagnosis(await get_storage_url(image_path), pest_name,
+                                                            confidence, crop_name)
+        except Exception as e:
+            if job_queue is not None and is_transient_error(e):
+                # Ollama is down or overloaded - the fallback queues the enrichment
+                raise
+            print(f"LLaMA diagnosis failed, using disease descriptions: {e}")
+            return None
+        if not llama_diagnosis or "Unable to generate" in llama_diagnosis:
+            print("⚠️ LLaMA returned no diagnosis, using disease descriptions")
+            return await queue_llama(results, None) if job_queue is not None else None
+        return llama_diagnosis
+    
+    def detection_row(results):
+        return {
+            "id": upload_id,
+            "image_url": results["image_url"],
+            "heatmap_url": results["heatmap_url"],
+            "pest_name": pest_name,
+            "confidence": confidence,
+            "crop_name": crop_name,
+            "diagnosis": combine_diagnosis(results["diagnosis"], results["llama"])
+        }
+    
+    async def insert_detection(results):
+        row = detection_row(results)
+        if not insert:
+            return row
+        client = await get_supabase_client()
+        table = client.table("detections")
+        await (table.upsert(row) if idempotent else table.insert(row)).execute()
+        return row
+    
+    # Fallbacks: queue the work and carry on with what the result will be
+    
+    async def queue_upload(path, data, error):
+        if data is None:
+            raise error
+        await run_cpu_bound(job_queue.enqueue, f"storage:{path}", "storage_upload", {"path": path}, data)
+        return await get_storage_url(path)
+    
+    async def queue_image(results, error):
+        return await queue_upload(image_path, staged.get("image"), error)
+    
+    async def queue_heatmap(results, error):
+        return await queue_upload(heatmap_path, results.get("heatmap"), error)
+    
+    async def queue_llama(results, error):
+        await run_cpu_bound(job_queue.enqueue, f"llama:{upload_id}", "llama_enrichment", {
+            "id": upload_id,
+            "image_url": await get_storage_url(image_path),
+            "pest_name": pest_name,
+            "confidence": confidence,
+            "crop_name": crop_name,
+        })
+        return None
+    
+    async def queue_insert(results, error):
+        row = detection_row(results)
+        await run_cpu_bound(job_queue.enqueue, f"insert:{upload_id}", "detection_insert", {"row": row})
+        return row
+    
+    def fallback(func):
+        if job_queue is None:
+            return None
+        
+        async def queue_if_transient(results, error):
+            # A rejected upload or insert would only fail again until the job is dead
+            if not is_transient_error(error):
+                raise error
+            return await func(results, error)
+        return queue_if_transient
+    
+    return (
+        Pipeline(stats=upload_pipeline_stats, on_stage=on_stage)
+        .add("image_url", store_image, timeout=PIPELINE_STORAGE_TIMEOUT_SECONDS, fallback=fallback(queue_image))
+        .add("heatmap", heatmap, timeout=PIPELINE_HEATMAP_TIMEOUT_SECONDS, required=False)
+        .add("heatmap_url", store_heatmap, after=["heatmap"], timeout=PIPELINE_STORAGE_TIMEOUT_SECONDS,
+             required=False, fallback=fallback(queue_heatmap))
+        .add("diagnosis", diagnosis)
+        .add("llama", llama, timeout=PIPELINE_LLAMA_TIMEOUT_SECONDS, required=False,
+             fallback=fallback(queue_llama))
+        .add("detection", insert_detection, after=["image_url", "heatmap_url", "diagnosis", "llama"],
+             timeout=PIPELINE_DATABASE_TIMEOUT_SECONDS, fallback=fallback(queue_insert))
+    )
+
+
+async def run_storage_upload_job(payload: dict, data: Optional[bytes]):
+    """Queued storage upload - upserts, so a retry after a lost response is harmless"""
+    client = await get_supabase_client()
+    await client.storage.from_(STORAGE_BUCKET).upload(payload["path"], data, {"upsert": "true"})
+
+
+async def run_detection_insert_job(payload: dict, data: Optional[bytes]):
+    """Queued detections insert - upserts on the detection ID"""
+    client = await get_supabase_client()
+    await client.table("detections").upsert(payload["row"]).execute()
+
+
+async def run_llama_enrichment_job(payload: dict, data: Optional[bytes]):
+    """Queued LLaMA diagnosis - added to the stored detection once both exist"""
+    pest_name, confidence, crop_name = payload["pest_name"], payload["confidence"], payload["crop_name"]
+    llama_diagnosis = await request_llama_diagnosis(payload["image_url"], pest_name, confidence, crop_name)
+    if not llama_diagnosis or "Unable to generate" in llama_diagnosis:
+        raise RuntimeError("Ollama did not return a diagnosis")
+    
+    diagnosis = combine_diagnosis(generate_diagnosis_summary(pest_name, confidence, crop_name), llama_diagnosis)
+    client = await get_supabase_client()
+    response = await client.table("detections").update({"diagnosis": diagnosis}).eq("id", payload["id"]).execute()
+    if not response.data:
+        # The insert itself may still be queued
+        raise RuntimeError(f"Detection {payload['id']} is not stored yet")
+
+
+def register_job_handlers(job_queue: JobQueue):
+    """Handlers for the side effects build_upload_pipeline queues"""
+    job_queue.register("storage_upload", run_storage_upload_job)
+    job_queue.register("detection_insert", run_detection_insert_job)
+    job_queue.register("llama_enrichment", run_llama_enrichment_job)
+
+
+def start_enrichment(upload_id: str, image_data: bytes, image, image_tensor, prediction_results: dict,
+                     crop_name: str, response: dict, cache_key: Optional[str], idempotent: bool = False) -> dict:
+    """Run the upload pipeline in the background for a fast-path response
+    
+    Returns:
+        The response with every enriched field's state and where to follow it
+    """
+    async def enrich(entry):
+        def on_stage(name, result):
+            if name in ("image_url", "heatmap_url"):
+                entry.update(name, result)
+            elif name == "llama":
+                entry.update("diagnosis", combine_diagnosis(response["diagnosis"], result))
+            elif name == "detection":
+                entry.update("stored")
+        
+        await build_upload_pipeline(upload_id, image_data, image, image_tensor, prediction_results,
+                                    crop_name, on_stage=on_stage, idempotent=idempotent).run()
+        if cache_key is not None:
+            await run_cpu_bound(get_result_cache().set, cache_key, dict(entry.response))
+    
+    entry = enrichment_tracker.start(upload_id, response, enrich)
+    fast_response = entry.snapshot()
+    fast_response["events_url"] = f"/api/detections/{upload_id}/events"
+    return fast_response
+
+
+def format_detection(detection: dict) -> dict:
+    """Shape a detections row for mobile app compatibility"""
+    return {
+        "id": detection.get("id"),
+        "prediction": detection.get("pest_name"),
+        "confidence": detection.get("confidence"),
+        "image_url": detection.get("image_url"),
+        "heatmap_url": detection.get("heatmap_url"),
+        "diagnosis": detection.get("diagnosis"),
+        "timestamp": detection.get("created_at"),
+        "crop_name": detection.get("crop_name")
+    }
+
+
+async def fetch_detection(detection_id: str) -> Optional[dict]:
+    """Stored detection by ID, with every field marked ready, or None"""
+    client = await get_supabase_client()
+    response = await client.table("detections").select("*").eq("id", detection_id).execute()
+    if not response.data:
+        return None
+    detection = format_detection(response.data[0])
+    detection["status"] = "complete"
+    detection["fields"] = {field: READY for field in ENRICHED_FIELDS}
+    return detection
+
+
+def render_heatmap(image, image_tensor, prediction_results) -> Optional[bytes]:
+    """Render the heatmap, falling back to the simple renderer on failure"""
+    try:
+        heatmap_data = generate_heatmap(image, image_tensor, prediction_results)
+    except Exception as e:
+        print(f"Error with heatmap renderer, using simple version: {e}")
+        heatmap_data = None
+    if heatmap_data is None:
+        heatmap_data = generate_heatmap_simple(image, image_tensor, prediction_results)
+    return heatmap_data
 
 # Create router
 router = APIRouter()
@@ -28,37 +359,53 @@ router = APIRouter()
 async def get_available_crops():
     """Get list of available crops for disease detection"""
     try:
-        from .inference import CROP_LABELS
+        from .inference import get_crop_labels
+        crop_labels = get_crop_labels()
         return {
-            "crops": CROP_LABELS,
-            "total": len(CROP_LABELS)
+            "crops": crop_labels,
+            "total": len(crop_labels)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/metrics")
+async def get_metrics():
+    """Get runtime metrics for the inference pipeline"""
+    metrics = {
+        "inference_batcher": get_batching_stats(),
+        "result_cache": get_result_cache_stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "runtime": get_runtime_profile_info(),
+        "model_runtime": get_model_runtime_stats(),
+        "model_lifecycle": model_lifecycle.status(),
+        "upload_pipeline": upload_pipeline_stats.stats(),
+        "enrichment": enrichment_tracker.stats(),
+        "job_queue": await run_cpu_bound(get_job_queue_stats),
+        "idempotency": idempotency_store.stats()
+    }
+    if INFERENCE_SERVER:
+        # The model, its caches and the batcher live in the inference server
+        try:
+            status = await get_inference_client().status()
+            for key in ("inference_batcher", "embedding_cache", "runtime", "model_runtime",
+                        "model_lifecycle", "inference_server"):
+                metrics[key] = status[key]
+        except Exception as e:
+            metrics["inference_server"] = {"error": str(e)}
+    return metrics
+
+
 @router.get("/history")
 async def get_detection_history():
     """Get all detection history"""
     try:
-        response = supabase_client.table("detections").select("*").order("created_at", desc=True).execute()
+        client = await get_supabase_client()
+        response = await client.table("detections").select("*").order("created_at", desc=True).execute()
         detections = response.data
         
         # Format the response for mobile app compatibility
-        formatted_detections = []
-        for detection in detections:
-            formatted_detections.append({
-                "id": detection.get("id"),
-                "prediction": detection.get("pest_name"),
-                "confidence": detection.get("confidence"),
-                "image_url": detection.get("image_url"),
-                "heatmap_url": detection.get("heatmap_url"),
-                "diagnosis": detection.get("diagnosis"),
-                "timestamp": detection.get("created_at"),
-                "crop_name": detection.get("crop_name")
-            })
-        
-        return formatted_detections
+        return [format_detection(detection) for detection in detections]
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -66,26 +413,22 @@ async def get_detection_history():
 
 @router.get("/detections/{detection_id}")
 async def get_detection(detection_id: str):
-    """Get a specific detection by ID"""
+    """Get a specific detection by ID
+    
+    Fast-path uploads still being enriched (or finished recently) are answered
+    from the enrichment tracker, whichever worker took the upload; "fields"
+    says which of image_url, heatmap_url, diagnosis and the stored row are
+    ready yet.
+    """
     try:
-        response = supabase_client.table("detections").select("*").eq("id", detection_id).execute()
+        tracked = await enrichment_tracker.lookup(detection_id)
+        if tracked is not None:
+            return tracked[1]
         
-        if not response.data:
+        detection = await fetch_detection(detection_id)
+        if detection is None:
             raise HTTPException(status_code=404, detail="Detection not found")
-        
-        detection = response.data[0]
-        
-        # Format the response for mobile app compatibility
-        return {
-            "id": detection.get("id"),
-            "prediction": detection.get("pest_name"),
-            "confidence": detection.get("confidence"),
-            "image_url": detection.get("image_url"),
-            "heatmap_url": detection.get("heatmap_url"),
-            "diagnosis": detection.get("diagnosis"),
-            "timestamp": detection.get("created_at"),
-            "crop_name": detection.get("crop_name")
-        }
+        return detection
     
     except HTTPException:
         raise
@@ -93,99 +436,449 @@ async def get_detection(detection_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/upload")
-async def upload_image(
-    file: UploadFile = File(...),
-    crop_name: str = Form(...)
-):
-    """Upload an image for pest/disease detection"""
+@router.get("/detections/{detection_id}/events")
+async def detection_events(detection_id: str):
+    """Server-sent events with the detection's state on every change, until enrichment ends
+    
+    On the worker that took the upload the events are pushed as they happen;
+    on any other worker the shared enrichment state is polled every
+    ENRICHMENT_POLL_SECONDS.
+    """
+    entry = enrichment_tracker.get(detection_id)
+    tracked = detection = None
+    if entry is None:
+        try:
+            tracked = await enrichment_tracker.lookup(detection_id)
+            if tracked is None:
+                detection = await fetch_detection(detection_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if tracked is None and detection is None:
+            raise HTTPException(status_code=404, detail="Detection not found")
+    
+    def event(snapshot):
+        return f"event: detection\ndata: {json.dumps(snapshot)}\n\n"
+    
+    async def follow_shared_state():
+        version, snapshot = tracked
+        yield event(snapshot)
+        idle = 0.0
+        while snapshot["status"] == "enriching":
+            await asyncio.sleep(ENRICHMENT_POLL_SECONDS)
+            latest = await enrichment_tracker.lookup(detection_id)
+            if latest is None:
+                # Expired, or lost with its worker - the stored row is all there is
+                stored = await fetch_detection(detection_id)
+                if stored is not None:
+                    yield event(stored)
+                return
+            if latest[0] != version:
+                version, snapshot = latest
+                idle = 0.0
+                yield event(snapshot)
+                continue
+            idle += ENRICHMENT_POLL_SECONDS
+            if idle >= SSE_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+    
+    async def stream():
+        if tracked is not None:
+            async for message in follow_shared_state():
+                yield message
+            return
+        if entry is None:
+            yield event(detection)
+            return
+        queue = entry.subscribe()
+        try:
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line - keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event(snapshot)
+                if snapshot["status"] != "enriching":
+                    return
+        finally:
+            entry.unsubscribe(queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def process_upload(upload_id: str, image_data: bytes, crop_name: str, fast: bool,
+                         idempotent: bool = False) -> Dict[str, Any]:
+    """Run one uploaded image through inference and the upload pipeline
+    
+    idempotent=True marks an upload ID derived from an Idempotency-Key, which
+    an earlier attempt may already have written under.
+    
+    Returns:
+        The /upload response
+    """
     try:
-        # Generate a unique ID for this upload
-        upload_id = str(uuid.uuid4())
+        # Retries of the same photo and crop return the stored detection
+        image_hash, cache_key, cached_response = await lookup_cached_result(image_data, crop_name)
+        if cached_response is not None:
+            if fast:
+                # Same shape as a fast response whose enrichment already finished
+                return {
+                    **cached_response,
+                    "status": "complete",
+                    "fields": {field: READY for field in ENRICHED_FIELDS},
+                    "events_url": f"/api/detections/{cached_response['id']}/events",
+                }
+            return cached_response
         
-        # Save image locally for processing
-        image_path = await save_image_locally(file, upload_id)
+        # Decode once, at the smallest resolution any stage needs - every stage shares it
+        image = await run_cpu_bound(decode_image, image_data, get_decode_size())
         
-        # Preprocess image for model inference
-        image_tensor = preprocess_image(image_path)
+        # Preprocess image for model inference (CPU-bound - off the event loop)
+        image_tensor = await run_cpu_bound(preprocess_image, image)
         
-        # Run model inference
-        prediction_results = run_inference(image_tensor, crop_name)
+        # Run model inference (micro-batched with other concurrent uploads)
+        prediction_results = await run_inference_async(image_tensor, crop_name, image_hash)
         
         # Get the top prediction
         pest_name = prediction_results["label"]
         confidence = prediction_results["confidence"]
         
-        # Generate heatmap (optional)
-        try:
-            heatmap_path = generate_heatmap(image_path, image_tensor, prediction_results)
-        except Exception as e:
-            print(f"Error with matplotlib heatmap, using simple version: {e}")
-            heatmap_path = generate_heatmap_simple(image_path, image_tensor, prediction_results)
+        # Auto-detected (or unrecognised) crops are resolved by the model
+        crop_detected = prediction_results.get("crop_detected", False)
+        if crop_detected:
+            crop_name = prediction_results["crop_used"]
         
-        # Upload original image to Supabase Storage
-        with open(image_path, "rb") as f:
-            image_data = f.read()
+        response = {
+            "id": upload_id,
+            "prediction": pest_name,
+            "confidence": confidence,
+            "image_url": None,
+            "heatmap_url": None,
+            "diagnosis": generate_diagnosis_summary(pest_name, confidence, crop_name)
+        }
+        if crop_detected:
+            response["crop_name"] = crop_name
+            response["crop_probability"] = prediction_results["crop_probability"]
+            response["all_crops"] = prediction_results["all_crops"]
         
-        image_path_in_bucket = f"images/{upload_id}.jpg"
-        supabase_client.storage.from_(STORAGE_BUCKET).upload(
-            image_path_in_bucket,
-            image_data
-        )
+        if fast:
+            return start_enrichment(upload_id, image_data, image, image_tensor, prediction_results,
+                                    crop_name, response, cache_key, idempotent=idempotent)
         
-        # Get the public URL
-        image_url = supabase_client.storage.from_(STORAGE_BUCKET).get_public_url(image_path_in_bucket)
+        # Storage uploads, heatmap, diagnosis and LLaMA run concurrently; the insert waits for them
+        results = await build_upload_pipeline(upload_id, image_data, image, image_tensor, prediction_results,
+                                              crop_name, idempotent=idempotent).run()
+        detection = results["detection"]
+        response.update(image_url=detection["image_url"], heatmap_url=detection["heatmap_url"],
+                        diagnosis=detection["diagnosis"])
         
-        # Upload heatmap to Supabase Storage if available
-        heatmap_url = None
-        if heatmap_path:
-            with open(heatmap_path, "rb") as f:
-                heatmap_data = f.read()
-            
-            heatmap_path_in_bucket = f"heatmaps/{upload_id}.jpg"
-            supabase_client.storage.from_(STORAGE_BUCKET).upload(
-                heatmap_path_in_bucket,
-                heatmap_data
-            )
-            
-            heatmap_url = supabase_client.storage.from_(STORAGE_BUCKET).get_public_url(heatmap_path_in_bucket)
+        if cache_key is not None:
+            await run_cpu_bound(get_result_cache().set, cache_key, response)
         
-        # Generate comprehensive diagnosis using disease descriptions
-        diagnosis = generate_diagnosis_summary(pest_name, confidence, crop_name)
+        return response
+    
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/upload")
+async def upload_image(
+    response: Response,
+    file: UploadFile = File(...),
+    crop_name: str = Form(AUTO_CROP),
+    fast: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Upload an image for pest/disease detection
+    
+    Leave crop_name out (or send "auto") to let the model detect the crop; the
+    response then also carries the ranked diseases for every crop.
+    
+    With fast=true the prediction is returned as soon as inference is done;
+    the image and heatmap URLs, the LLaMA diagnosis and the stored row follow
+    in the background - poll /detections/{id} or follow its events_url.
+    
+    Send the same Idempotency-Key header on every retry of an upload: a retry
+    gets the first attempt's response (waiting for it if it is still running,
+    marked by an Idempotent-Replayed header) instead of a new detection.
+    Reusing a key for another image or crop is a 422. Keys are not scoped
+    per client, so send a fresh UUID for every new upload.
+    """
+    try:
+        # Read the upload once - every stage shares the bytes
+        image_data = await read_upload(file)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if idempotency_key is None:
+        return await process_upload(str(uuid.uuid4()), image_data, crop_name, fast)
+    
+    idempotency_key = idempotency_key.strip()
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400,
+                            detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+    image_hash = await run_cpu_bound(hash_image, image_data)
+    fingerprint = request_fingerprint(image_hash, normalize_crop_name(crop_name), fast)
+    try:
+        result, replayed = await idempotency_store.run(
+            idempotency_key, fingerprint,
+            lambda: process_upload(upload_id_for_key(idempotency_key), image_data, crop_name, fast, idempotent=True)
+        )
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInterruptedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+def resolve_batch_crops(crop_names: Optional[List[str]], count: int) -> List[str]:
+    """One crop per file: none given (auto-detect all), one for every file, or one per file"""
+    crop_names = [name.strip() or AUTO_CROP for name in (crop_names or [])]
+    if not crop_names:
+        return [AUTO_CROP] * count
+    if len(crop_names) == 1:
+        return crop_names * count
+    if len(crop_names) != count:
+        raise HTTPException(status_code=400,
+                            detail=f"Got {len(crop_names)} crop names for {count} files - send one, or one per file")
+    return crop_names
+
+
+async def insert_detections(rows: List[dict]) -> Dict[str, int]:
+    """Insert detections in one call, queueing them one by one if that hits an outage
+    
+    Returns:
+        Counts of stored, queued and failed rows
+    """
+    try:
+        client = await get_supabase_client()
+        await asyncio.wait_for(client.table("detections").insert(rows).execute(), PIPELINE_DATABASE_TIMEOUT_SECONDS)
+        return {"stored": len(rows), "queued": 0, "failed": 0}
+    except Exception as e:
+        job_queue = get_job_queue() if is_transient_error(e) else None
+        print(f"⚠️ Bulk insert of {len(rows)} detections failed{', queueing them' if job_queue else ''}: {e}")
+        if job_queue is None:
+            return {"stored": 0, "queued": 0, "failed": len(rows)}
+        for row in rows:
+            await run_cpu_bound(job_queue.enqueue, f"insert:{row['id']}", "detection_insert", {"row": row})
+        return {"stored": 0, "queued": len(rows), "failed": 0}
+
+
+async def infer_batch(images: list, crop_names: List[str], image_keys: List[str]) -> List[dict]:
+    """Predictions for decoded images in as few model calls as possible
+    
+    Locally the images go straight into one run_inference_batch call (and are
+    preprocessed into the bound input rows); with the inference server they
+    are sent individually and batched there.
+    """
+    if INFERENCE_SERVER:
+        tensors = await asyncio.gather(*(run_cpu_bound(preprocess_image, image) for image in images))
+        return list(await asyncio.gather(*(
+            run_inference_async(tensor, crop_name, key) for tensor, crop_name, key in zip(tensors, crop_names, image_keys)
+        )))
+    return await run_cpu_bound(run_inference_batch, images, crop_names, image_keys)
+
+
+async def process_batch_upload(uploads: List[tuple], emit) -> Dict[str, Any]:
+    """Run a field survey's images through decode, batched inference and storage
+    
+    Calls emit(line) once per image as soon as its result is ready, in
+    completion order. Rows are inserted in bulk - whenever BATCH_INSERT_SIZE
+    are waiting and at least every BATCH_INSERT_INTERVAL_SECONDS - so an
+    emitted id can briefly 404 on /detections/{id} until its insert lands.
+    
+    Args:
+        uploads: (filename, image bytes, crop name) per image
         
-        # Also try to get LLaMA diagnosis if available (fallback)
+    Returns:
+        Summary counts
+    """
+    summary = {"total": len(uploads), "succeeded": 0, "failed": 0, "cached": 0,
+               "stored": 0, "queued": 0, "unstored": 0}
+    rows = []
+    post_slots = asyncio.Semaphore(max(1, BATCH_UPLOAD_CONCURRENCY))
+    done = asyncio.Event()
+    
+    async def flush_rows(force: bool = False):
+        while rows and (force or len(rows) >= BATCH_INSERT_SIZE):
+            chunk = rows[:BATCH_INSERT_SIZE]
+            del rows[:BATCH_INSERT_SIZE]
+            counts = await insert_detections(chunk)
+            summary["stored"] += counts["stored"]
+            summary["queued"] += counts["queued"]
+            summary["unstored"] += counts["failed"]
+    
+    async def flush_periodically():
+        # Waits on the event rather than being cancelled, so an insert is never cut off midway
+        while not done.is_set():
+            try:
+                await asyncio.wait_for(done.wait(), BATCH_INSERT_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                await flush_rows(force=True)
+    
+    def fail(index, filename, error):
+        summary["failed"] += 1
+        emit({"index": index, "filename": filename, "error": str(error)})
+    
+    async def prepare(index):
+        """Cache lookup and decode - returns the work left for inference, if any"""
+        filename, image_data, crop_name = uploads[index]
         try:
-            llama_diagnosis = llama_prompt(image_url, pest_name, confidence, crop_name)
-            if llama_diagnosis and "Unable to generate" not in llama_diagnosis:
-                diagnosis = f"{diagnosis}\n\n**AI-Generated Additional Insights:**\n{llama_diagnosis}"
+            image_hash, cache_key, cached_response = await lookup_cached_result(image_data, crop_name)
+            if cached_response is not None:
+                summary["succeeded"] += 1
+                summary["cached"] += 1
+                emit({"index": index, "filename": filename, "cached": True, **cached_response})
+                return None
+            image = await run_cpu_bound(decode_image, image_data, get_decode_size())
+            return index, image, image_hash, cache_key
         except Exception as e:
-            print(f"LLaMA diagnosis failed, using disease descriptions: {e}")
+            fail(index, filename, e)
+            return None
+    
+    async def finish(index, image, cache_key, prediction_results):
+        """Heatmap and storage uploads for one image, then its result line"""
+        filename, image_data, crop_name = uploads[index]
+        upload_id = str(uuid.uuid4())
+        try:
+            async with post_slots:
+                crop_detected = prediction_results.get("crop_detected", False)
+                if crop_detected:
+                    crop_name = prediction_results["crop_used"]
+                results = await build_upload_pipeline(upload_id, image_data, image, None, prediction_results,
+                                                      crop_name, use_llama=False, insert=False).run()
+        except Exception as e:
+            fail(index, filename, e)
+            return
         
-        # Store results in database
-        supabase_client.table("detections").insert({
+        row = results["detection"]
+        response = {
             "id": upload_id,
-            "image_url": image_url,
-            "heatmap_url": heatmap_url,
-            "pest_name": pest_name,
-            "confidence": confidence,
-            "crop_name": crop_name,
-            "diagnosis": diagnosis
-        }).execute()
+            "prediction": row["pest_name"],
+            "confidence": row["confidence"],
+            "image_url": row["image_url"],
+            "heatmap_url": row["heatmap_url"],
+            "diagnosis": row["diagnosis"]
+        }
+        if crop_detected:
+            response["crop_name"] = crop_name
+            response["crop_probability"] = prediction_results["crop_probability"]
+            response["all_crops"] = prediction_results["all_crops"]
+        if cache_key is not None:
+            try:
+                await run_cpu_bound(get_result_cache().set, cache_key, response)
+            except Exception as e:
+                print(f"⚠️ Could not cache the result of batch image {index}: {e}")
         
-        # Clean up local files
-        os.remove(image_path)
-        if heatmap_path:
-            os.remove(heatmap_path)
+        summary["succeeded"] += 1
+        emit({"index": index, "filename": filename, **response})
+        rows.append(row)
+        await flush_rows()
+    
+    async def run_chunk(chunk):
+        indices = [item[0] for item in chunk]
+        try:
+            predictions = await infer_batch([item[1] for item in chunk],
+                                            [uploads[i][2] for i in indices],
+                                            [item[2] for item in chunk])
+        except Exception as e:
+            for i in indices:
+                fail(i, uploads[i][0], e)
+            return
+        # Each chunk's images move on to storage as soon as its model call returns
+        await asyncio.gather(*(finish(index, image, cache_key, prediction)
+                               for (index, image, _, cache_key), prediction in zip(chunk, predictions)))
+    
+    flusher = asyncio.ensure_future(flush_periodically()) if BATCH_INSERT_INTERVAL_SECONDS > 0 else None
+    try:
+        # Decode everything in parallel on the CPU pool
+        prepared = [item for item in await asyncio.gather(*(prepare(i) for i in range(len(uploads)))) if item]
         
-        # Return results
-        return {
-            "id": upload_id,
-            "prediction": pest_name,
-            "confidence": confidence,
-            "image_url": image_url,
-            "heatmap_url": heatmap_url,
-            "diagnosis": diagnosis
-        }
+        chunk_size = get_batch_settings()["max_batch_size"]
+        await asyncio.gather(*(run_chunk(prepared[start:start + chunk_size])
+                               for start in range(0, len(prepared), chunk_size)))
+    finally:
+        done.set()
+        if flusher is not None:
+            await flusher
+        await flush_rows(force=True)
+    return summary
+
+
+# Batch uploads still running after their client went away
+_detached_batches = set()
+
+
+@router.post("/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    crop_names: Optional[List[str]] = Form(None)
+):
+    """Upload a field survey's images in one request
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    Send any number of "files" parts (up to BATCH_UPLOAD_MAX_FILES) and either
+    no crop_names (auto-detect), one crop_names value for every file, or one
+    per file in the same order ("" or "auto" to auto-detect that file).
+    
+    The response is NDJSON: one line per image as soon as it is done, in
+    completion order - its "index" says which file it is, and failed images
+    carry an "error" - then a final {"summary": ...} line, or {"error": ...}
+    if the batch itself failed. Detections are stored with bulk inserts, so
+    a line's id can take up to BATCH_INSERT_INTERVAL_SECONDS to show up on
+    /detections/{id}. The LLaMA diagnosis is not requested for batches, each
+    detection gets the description-based diagnosis.
+    """
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {BATCH_UPLOAD_MAX_FILES} files per batch, got {len(files)}")
+    crops = resolve_batch_crops(crop_names, len(files))
+    # Read every part now - the upload files are closed once this handler returns
+    uploads = [(file.filename, await read_upload(file), crop) for file, crop in zip(files, crops)]
+    
+    lines = asyncio.Queue()
+    
+    async def stream():
+        runner = asyncio.ensure_future(process_batch_upload(uploads, lines.put_nowait))
+        reported = set()
+        getter = None
+        try:
+            # Lines until the runner finishes, however many there are
+            while not runner.done():
+                getter = asyncio.ensure_future(lines.get())
+                await asyncio.wait({getter, runner}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                line = getter.result()
+                reported.add(line["index"])
+                yield json.dumps(line) + "\n"
+            while not lines.empty():
+                line = lines.get_nowait()
+                reported.add(line["index"])
+                yield json.dumps(line) + "\n"
+            
+            error = runner.exception()
+            if error is None:
+                yield json.dumps({"summary": runner.result()}) + "\n"
+                return
+            print(f"❌ Batch upload failed: {error}")
+            for index, (filename, _, _) in enumerate(uploads):
+                if index not in reported:
+                    yield json.dumps({"index": index, "filename": filename, "error": str(error)}) + "\n"
+            yield json.dumps({"error": str(error)}) + "\n"
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not runner.done():
+                # Client disconnected - finish storing what was started
+                _detached_batches.add(runner)
+                runner.add_done_callback(_detached_batches.discard)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
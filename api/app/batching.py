@@ -0,0 +1,290 @@
+"""
+Dynamic micro-batching for model inference
+
+Concurrent uploads each submit their preprocessed image to a shared queue.
+Scheduler threads collect requests until either the batch is full or the
+oldest request has waited long enough, then run them through the model in
+one ONNX call and hand every caller its own per-crop result. With several
+sessions (or run slots) in the model runtime, one scheduler thread per slot
+keeps them all busy.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import (
+    INFERENCE_BATCHING,
+    INFERENCE_BATCH_MAX_SIZE,
+    INFERENCE_BATCH_MAX_WAIT_MS,
+    INFERENCE_QUEUE_MAX_SIZE,
+    INFERENCE_BATCH_WORKERS,
+    INFERENCE_SESSION_POOL_SIZE,
+    INFERENCE_MAX_CONCURRENT_RUNS,
+    INFERENCE_SERVER,
+)
+
+
+class InferenceQueueFullError(RuntimeError):
+    """Raised when the inference queue cannot accept more requests"""
+
+
+class _BatchItem:
+    __slots__ = ("image_tensor", "crop_name", "image_key", "future", "enqueued_at")
+
+    def __init__(self, image_tensor, crop_name: Optional[str], image_key: Optional[str] = None):
+        self.image_tensor = image_tensor
+        self.crop_name = crop_name
+        self.image_key = image_key
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+def _resolve(future: Future, result: Any = None, error: Optional[BaseException] = None):
+    """Hand one caller its result - a future that is already settled is left alone"""
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except Exception as e:
+        print(f"⚠️ Could not deliver an inference result: {e}")
+
+
+class InferenceBatcher:
+    """Collects concurrent inference requests and runs them as one batch"""
+
+    def __init__(self,
+                 run_batch: Optional[Callable[..., List[Dict[str, Any]]]] = None,
+                 max_batch_size: int = INFERENCE_BATCH_MAX_SIZE,
+                 max_wait_ms: float = INFERENCE_BATCH_MAX_WAIT_MS,
+                 max_queue_size: int = INFERENCE_QUEUE_MAX_SIZE,
+                 workers: int = INFERENCE_BATCH_WORKERS):
+        if run_batch is None:
+            from .inference import run_inference_batch
+            run_batch = run_inference_batch
+
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.workers = int(workers) or max(INFERENCE_SESSION_POOL_SIZE, INFERENCE_MAX_CONCURRENT_RUNS, 1)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        # Metrics
+        self._batches_run = 0
+        self._requests_processed = 0
+        self._requests_failed = 0
+        self._max_batch_seen = 0
+        self._batch_size_counts = {}
+        self._total_queue_wait = 0.0
+        self._total_batch_time = 0.0
+
+    def start(self):
+        """Start the scheduler threads if they are not already running"""
+        with self._lock:
+            if self._threads and all(thread.is_alive() for thread in self._threads):
+                return
+            self._stopping = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._loop, name=f"inference-batcher-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the scheduler threads after the queued requests are processed"""
+        with self._lock:
+            threads = self._threads
+            if not threads:
+                return
+            self._stopping = True
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, image_tensor, crop_name: Optional[str] = None, image_key: Optional[str] = None) -> Future:
+        """Queue an image for inference
+
+        Args:
+            image_tensor: Preprocessed image tensor ready for model input
+            crop_name: Name of the crop (optional)
+            image_key: Content hash of the image for the embedding cache (optional)
+
+        Returns:
+            Future resolving to the prediction results for this image
+        """
+        self.start()
+        item = _BatchItem(image_tensor, crop_name, image_key)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            raise InferenceQueueFullError(
+                f"Inference queue is full ({self._queue.maxsize} pending requests)"
+            )
+        return item.future
+
+    def infer(self, image_tensor, crop_name: Optional[str] = None, timeout: Optional[float] = None,
+              image_key: Optional[str] = None) -> Dict[str, Any]:
+        """Blocking helper: submit an image and wait for its result"""
+        return self.submit(image_tensor, crop_name, image_key).result(timeout)
+
+    async def infer_async(self, image_tensor, crop_name: Optional[str] = None,
+                          image_key: Optional[str] = None) -> Dict[str, Any]:
+        """Awaitable helper for use inside request handlers"""
+        return await asyncio.wrap_future(self.submit(image_tensor, crop_name, image_key))
+
+    def _collect(self, first: _BatchItem) -> List[_BatchItem]:
+        """Gather more requests until the batch is full or the wait window closes"""
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    # Window closed - still take whatever is already waiting
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                # Stop sentinel - put it back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                if self._stopping:
+                    return
+                continue
+
+            # Callers cancelled while queued (timeout, client gone) drop out;
+            # the rest can no longer be cancelled once marked running
+            batch = [item for item in self._collect(first) if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.monotonic()
+
+            try:
+                results = self._run_batch(
+                    [item.image_tensor for item in batch],
+                    [item.crop_name for item in batch],
+                    [item.image_key for item in batch]
+                )
+                for item, result in zip(batch, results):
+                    _resolve(item.future, result=result)
+                failed = 0
+            except Exception as e:
+                print(f"❌ Batched inference failed for {len(batch)} requests: {e}")
+                for item in batch:
+                    _resolve(item.future, error=e)
+                failed = len(batch)
+
+            finished = time.monotonic()
+            with self._lock:
+                size = len(batch)
+                self._batches_run += 1
+                self._requests_processed += size
+                self._requests_failed += failed
+                self._max_batch_seen = max(self._max_batch_seen, size)
+                self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+                self._total_queue_wait += sum(started - item.enqueued_at for item in batch)
+                self._total_batch_time += finished - started
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and batch-size metrics"""
+        with self._lock:
+            batches = self._batches_run
+            processed = self._requests_processed
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "workers": self.workers,
+                "batches_run": batches,
+                "requests_processed": processed,
+                "requests_failed": self._requests_failed,
+                "avg_batch_size": processed / batches if batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "batch_size_counts": {str(k): v for k, v in sorted(self._batch_size_counts.items())},
+                "avg_queue_wait_ms": (self._total_queue_wait / processed * 1000.0) if processed else 0.0,
+                "avg_batch_time_ms": (self._total_batch_time / batches * 1000.0) if batches else 0.0,
+            }
+
+
+def get_batch_settings() -> Dict[str, Any]:
+    """Batch size and wait window from config, overridden by the runtime profile file"""
+    from .runtime_profile import load_profile_section
+
+    settings = {"max_batch_size": INFERENCE_BATCH_MAX_SIZE, "max_wait_ms": INFERENCE_BATCH_MAX_WAIT_MS}
+    overrides = load_profile_section("batching")
+    settings.update({key: overrides[key] for key in settings if key in overrides})
+    return settings
+
+
+# Shared batcher - lazily created on first use
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> InferenceBatcher:
+    """Get or create the process-wide inference batcher"""
+    global _batcher
+
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = InferenceBatcher(**get_batch_settings())
+    return _batcher
+
+
+async def run_inference_async(image_tensor, crop_name: Optional[str] = None,
+                              image_key: Optional[str] = None) -> Dict[str, Any]:
+    """Run inference without blocking the event loop
+
+    Images whose backbone outputs are cached (by image_key) are re-classified
+    directly. Other requests go through the shared micro-batcher when batching
+    is enabled; otherwise the single-image path runs on the CPU worker pool.
+    With INFERENCE_SERVER, all of that happens in the inference server.
+    """
+    if INFERENCE_SERVER:
+        from .inference_server import get_inference_client
+        return await get_inference_client().infer(image_tensor, crop_name, image_key)
+
+    from .inference import classify_cached, run_inference
+
+    cached = classify_cached(image_key, [crop_name])
+    if cached is not None:
+        return cached[0]
+
+    if INFERENCE_BATCHING:
+        return await get_batcher().infer_async(image_tensor, crop_name, image_key)
+
+    from .executor import run_cpu_bound
+    return await run_cpu_bound(run_inference, image_tensor, crop_name, image_key)
+
+
+def get_batching_stats() -> Dict[str, Any]:
+    """Batcher metrics, or a disabled marker when batching is off"""
+    if not INFERENCE_BATCHING:
+        return {"enabled": False}
+    stats = get_batcher().stats()
+    stats["enabled"] = True
+    return stats
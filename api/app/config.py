@@ -24,6 +24,128 @@ APP_DIR = Path(__file__).parent
 MODEL_PATH = os.getenv("MODEL_PATH", str(BASE_DIR / "models" / "mobilenet.onnx"))
 MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "160"))
 
+# Preprocessing backend: "numpy" (torch-free, default) or "torchvision" (reference)
+PREPROCESS_BACKEND = os.getenv("PREPROCESS_BACKEND", "numpy").lower()
+
+# Reduced-resolution decoding: let the JPEG decoder scale down (DCT scaling)
+# to the smallest size any stage needs instead of decoding every pixel
+JPEG_DRAFT_DECODE = os.getenv("JPEG_DRAFT_DECODE", "true").lower() in ("1", "true", "yes")
+HEATMAP_IMAGE_SIZE = int(os.getenv("HEATMAP_IMAGE_SIZE", "224"))
+# Heatmap encoding: "jpeg" or "webp"
+HEATMAP_FORMAT = os.getenv("HEATMAP_FORMAT", "jpeg").lower()
+# Longest side of the image copy kept in storage (0 keeps the original upload bytes)
+STORED_IMAGE_MAX_SIDE = int(os.getenv("STORED_IMAGE_MAX_SIDE", "0"))
+
+# Inference batching configuration
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "true").lower() in ("1", "true", "yes")
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "8"))
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv("INFERENCE_BATCH_MAX_WAIT_MS", "5"))
+INFERENCE_QUEUE_MAX_SIZE = int(os.getenv("INFERENCE_QUEUE_MAX_SIZE", "256"))
+
+# Inference sessions kept per model and how many runs may execute at once
+# (0 = one per session; above the pool size the sessions are shared, which is
+# safe because InferenceSession.run is thread-safe)
+INFERENCE_SESSION_POOL_SIZE = int(os.getenv("INFERENCE_SESSION_POOL_SIZE", "1"))
+INFERENCE_MAX_CONCURRENT_RUNS = int(os.getenv("INFERENCE_MAX_CONCURRENT_RUNS", "0"))
+# Batcher threads dispatching batches (0 = one per run slot)
+INFERENCE_BATCH_WORKERS = int(os.getenv("INFERENCE_BATCH_WORKERS", "0"))
+# Run through ORT IOBinding on preallocated per-slot input/output buffers
+INFERENCE_IO_BINDING = os.getenv("INFERENCE_IO_BINDING", "true").lower() in ("1", "true", "yes")
+
+# Model lifecycle: warm-up before /ready reports ready, and hot reload of new model files
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+# Comma-separated batch sizes to warm (empty = 1 and INFERENCE_BATCH_MAX_SIZE)
+MODEL_WARMUP_BATCH_SIZES = [int(size) for size in os.getenv("MODEL_WARMUP_BATCH_SIZES", "").split(",") if size.strip()]
+# Seconds between checks for new model files (0 disables hot reload)
+MODEL_WATCH_INTERVAL_SECONDS = float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS", "30"))
+
+# Server worker processes. With more than one, run.py uses the pre-fork server
+# (prefork.py): the model bundle and tables are loaded once and shared by
+# forked workers, and ORT intra-op threads are split between them
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+SERVER_PREFORK = os.getenv("SERVER_PREFORK", "true").lower() in ("1", "true", "yes")
+
+# Standalone inference server (inference_server.py): one process owns the model,
+# session pool and batcher; API workers send it preprocessed tensors over a Unix
+# socket (shared memory for the tensor). run.py starts it when enabled
+INFERENCE_SERVER = os.getenv("INFERENCE_SERVER", "false").lower() in ("1", "true", "yes")
+INFERENCE_SERVER_SOCKET = os.getenv("INFERENCE_SERVER_SOCKET", "/tmp/crop-disease-inference.sock")
+# Connections (= requests in flight) per API worker
+INFERENCE_SERVER_CONNECTIONS = int(os.getenv("INFERENCE_SERVER_CONNECTIONS", "16"))
+INFERENCE_SERVER_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_SERVER_TIMEOUT_SECONDS", "30"))
+# How long a worker trusts the server's model version before asking again
+# (a hot reload in the server changes it)
+INFERENCE_SERVER_VERSION_TTL_SECONDS = float(os.getenv("INFERENCE_SERVER_VERSION_TTL_SECONDS", "5"))
+
+# Worker pool for CPU-bound request stages (decode, preprocess, heatmap)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Model version used in cache keys (defaults to a checksum of the model file)
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+
+# Result cache for repeat uploads (keyed by image hash + crop + model version)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+# Optional on-disk tier (empty disables it)
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+
+# Idempotency-Key handling for /api/upload: completed responses kept per key
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "4096"))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Optional on-disk store shared by the workers on a host (empty disables it)
+IDEMPOTENCY_DIR = os.getenv("IDEMPOTENCY_DIR", "")
+
+# Per-crop head weights written by the converter (used for class activation maps
+# and, together with the backbone graph, for the split backbone + heads mode)
+HEAD_WEIGHTS_PATH = os.getenv("HEAD_WEIGHTS_PATH", str(BASE_DIR / "models" / "crop_heads.npz"))
+BACKBONE_MODEL_PATH = os.getenv("BACKBONE_MODEL_PATH", str(BASE_DIR / "models" / "backbone.onnx"))
+# Model precision variant: "fp32" (default) or e.g. "int8" to load <model>_int8.onnx
+# written by scripts/quantize_multicrop_onnx.py (falls back to fp32 if missing)
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "fp32").lower()
+
+# Export variant that takes crop_id as an input and does the crop routing,
+# softmax and top-k inside the graph (preferred when present)
+ROUTED_MODEL_PATH = os.getenv("ROUTED_MODEL_PATH", str(BASE_DIR / "models" / "mobilenet_routed.onnx"))
+
+# Single-file model bundle (graph, labels, crop tables and head weights) written
+# by the converter; memory-mapped and preferred over the loose files (see MODEL_BUNDLE)
+MODEL_BUNDLE_PATH = os.getenv("MODEL_BUNDLE_PATH", str(BASE_DIR / "models" / "model_bundle.zip"))
+# auto: use the bundle unless a loose model file is newer; true / false: always / never
+MODEL_BUNDLE = os.getenv("MODEL_BUNDLE", "auto").lower()
+if MODEL_BUNDLE in ("1", "true", "yes"):
+    MODEL_BUNDLE = "true"
+elif MODEL_BUNDLE in ("0", "false", "no"):
+    MODEL_BUNDLE = "false"
+
+# ONNX Runtime session profile (0 / empty keeps the ONNX Runtime default)
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+# "sequential" or "parallel"
+ORT_EXECUTION_MODE = os.getenv("ORT_EXECUTION_MODE", "sequential").lower()
+# "disabled", "basic", "extended" or "all"
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION", "all").lower()
+ORT_ENABLE_CPU_MEM_ARENA = os.getenv("ORT_ENABLE_CPU_MEM_ARENA", "true").lower() in ("1", "true", "yes")
+ORT_ENABLE_MEM_PATTERN = os.getenv("ORT_ENABLE_MEM_PATTERN", "true").lower() in ("1", "true", "yes")
+# Busy-wait between ops; turning it off helps on shared or oversubscribed cores
+ORT_ALLOW_SPINNING = os.getenv("ORT_ALLOW_SPINNING", "true").lower() in ("1", "true", "yes")
+# Comma-separated execution providers (empty uses every available provider)
+ORT_PROVIDERS = [p.strip() for p in os.getenv("ORT_PROVIDERS", "").split(",") if p.strip()]
+# Optional JSON file whose keys override the settings above (see runtime_profile.py);
+# profiles from scripts/autotune_runtime.py also carry batching and worker settings
+RUNTIME_PROFILE_PATH = os.getenv("RUNTIME_PROFILE_PATH", "")
+# Where optimized graphs are kept between boots (empty disables the cache)
+ORT_OPTIMIZED_CACHE_DIR = os.getenv("ORT_OPTIMIZED_CACHE_DIR", str(BASE_DIR / "models" / ".ort_cache"))
+# "onnx" or "ort" (ONNX Runtime's flatbuffer format, fastest to load)
+ORT_OPTIMIZED_FORMAT = os.getenv("ORT_OPTIMIZED_FORMAT", "onnx").lower()
+
+# Ranked diseases returned per crop when the crop is auto-detected
+ALL_CROPS_TOP_K = int(os.getenv("ALL_CROPS_TOP_K", "3"))
+
+# Per-image backbone outputs kept so a crop change skips the forward pass
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "256"))
+
 # Class and crop map paths
 CLASS_MAP_PATH = BASE_DIR / "models" / "class_map.json"
 DISEASE_CLASS_MAP_PATH = BASE_DIR / "models" / "disease_class_map.json"
@@ -41,10 +163,55 @@ STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "crop-images")
 # Ollama configuration
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+
+# Per-stage timeouts of the post-inference upload pipeline, in seconds (0 = no limit).
+# Storage and the database insert are required; a slow heatmap or LLM answer is dropped
+PIPELINE_STORAGE_TIMEOUT_SECONDS = float(os.getenv("PIPELINE_STORAGE_TIMEOUT_SECONDS", "15"))
+PIPELINE_HEATMAP_TIMEOUT_SECONDS = float(os.getenv("PIPELINE_HEATMAP_TIMEOUT_SECONDS", "10"))
+PIPELINE_LLAMA_TIMEOUT_SECONDS = float(os.getenv("PIPELINE_LLAMA_TIMEOUT_SECONDS", "20"))
+PIPELINE_DATABASE_TIMEOUT_SECONDS = float(os.getenv("PIPELINE_DATABASE_TIMEOUT_SECONDS", "10"))
+
+# Fast uploads (fast=true) answer after inference and enrich in the background;
+# their progress is kept in memory this long after they finish
+ENRICHMENT_RETENTION_SECONDS = float(os.getenv("ENRICHMENT_RETENTION_SECONDS", "600"))
+ENRICHMENT_MAX_TRACKED = int(os.getenv("ENRICHMENT_MAX_TRACKED", "1024"))
+# Seconds running enrichments get to finish on shutdown
+ENRICHMENT_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("ENRICHMENT_SHUTDOWN_TIMEOUT_SECONDS", "30"))
+# /api/upload/batch: files per request, images uploading to storage at once, rows per bulk insert
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "200"))
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "8"))
+BATCH_INSERT_SIZE = int(os.getenv("BATCH_INSERT_SIZE", "50"))
+# Longest a finished batch image waits for its bulk insert (0 = only by count and at the end)
+BATCH_INSERT_INTERVAL_SECONDS = float(os.getenv("BATCH_INSERT_INTERVAL_SECONDS", "2"))
+# Idle seconds between keep-alive comments on /detections/{id}/events
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
 
 # Storage configuration
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", str(BASE_DIR.parent / "temp"))
 
+# Fast-upload progress shared by the workers on a host, so /detections/{id} and
+# its event stream work whichever worker a poll lands on
+ENRICHMENT_SHARED_STATE = os.getenv("ENRICHMENT_SHARED_STATE", "true").lower() in ("1", "true", "yes")
+ENRICHMENT_STATE_PATH = os.getenv("ENRICHMENT_STATE_PATH", os.path.join(UPLOAD_DIR, "enrichment.sqlite3"))
+# How often an event stream on another worker checks the shared state
+ENRICHMENT_POLL_SECONDS = float(os.getenv("ENRICHMENT_POLL_SECONDS", "0.5"))
+
+# Durable queue for storage uploads, detection inserts and LLaMA enrichment that
+# failed inline - retried with exponential backoff, drained on startup
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(UPLOAD_DIR, "jobs.sqlite3"))
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "10"))
+JOB_QUEUE_BASE_DELAY_SECONDS = float(os.getenv("JOB_QUEUE_BASE_DELAY_SECONDS", "2"))
+JOB_QUEUE_MAX_DELAY_SECONDS = float(os.getenv("JOB_QUEUE_MAX_DELAY_SECONDS", "600"))
+JOB_QUEUE_POLL_SECONDS = float(os.getenv("JOB_QUEUE_POLL_SECONDS", "1"))
+# A claimed job whose worker died is picked up again after this long
+JOB_QUEUE_LEASE_SECONDS = float(os.getenv("JOB_QUEUE_LEASE_SECONDS", "300"))
+# Longest a job handler may run (capped below the lease so it cannot expire mid-run)
+JOB_QUEUE_HANDLER_TIMEOUT_SECONDS = float(os.getenv("JOB_QUEUE_HANDLER_TIMEOUT_SECONDS", "120"))
+# Finished jobs are remembered this long so the same work is not queued twice
+JOB_QUEUE_RETENTION_SECONDS = float(os.getenv("JOB_QUEUE_RETENTION_SECONDS", "86400"))
+
 # CORS configuration
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
@@ -66,7 +233,7 @@ def validate_config() -> List[str]:
             model_found = True
             break
     
-    if not model_found:
+    if not model_found and not os.path.exists(MODEL_BUNDLE_PATH):
         errors.append("Model file not found in any expected location")
     
     # Check if class map exists (try multiple locations)
@@ -0,0 +1,77 @@
+"""
+Per-image cache of backbone outputs
+
+The model is one shared MobileNetV3 backbone plus small per-crop heads. When
+the same photo comes back with a different crop (or several crops are asked
+for at once) only the head has to change, so we keep each image's 576-d
+embedding (or, for the fused graph, its concatenated logits) and final
+feature map, keyed by the image content hash. Re-classifying is then a
+single matmul instead of a full forward pass.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .config import EMBEDDING_CACHE_MAX_ENTRIES
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of per-image backbone outputs"""
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.max_entries = max(0, int(max_entries))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # Bumped by clear() so outputs computed by a replaced model are dropped
+        self.generation = 0
+
+    def get(self, image_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Cached outputs for an image hash, or None"""
+        if image_key is None or self.max_entries == 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(image_key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(image_key)
+            self._hits += 1
+            return entry
+
+    def set(self, image_key: Optional[str], entry: Dict[str, Any], generation: Optional[int] = None):
+        """Store outputs (arrays must not alias reused buffers)
+        
+        Pass the generation read before running the model; if the cache was
+        cleared in the meantime (model swapped) the entry is discarded.
+        """
+        if image_key is None or self.max_entries == 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[image_key] = entry
+            self._entries.move_to_end(image_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,314 @@
+"""
+Background enrichment of fast-path detections
+
+With a fast upload the client gets the prediction as soon as inference is
+done. The storage uploads, heatmap, LLaMA diagnosis and the detections
+insert then run as a background task. The tracker keeps each detection's
+partial state in memory so /api/detections/{id} can report which fields are
+ready, and pushes every change to event-stream subscribers.
+
+Finished detections stay in the tracker for ENRICHMENT_RETENTION_SECONDS so
+late pollers see the final state without a database round trip; after that
+the detections table is the only source.
+
+With several workers (WEB_CONCURRENCY > 1) a poll or event stream can land
+on a worker that did not handle the upload. Every snapshot is therefore
+also written to a small SQLite table that all workers on the host read;
+other workers answer from it and follow its changes by polling.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import (
+    ENRICHMENT_MAX_TRACKED,
+    ENRICHMENT_RETENTION_SECONDS,
+    ENRICHMENT_SHARED_STATE,
+    ENRICHMENT_STATE_PATH,
+)
+from .executor import run_cpu_bound
+
+# Fields filled in by the background pipeline, in the order they usually arrive
+ENRICHED_FIELDS = ("image_url", "heatmap_url", "diagnosis", "stored")
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Enrichment:
+    """Partial state of one detection while its background stages run"""
+
+    def __init__(self, detection_id: str, response: Dict[str, Any]):
+        self.id = detection_id
+        self.response = dict(response)
+        self.fields = {field: PENDING for field in ENRICHED_FIELDS}
+        self.error = None
+        self.finished_at = None
+        # Bumped on every change, so readers of the shared store can tell snapshots apart
+        self.version = 0
+        self._subscribers: List[asyncio.Queue] = []
+        self._on_change: Optional[Callable[["Enrichment", Dict[str, Any]], None]] = None
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return "failed"
+        return "complete" if self.finished_at is not None else "enriching"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The detection as a client should see it right now"""
+        snapshot = dict(self.response)
+        snapshot["status"] = self.status
+        snapshot["fields"] = dict(self.fields)
+        if self.error is not None:
+            snapshot["error"] = self.error
+        return snapshot
+
+    def _publish(self):
+        self.version += 1
+        snapshot = self.snapshot()
+        for queue in self._subscribers:
+            queue.put_nowait(snapshot)
+        if self._on_change is not None:
+            self._on_change(self, snapshot)
+
+    def update(self, field: str, value: Any = None, status: str = READY):
+        """Set one enriched field and notify subscribers"""
+        if field in self.response:
+            self.response[field] = value
+        self.fields[field] = status
+        self._publish()
+
+    def finish(self, error: Optional[str] = None):
+        """Mark the enrichment done; on failure the fields still pending are marked failed"""
+        self.error = error
+        if error is not None:
+            self.fields = {field: FAILED if state == PENDING else state for field, state in self.fields.items()}
+        self.finished_at = time.monotonic()
+        self._publish()
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue receiving a snapshot on every change, starting with the current one"""
+        queue = asyncio.Queue()
+        queue.put_nowait(self.snapshot())
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrichments (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    snapshot TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# How many writes between sweeps of expired rows
+_PRUNE_INTERVAL = 100
+
+
+class EnrichmentStore:
+    """Latest snapshot of each tracked detection, shared by the workers on a host
+
+    One short-lived SQLite connection per operation, like the job queue, so
+    it is safe to call from the CPU pool threads.
+    """
+
+    def __init__(self, path: str = ENRICHMENT_STATE_PATH,
+                 retention_seconds: float = ENRICHMENT_RETENTION_SECONDS):
+        self.path = str(path)
+        self.retention_seconds = float(retention_seconds)
+        self._writes_since_prune = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+        finally:
+            db.close()
+
+    def put(self, detection_id: str, version: int, snapshot: Dict[str, Any]):
+        """Store a snapshot unless a newer one is already there (writes can land out of order)"""
+        now = time.time()
+        with self._lock:
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= _PRUNE_INTERVAL
+            if prune:
+                self._writes_since_prune = 0
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO enrichments (id, version, snapshot, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET version = excluded.version, snapshot = excluded.snapshot, "
+                "updated_at = excluded.updated_at WHERE excluded.version > enrichments.version",
+                (detection_id, int(version), json.dumps(snapshot, default=str), now),
+            )
+            if prune:
+                db.execute("DELETE FROM enrichments WHERE updated_at < ?", (now - self.retention_seconds,))
+
+    def get(self, detection_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """(version, snapshot), or None if unknown or not updated within the retention period
+
+        An enrichment that stopped updating that long ago finished long ago
+        or died with its worker - the detections table has the rest.
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT version, snapshot, updated_at FROM enrichments WHERE id = ?",
+                             (detection_id,)).fetchone()
+        if row is None or row[2] < time.time() - self.retention_seconds:
+            return None
+        return row[0], json.loads(row[1])
+
+
+class EnrichmentTracker:
+    """In-flight and recently finished fast-path detections, plus their background tasks
+
+    Only touched from the event loop, so it needs no locking.
+    """
+
+    def __init__(self,
+                 retention_seconds: float = ENRICHMENT_RETENTION_SECONDS,
+                 max_tracked: int = ENRICHMENT_MAX_TRACKED,
+                 store: Optional[EnrichmentStore] = None):
+        self.retention_seconds = float(retention_seconds)
+        self.max_tracked = max(1, int(max_tracked))
+        # Shared with the other workers (None = this process only)
+        self.store = store
+        self._entries: "OrderedDict[str, Enrichment]" = OrderedDict()
+        self._tasks = set()
+        self._writes = set()
+
+        # Metrics
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _prune(self):
+        now = time.monotonic()
+        for detection_id, entry in list(self._entries.items()):
+            expired = entry.finished_at is not None and now - entry.finished_at > self.retention_seconds
+            if expired or (len(self._entries) > self.max_tracked and entry.finished_at is not None):
+                del self._entries[detection_id]
+
+    def get(self, detection_id: str) -> Optional[Enrichment]:
+        """This worker's entry for a detection, if it handled the upload"""
+        self._prune()
+        return self._entries.get(detection_id)
+
+    async def lookup(self, detection_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """(version, snapshot) of a detection tracked by this or another worker, or None"""
+        entry = self.get(detection_id)
+        if entry is not None:
+            return entry.version, entry.snapshot()
+        if self.store is None:
+            return None
+        return await run_cpu_bound(self.store.get, detection_id)
+
+    def _share(self, entry: Enrichment, snapshot: Dict[str, Any]):
+        if self.store is None:
+            return
+        write = asyncio.ensure_future(run_cpu_bound(self.store.put, entry.id, entry.version, snapshot))
+        self._writes.add(write)
+        write.add_done_callback(self._shared)
+
+    def _shared(self, write: asyncio.Future):
+        self._writes.discard(write)
+        if not write.cancelled() and write.exception() is not None:
+            print(f"⚠️ Could not share enrichment state with the other workers: {write.exception()}")
+
+    def start(self, detection_id: str, response: Dict[str, Any],
+              work: Callable[[Enrichment], Awaitable[Any]]) -> Enrichment:
+        """Track a detection and run its enrichment in the background
+
+        Args:
+            detection_id: Detection / upload ID
+            response: Fields already known (prediction, confidence, ...)
+            work: Coroutine function filling in the fields through entry.update()
+        """
+        self._prune()
+        entry = Enrichment(detection_id, response)
+        entry._on_change = self._share
+        self._entries[detection_id] = entry
+        self._started += 1
+        self._share(entry, entry.snapshot())
+
+        async def run():
+            try:
+                await work(entry)
+            except asyncio.CancelledError:
+                entry.finish("Enrichment cancelled on shutdown")
+                raise
+            except Exception as e:
+                print(f"❌ Enrichment of detection {detection_id} failed: {e}")
+                self._failed += 1
+                entry.finish(str(e))
+            else:
+                self._completed += 1
+                entry.finish()
+
+        task = asyncio.ensure_future(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return entry
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait for running enrichments, cancelling whatever is left after the timeout"""
+        tasks = list(self._tasks)
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        # The final states, so other workers do not see these stuck as enriching
+        if self._writes:
+            await asyncio.gather(*list(self._writes), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._tasks),
+            "tracked": len(self._entries),
+            "shared": self.store is not None,
+            "started": self._started,
+            "completed": self._completed,
+            "failed": self._failed,
+        }
+
+
+# Shared tracker for the API process - its store is attached on startup (see get_enrichment_store)
+enrichment_tracker = EnrichmentTracker()
+
+_enrichment_store = None
+_enrichment_store_lock = threading.Lock()
+
+
+def get_enrichment_store() -> Optional[EnrichmentStore]:
+    """Get or create the host-wide enrichment store (None when ENRICHMENT_SHARED_STATE is off)"""
+    global _enrichment_store
+
+    if not ENRICHMENT_SHARED_STATE:
+        return None
+    if _enrichment_store is None:
+        with _enrichment_store_lock:
+            if _enrichment_store is None:
+                _enrichment_store = EnrichmentStore()
+    return _enrichment_store
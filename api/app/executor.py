@@ -0,0 +1,45 @@
+"""
+Bounded worker pool for CPU-bound request stages
+
+Image decoding, preprocessing and heatmap rendering release the GIL for most
+of their work (PIL, NumPy), so running them on a small thread pool keeps the
+event loop free for other requests while capping how many run at once.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from .config import CPU_WORKERS
+
+_cpu_pool = None
+_cpu_pool_lock = threading.Lock()
+
+
+def get_cpu_pool() -> ThreadPoolExecutor:
+    """Get or create the shared CPU worker pool"""
+    global _cpu_pool
+
+    if _cpu_pool is None:
+        with _cpu_pool_lock:
+            if _cpu_pool is None:
+                _cpu_pool = ThreadPoolExecutor(max_workers=max(1, CPU_WORKERS), thread_name_prefix="cpu-worker")
+    return _cpu_pool
+
+
+async def run_cpu_bound(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function on the CPU worker pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_cpu_pool():
+    """Stop the CPU worker pool (called on application shutdown)"""
+    global _cpu_pool
+
+    with _cpu_pool_lock:
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False)
+            _cpu_pool = None
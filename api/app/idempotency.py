@@ -0,0 +1,161 @@
+"""
+Idempotency keys for uploads
+
+A mobile client that loses the response to an upload retries it, and
+without a key every retry is a new detection: another pipeline run, more
+storage objects and another row. A client that sends the same
+Idempotency-Key header on every attempt instead gets:
+
+- the stored response, if an earlier attempt finished
+- the first attempt's result, if it is still running (the retry waits for
+  it rather than running the pipeline a second time)
+
+The upload ID is derived from the key, so even attempts that do run twice
+(e.g. on two workers at once) write the same storage paths and row.
+
+Completed responses live in a ResultCache, optionally with its on-disk tier
+so workers on one host share them. In-flight attempts are only known to the
+worker running them. Failed attempts are not stored - the next retry runs
+again, upserting over whatever the failed attempt already wrote.
+
+Keys are global: there is no client identity to scope them by, so clients
+must send unique keys (a fresh UUID per upload), not counters like "1" that
+another client might also use.
+"""
+
+import asyncio
+import hashlib
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .config import (
+    IDEMPOTENCY_MAX_ENTRIES,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_DIR,
+)
+from .executor import run_cpu_bound
+from .result_cache import ResultCache
+
+# Longest key accepted (clients normally send a UUID)
+MAX_KEY_LENGTH = 255
+
+# Namespace for upload IDs derived from idempotency keys
+_UPLOAD_ID_NAMESPACE = uuid.UUID("0f6f1b0e-5c37-4d8a-9a52-6c0e1d3b7a41")
+
+
+class IdempotencyConflictError(ValueError):
+    """Raised when a key is reused for a different request"""
+
+
+class IdempotencyInterruptedError(RuntimeError):
+    """Raised to waiters when the attempt they were waiting for was cancelled"""
+
+
+def upload_id_for_key(key: str) -> str:
+    """Stable upload ID for an idempotency key"""
+    return str(uuid.uuid5(_UPLOAD_ID_NAMESPACE, key))
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash of the request fields a key must always be sent with"""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def _store_key(key: str) -> str:
+    # Keys come from clients - hash them before they become file names
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """In-flight and completed requests by idempotency key
+
+    The in-flight map is only touched from the event loop, so it needs no
+    locking; the completed store is a thread-safe ResultCache.
+    """
+
+    def __init__(self,
+                 max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+                 ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+                 disk_dir: Optional[str] = None):
+        # Bounded by entry count; responses are small, so the byte limit is generous
+        self.completed = ResultCache(max_entries=max_entries, max_bytes=max(1, max_entries) * 64 * 1024,
+                                     ttl_seconds=ttl_seconds, disk_dir=disk_dir)
+        self._in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+        # Metrics
+        self._executed = 0
+        self._replayed = 0
+        self._joined = 0
+        self._conflicts = 0
+
+    def _check(self, key: str, fingerprint: str, stored_fingerprint: str):
+        if fingerprint != stored_fingerprint:
+            self._conflicts += 1
+            raise IdempotencyConflictError(f"Idempotency key '{key}' was already used for a different request")
+
+    async def run(self, key: str, fingerprint: str,
+                  func: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """Run func once per key and hand its response to every attempt
+
+        Args:
+            key: Client-supplied idempotency key
+            fingerprint: request_fingerprint() of the attempt's payload
+            func: Coroutine function producing the response
+
+        Returns:
+            (response, replayed) - replayed is True when func did not run for this attempt
+
+        Raises:
+            IdempotencyConflictError: If the key was used with another payload
+        """
+        store_key = _store_key(key)
+
+        record = await run_cpu_bound(self.completed.get, store_key)
+        if record is not None:
+            self._check(key, fingerprint, record["fingerprint"])
+            self._replayed += 1
+            return record["response"], True
+
+        in_flight = self._in_flight.get(store_key)
+        if in_flight is not None:
+            self._check(key, fingerprint, in_flight[0])
+            self._joined += 1
+            # Shielded so a waiter that disconnects does not cancel the first attempt
+            return await asyncio.shield(in_flight[1]), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[store_key] = (fingerprint, future)
+        self._executed += 1
+        try:
+            response = await func()
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception)
+                                 else IdempotencyInterruptedError("The original request was interrupted, retry it"))
+            # Mark the error as retrieved - there may be no waiters
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+            try:
+                await run_cpu_bound(self.completed.set, store_key, {"fingerprint": fingerprint, "response": response})
+            except Exception as e:
+                # The upload itself succeeded - a later retry just runs again
+                print(f"⚠️ Could not store the response for idempotency key '{key}': {e}")
+            return response, False
+        finally:
+            del self._in_flight[store_key]
+
+    def stats(self) -> Dict[str, Any]:
+        completed = self.completed.stats()
+        return {
+            "in_flight": len(self._in_flight),
+            "stored": completed["entries"],
+            "executed": self._executed,
+            "replayed": self._replayed,
+            "joined": self._joined,
+            "conflicts": self._conflicts,
+        }
+
+
+# Shared store for the API process
+idempotency_store = IdempotencyStore(disk_dir=IDEMPOTENCY_DIR or None)
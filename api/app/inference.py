@@ -1,14 +1,31 @@
 import os
+import hashlib
+import threading
 import numpy as np
-import onnxruntime as ort
 import json
-from typing import Dict, Any, List
-from .config import get_model_paths, get_class_map_paths, get_crop_map_paths
+from typing import Dict, Any, List, Optional
+from PIL import Image
+from .config import get_model_paths, get_class_map_paths, get_crop_map_paths, MODEL_VERSION, BACKBONE_MODEL_PATH, ROUTED_MODEL_PATH, HEAD_WEIGHTS_PATH, ALL_CROPS_TOP_K, MODEL_VARIANT
+from .embedding_cache import embedding_cache
+from .model_runtime import ModelRuntime
+from .model_bundle import build_crop_segments, get_model_bundle, set_model_bundle, variant_path
+from .utils.cam import compute_crop_cam, load_head_weights, clear_head_weights
+from .utils.image_utils import preprocess_image
 
-# Global model session - lazy loaded
-_model_session = None
+# Global model runtime (session pool) - lazy loaded
+_model_runtime = None
+_model_runtime_lock = threading.Lock()
 _crop_to_global_classes = None
 _preprocess_config = None
+_model_version = None
+_fused_heads = None
+_crop_segments = None
+_class_labels = None
+_crop_labels = None
+_warned_missing_heads = False
+
+# Crop name that asks the model to detect the crop itself
+AUTO_CROP = "auto"
 
 # Path to the ONNX model - use centralized config
 def get_model_path():
@@ -29,12 +46,139 @@ def get_model_path():
     
     raise FileNotFoundError("Model file not found in any expected location")
 
+def is_split_model() -> bool:
+    """True when the export ships a backbone-only graph plus a head-weights file
+    
+    In split mode the ONNX call stops at the 576-d embedding and the per-crop
+    heads are applied in NumPy, so cached embeddings can be re-classified for
+    any crop without another forward pass.
+    """
+    return os.path.exists(BACKBONE_MODEL_PATH) and bool(load_head_weights())
+
+
+def get_model_layout() -> str:
+    """Which exported graph load_model() runs
+    
+    "routed": takes crop_id and returns probabilities / top-k per image
+    "split": backbone only, crop heads applied in NumPy
+    "fused": all crop heads concatenated (original export)
+    """
+    bundle = get_model_bundle()
+    if bundle is not None:
+        return bundle.layout
+    return get_loose_model_layout()
+
+
+def get_loose_model_layout() -> str:
+    """Layout of the unbundled model files"""
+    global _warned_missing_heads
+    
+    if os.path.exists(ROUTED_MODEL_PATH):
+        has_fused_model = any(path and os.path.exists(path) for path in get_model_paths())
+        if load_head_weights() or not has_fused_model:
+            return "routed"
+        # Auto-detect and cached re-classification need the heads - the fused graph carries its own
+        if not _warned_missing_heads:
+            _warned_missing_heads = True
+            print(f"⚠️ {ROUTED_MODEL_PATH} has no crop head weights at {HEAD_WEIGHTS_PATH}, using the fused model")
+    if is_split_model():
+        return "split"
+    return "fused"
+
+
+def check_head_weights(bundle=None):
+    """Fail at model load, not on the first request that needs them, when the heads are missing
+    
+    The split graph stops at the embedding and the routed graph only applies
+    the requested crop's head, so both need the stacked heads to auto-detect
+    the crop and to re-classify cached embeddings.
+    
+    Args:
+        bundle: Bundle about to be loaded, or None for the loose model files
+    
+    Raises:
+        FileNotFoundError: If the layout needs head weights and there are none
+    """
+    layout = bundle.layout if bundle is not None else get_loose_model_layout()
+    if layout == "fused":
+        return
+    if bundle is not None and bundle.fused_heads() is not None:
+        return
+    if os.path.exists(HEAD_WEIGHTS_PATH):
+        return
+    source = bundle.path if bundle is not None else (ROUTED_MODEL_PATH if layout == "routed" else BACKBONE_MODEL_PATH)
+    raise FileNotFoundError(f"The {layout} model {source} needs the crop head weights the converter writes "
+                            f"next to it ({HEAD_WEIGHTS_PATH}) - re-run the converter or deploy the file")
+
+
+def get_variant_path(path: str, variant: str = None) -> str:
+    """Path of a precision variant of a model file (mobilenet.onnx -> mobilenet_int8.onnx)"""
+    return variant_path(path, variant or MODEL_VARIANT)
+
+
+def get_active_model_path() -> str:
+    """Path of the ONNX graph that load_model() runs"""
+    bundle = get_model_bundle()
+    if bundle is not None:
+        return bundle.describe(MODEL_VARIANT)
+    return get_loose_model_path()
+
+
+def get_loose_model_path() -> str:
+    """Path of the ONNX graph among the unbundled model files
+    
+    Ignores the active bundle, so a hot reload can move from the bundle to
+    loose files that replaced it.
+    """
+    layout = get_loose_model_layout()
+    if layout == "routed":
+        path = ROUTED_MODEL_PATH
+    elif layout == "split":
+        path = BACKBONE_MODEL_PATH
+    else:
+        path = get_model_path()
+    
+    variant_path = get_variant_path(path)
+    if variant_path != path and not os.path.exists(variant_path):
+        print(f"⚠️ Model variant '{MODEL_VARIANT}' not found at {variant_path}, using {path}")
+        return path
+    return variant_path
+
+
+def get_model_version() -> str:
+    """Identify the deployed model - MODEL_VERSION if set, else a checksum of the model files"""
+    global _model_version
+    
+    if _model_version is None:
+        bundle = get_model_bundle()
+        if MODEL_VERSION:
+            _model_version = MODEL_VERSION
+        elif bundle is not None:
+            # Precision variants share the bundle but must not share cached results
+            member = bundle.model_member(MODEL_VARIANT)
+            _model_version = bundle.model_version if member == "model.onnx" else f"{bundle.model_version}-{MODEL_VARIANT}"
+        else:
+            paths = [get_active_model_path()]
+            if get_model_layout() != "fused" and os.path.exists(HEAD_WEIGHTS_PATH):
+                paths.append(HEAD_WEIGHTS_PATH)
+            digest = hashlib.sha256()
+            for path in paths:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+            _model_version = digest.hexdigest()[:16]
+    return _model_version
+
 # Load crop to global classes mapping
 def load_crop_to_global_classes():
     """Load the crop to global classes mapping from the trained model checkpoint"""
     global _crop_to_global_classes
     
     if _crop_to_global_classes is None:
+        bundle = get_model_bundle()
+        if bundle is not None:
+            _crop_to_global_classes = bundle.labels["crop_to_global_classes"]
+            return _crop_to_global_classes
         try:
             # First try to load from the JSON file created during conversion
             json_path = os.path.join(os.path.dirname(__file__), "..", "models", "crop_to_global_classes.json")
@@ -79,6 +223,10 @@ def load_preprocess_config():
     global _preprocess_config
     
     if _preprocess_config is None:
+        bundle = get_model_bundle()
+        if bundle is not None:
+            _preprocess_config = bundle.labels["preprocess"]
+            return _preprocess_config
         try:
             # First try to load from the JSON file created during conversion
             json_path = os.path.join(os.path.dirname(__file__), "..", "models", "preprocess_config.json")
@@ -121,6 +269,9 @@ def load_preprocess_config():
 # Load class labels from disease_class_map.json
 def load_class_labels():
     """Load disease class labels from disease_class_map.json"""
+    bundle = get_model_bundle()
+    if bundle is not None:
+        return list(bundle.labels["class_labels"])
     try:
         # First try to load the new disease class map
         disease_class_map_path = os.path.join(os.path.dirname(__file__), "..", "models", "disease_class_map.json")
@@ -168,6 +319,9 @@ def load_class_labels():
 # Load crop labels - you'll need to create this based on your training
 def load_crop_labels():
     """Load crop labels - update this based on your actual training crops"""
+    bundle = get_model_bundle()
+    if bundle is not None:
+        return list(bundle.labels["crop_labels"])
     try:
         # Use centralized config paths
         possible_paths = get_crop_map_paths()
@@ -189,158 +343,587 @@ def load_crop_labels():
         # Fallback crops
         return ["rice", "maize", "chickpea", "kidneybeans", "pigeonpeas", "mothbeans", "mungbean", "blackgram", "lentil", "pomegranate"]
 
-CLASS_LABELS = load_class_labels()
-CROP_LABELS = load_crop_labels()
+def get_class_labels() -> List[str]:
+    """Class labels of the active model (loaded on first use)"""
+    global _class_labels
+    if _class_labels is None:
+        _class_labels = load_class_labels()
+    return _class_labels
+
+def get_crop_labels() -> List[str]:
+    """Crop labels of the active model (loaded on first use)"""
+    global _crop_labels
+    if _crop_labels is None:
+        _crop_labels = load_crop_labels()
+    return _crop_labels
+
+def __getattr__(name):
+    # The label tables come from the model bundle - load them on first use
+    # rather than at import, so importing this module maps nothing
+    if name == "CLASS_LABELS":
+        return get_class_labels()
+    if name == "CROP_LABELS":
+        return get_crop_labels()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_crop_id(crop_name: str) -> int:
     """Get crop ID from crop name"""
     try:
-        return CROP_LABELS.index(crop_name.lower())
+        return get_crop_labels().index(crop_name.strip().lower())
     except ValueError:
         print(f"⚠️ Crop '{crop_name}' not found in crop labels, using default (0)")
         return 0
 
-def load_model():
-    """Load the ONNX model (lazy loading)"""
-    global _model_session
+def is_known_crop(crop_name: Optional[str]) -> bool:
+    """True if the name matches one of the model's crops"""
+    return bool(crop_name) and crop_name.strip().lower() in get_crop_labels()
+
+def get_model_runtime() -> ModelRuntime:
+    """The process-wide model runtime (sessions are created on first use)"""
+    global _model_runtime
     
-    if _model_session is None:
+    if _model_runtime is None:
+        with _model_runtime_lock:
+            if _model_runtime is None:
+                bundle = get_model_bundle()
+                if bundle is not None:
+                    _model_runtime = ModelRuntime(bundle.describe(MODEL_VARIANT), bundle=bundle,
+                                                  session_factory=bundle.session_factory(MODEL_VARIANT))
+                else:
+                    # Get the correct model path (backbone graph in split mode)
+                    _model_runtime = ModelRuntime(get_active_model_path())
+    return _model_runtime
+
+
+def load_model() -> ModelRuntime:
+    """Load the ONNX model (lazy loading, at most once even under concurrent first requests)"""
+    runtime = get_model_runtime()
+    if not runtime.loaded:
         try:
-            # Get the correct model path
-            model_path = get_model_path()
-            
-            print(f"✅ Loading model from: {model_path}")
-            _model_session = ort.InferenceSession(model_path)
+            print(f"✅ Loading model from: {runtime.model_path}")
+            check_head_weights(getattr(runtime, "bundle", None))
+            runtime.load()
             print("✅ Model loaded successfully")
         except Exception as e:
             print(f"❌ Error loading model: {e}")
             raise
     
-    return _model_session
+    return runtime
 
 
-def run_inference(image_tensor, crop_name: str = None) -> Dict[str, Any]:
-    """Run inference on the preprocessed image tensor with crop information
+def swap_model_runtime(runtime: ModelRuntime):
+    """Atomically make a (loaded) runtime the active one
+    
+    Requests that already hold the old runtime finish on it; everything
+    derived from the previous model (version, labels, crop tables, head
+    weights, cached embeddings) is reset so it is rebuilt from the new files
+    or the runtime's bundle.
+    """
+    global _model_runtime, _model_version, _fused_heads, _crop_segments
+    global _crop_to_global_classes, _preprocess_config, _class_labels, _crop_labels
+    from .utils.image_utils import clear_preprocessor
+    
+    with _model_runtime_lock:
+        set_model_bundle(getattr(runtime, "bundle", None))
+        _model_runtime = runtime
+        _model_version = None
+        _fused_heads = None
+        _crop_segments = None
+        _crop_to_global_classes = None
+        _preprocess_config = None
+        _class_labels = None
+        _crop_labels = None
+        clear_head_weights()
+        clear_preprocessor()
+        embedding_cache.clear()
+
+
+def get_model_runtime_stats() -> Dict[str, Any]:
+    """Session pool metrics, or a not-loaded marker before the first request"""
+    if _model_runtime is None:
+        return {"loaded": False}
+    return _model_runtime.stats()
+
+
+def get_input_name(session) -> str:
+    """Pick the image input name exposed by the ONNX graph"""
+    input_names = [input.name for input in session.get_inputs()]
+    
+    if 'image' in input_names:
+        # New model with image input only
+        return 'image'
+    elif 'input' in input_names:
+        # Legacy model with single input
+        return 'input'
+    
+    # Fallback - try first input name
+    return input_names[0]
+
+
+def to_model_input(image_tensor) -> np.ndarray:
+    """Convert a preprocessed image tensor to a single CHW float32 array
     
     Args:
-        image_tensor: Preprocessed image tensor ready for model input
+        image_tensor: Preprocessed image (torch tensor or numpy array, with or without batch dim),
+                      or a decoded PIL Image still to be preprocessed
+        
+    Returns:
+        Contiguous float32 array of shape (3, H, W)
+    """
+    if isinstance(image_tensor, Image.Image):
+        return preprocess_image(image_tensor)
+    
+    # Convert tensor to numpy array if it's not already
+    if hasattr(image_tensor, 'numpy'):
+        image_np = image_tensor.numpy()
+    else:
+        image_np = np.asarray(image_tensor)
+    
+    # Drop the batch dimension if the caller already added one
+    if len(image_np.shape) == 4:
+        image_np = image_np[0]
+    
+    return np.ascontiguousarray(image_np, dtype=np.float32)
+
+
+def write_model_input(image_tensor, out: np.ndarray) -> np.ndarray:
+    """Write one image into a preallocated (3, H, W) row of the model input
+    
+    Decoded PIL Images are preprocessed straight into the row; tensors are
+    copied in without an intermediate array.
+    """
+    if isinstance(image_tensor, Image.Image):
+        return preprocess_image(image_tensor, out=out)
+    
+    if hasattr(image_tensor, 'numpy'):
+        image_tensor = image_tensor.numpy()
+    image_np = np.asarray(image_tensor)
+    if len(image_np.shape) == 4:
+        image_np = image_np[0]
+    np.copyto(out, image_np, casting="same_kind")
+    return out
+
+
+def postprocess_logits(all_logits: np.ndarray, crop_name: str = None, feature_map: np.ndarray = None) -> Dict[str, Any]:
+    """Turn one row of concatenated logits into the crop-specific prediction
+    
+    Args:
+        all_logits: Concatenated logits for every crop head, shape (total_classes,)
         crop_name: Name of the crop (optional, will use default if not provided)
+        feature_map: Final backbone feature map for this image, shape (576, h, w),
+                     if the model exports it - used for the class activation map
         
     Returns:
         Dictionary containing prediction results
     """
-    try:
-        # Load the model (lazy loading - only loads on first request)
-        session = load_model()
-        
-        # Load crop to global classes mapping
-        crop_to_global_classes = load_crop_to_global_classes()
-        
-        # Get input names
-        input_names = [input.name for input in session.get_inputs()]
-        print(f"Model input names: {input_names}")
-        
-        # Convert tensor to numpy array if it's not already
-        if hasattr(image_tensor, 'numpy'):
-            image_np = image_tensor.numpy()
-        else:
-            image_np = image_tensor
-            
-        # Ensure the input has the right shape (add batch dimension if needed)
-        if len(image_np.shape) == 3:
-            image_np = np.expand_dims(image_np, axis=0)
-        
-        # Get crop ID
-        crop_id = get_crop_id(crop_name) if crop_name else 0
+    # Load crop to global classes mapping
+    crop_to_global_classes = load_crop_to_global_classes()
+    
+    # Get crop ID
+    crop_id = get_crop_id(crop_name) if crop_name else 0
+    
+    # Extract crop-specific logits
+    crop_id_str = str(crop_id)
+    if crop_id_str in crop_to_global_classes:
+        # Get the crop-specific class indices
+        crop_class_indices = crop_to_global_classes[crop_id_str]
         
-        # Prepare inputs for the model
-        inputs = {}
-        if 'image' in input_names:
-            # New model with image input only
-            inputs = {'image': image_np}
-        elif 'input' in input_names:
-            # Legacy model with single input
-            inputs = {'input': image_np}
+        # Where this crop's logits start in the concatenated output
+        start_idx = get_crop_segments()["offsets"][crop_id_str]
+        end_idx = start_idx + len(crop_class_indices)
+        scores = all_logits[start_idx:end_idx]
+    else:
+        # Fallback - use first few classes
+        print(f"⚠️ Crop ID {crop_id} not found in mapping, using first classes")
+        scores = all_logits[:15]  # Assume 15 classes per crop
+    
+    # Apply softmax to convert logits to probabilities
+    exp_scores = np.exp(scores - np.max(scores))  # Subtract max for numerical stability
+    probabilities = exp_scores / np.sum(exp_scores)
+    
+    # Get the index of the highest probability (local class index for this crop)
+    local_class_idx = np.argmax(probabilities)
+    
+    # Get the confidence score (probability is already between 0-1)
+    confidence = float(probabilities[local_class_idx])
+    
+    # Ensure confidence is within valid range (0-1)
+    confidence = max(0.0, min(1.0, confidence))
+    
+    # Map local class index to global class index
+    if crop_id_str in crop_to_global_classes:
+        global_class_idx = crop_to_global_classes[crop_id_str][local_class_idx]
+    else:
+        # Fallback - use local index directly
+        global_class_idx = local_class_idx
+        print(f"⚠️ Crop ID {crop_id} not found in mapping, using local index")
+    
+    # Get the class label using global class index
+    class_labels = get_class_labels()
+    if global_class_idx < len(class_labels):
+        label = class_labels[global_class_idx]
+    else:
+        # Fallback - use local index
+        label = f"class_{local_class_idx}"
+        print(f"⚠️ Global class index {global_class_idx} out of range, using fallback")
+    
+    # Debug information
+    print(f"🎯 Crop used: {crop_name or 'default'} (ID: {crop_id})")
+    print(f"🎯 Local class index: {local_class_idx}")
+    print(f"🎯 Global class index: {global_class_idx}")
+    print(f"🎯 Raw scores: {scores[local_class_idx]:.4f}")
+    print(f"🎯 Probability: {probabilities[local_class_idx]:.4f}")
+    print(f"🎯 Confidence: {confidence:.4f} ({confidence*100:.2f}%)")
+    
+    # Return the results
+    results = {
+        "label": label,
+        "confidence": confidence,
+        "class_index": int(global_class_idx),
+        "local_class_index": int(local_class_idx),
+        "raw_scores": scores.tolist(),
+        "probabilities": probabilities.tolist(),
+        "crop_used": crop_name or "default",
+        "crop_id": int(crop_id)
+    }
+    
+    # Class activation map for the predicted class, from the same forward pass
+    if feature_map is not None:
+        cam = compute_crop_cam(feature_map, crop_id_str, int(local_class_idx))
+        if cam is not None:
+            results["cam"] = cam
+    
+    return results
+
+
+def get_crop_segments() -> Dict[str, np.ndarray]:
+    """Precomputed layout of the concatenated logits, one segment per crop head
+    
+    Returns:
+        crop_ids: crop ID of each segment, in concatenation (string-sorted) order
+        starts: offset of each segment in the logits vector
+        offsets: crop ID string -> offset of its segment
+        global_classes: global class index of every logit
+        table: (num_crops, max_classes) logit indices per crop, padded with -1
+    """
+    global _crop_segments
+    
+    if _crop_segments is None:
+        bundle = get_model_bundle()
+        if bundle is not None:
+            # Precomputed by the converter, read straight from the mapped bundle
+            _crop_segments = bundle.crop_segments()
         else:
-            # Fallback - try first input name
-            inputs = {input_names[0]: image_np}
-        
-        # Run inference
-        outputs = session.run(None, inputs)
-        
-        # Process the output - now we get all concatenated logits
-        all_logits = outputs[0][0]  # Shape: (total_classes,)
+            _crop_segments = build_crop_segments(load_crop_to_global_classes())
+    return _crop_segments
+
+
+def segment_softmax(all_logits: np.ndarray):
+    """Softmax within every crop segment of the concatenated logits at once
+    
+    Returns:
+        (probabilities with the same shape as all_logits, per-crop log-sum-exp)
+    """
+    starts = get_crop_segments()["starts"]
+    logits = np.asarray(all_logits, dtype=np.float32)
+    
+    seg_max = np.maximum.reduceat(logits, starts, axis=-1)
+    lengths = np.diff(np.append(starts, logits.shape[-1]))
+    exp = np.exp(logits - np.repeat(seg_max, lengths, axis=-1))
+    seg_sum = np.add.reduceat(exp, starts, axis=-1)
+    probabilities = exp / np.repeat(seg_sum, lengths, axis=-1)
+    return probabilities, seg_max + np.log(seg_sum)
+
+
+def rank_crops(all_logits: np.ndarray, top_k: int = ALL_CROPS_TOP_K) -> List[Dict[str, Any]]:
+    """Top-k diseases for every crop plus how likely each crop is, from one logits row
+    
+    The heads are trained independently, so crops are ranked by each head's
+    log-sum-exp (its "energy") - heads that see their own crop tend to
+    produce larger logits overall - normalised with a softmax across crops.
+    
+    Returns:
+        One entry per crop, most likely crop first
+    """
+    segments = get_crop_segments()
+    table = segments["table"]
+    probabilities, crop_energy = segment_softmax(all_logits)
+    
+    crop_probabilities = np.exp(crop_energy - crop_energy.max())
+    crop_probabilities /= crop_probabilities.sum()
+    
+    # Top-k within each crop in one sort over the padded (crops, classes) table
+    padded = np.where(table >= 0, probabilities[np.maximum(table, 0)], -1.0)
+    top_k = max(1, min(int(top_k), table.shape[1]))
+    top_local = np.argsort(-padded, axis=1, kind="stable")[:, :top_k]
+    
+    class_labels, crop_labels = get_class_labels(), get_crop_labels()
+    ranked = []
+    for row in np.argsort(-crop_probabilities, kind="stable"):
+        crop_id = int(segments["crop_ids"][row])
+        predictions = []
+        for local_idx in top_local[row]:
+            flat_idx = table[row, local_idx]
+            if flat_idx < 0:
+                continue
+            global_idx = int(segments["global_classes"][flat_idx])
+            predictions.append({
+                "label": class_labels[global_idx] if global_idx < len(class_labels) else f"class_{local_idx}",
+                "class_index": global_idx,
+                "local_class_index": int(local_idx),
+                "probability": float(probabilities[flat_idx]),
+            })
+        ranked.append({
+            "crop_name": crop_labels[crop_id] if crop_id < len(crop_labels) else str(crop_id),
+            "crop_id": crop_id,
+            "crop_probability": float(crop_probabilities[row]),
+            "predictions": predictions,
+        })
+    return ranked
+
+
+def get_fused_heads():
+    """All crop heads stacked into one (total_classes, 576) matrix plus bias
+    
+    Heads are stacked in the same (string-sorted) crop order the fused ONNX
+    graph concatenates them in, so embedding @ W.T + b reproduces its logits.
+    """
+    global _fused_heads
+    
+    if _fused_heads is None:
+        bundle = get_model_bundle()
+        if bundle is not None and bundle.fused_heads() is not None:
+            _fused_heads = bundle.fused_heads()
+            return _fused_heads
+        heads = load_head_weights()
+        if not heads:
+            raise FileNotFoundError(f"Crop head weights not found at {HEAD_WEIGHTS_PATH} - "
+                                    f"the {get_model_layout()} model needs them to score every crop")
+        crop_ids = sorted(heads.keys())
+        weight = np.ascontiguousarray(np.concatenate([heads[cid][0] for cid in crop_ids], axis=0))
+        bias = np.concatenate([heads[cid][1] for cid in crop_ids], axis=0)
+        _fused_heads = (weight, bias)
+    return _fused_heads
+
+
+def classify_entry(entry: Dict[str, Any], crop_name: Optional[str] = None) -> Dict[str, Any]:
+    """Prediction for one crop from an image's cached backbone outputs
+    
+    A crop name of "auto" (or one the model does not know) detects the crop:
+    the prediction is made for the most likely crop and the ranked top-k
+    diseases of every crop are attached under "all_crops".
+    
+    Args:
+        entry: {"embedding": (576,)} from the backbone graph or {"logits": (total_classes,)}
+               from the fused graph, plus optional "features" for CAM
+        crop_name: Name of the crop (optional)
+    """
+    if "logits" in entry:
+        all_logits = entry["logits"]
+    else:
+        weight, bias = get_fused_heads()
+        all_logits = weight @ entry["embedding"] + bias
+    
+    if crop_name is None or is_known_crop(crop_name) or not load_crop_to_global_classes():
+        return postprocess_logits(all_logits, crop_name, entry.get("features"))
+    
+    all_crops = rank_crops(all_logits)
+    detected = all_crops[0]["crop_name"]
+    results = postprocess_logits(all_logits, detected, entry.get("features"))
+    results["crop_requested"] = crop_name
+    results["crop_detected"] = True
+    results["crop_probability"] = all_crops[0]["crop_probability"]
+    results["all_crops"] = all_crops
+    return results
+
+
+def classify_cached(image_key: Optional[str], crop_names: List[Optional[str]]) -> Optional[List[Dict[str, Any]]]:
+    """Re-classify a previously seen image for one or more crops without running the model
+    
+    Returns:
+        One result per crop name, or None if the image's outputs are not cached
+    """
+    entry = embedding_cache.get(image_key)
+    if entry is None:
+        return None
+    return [classify_entry(entry, crop_name) for crop_name in crop_names]
+
+
+def postprocess_routed(outputs: Dict[str, np.ndarray], row: int, crop_name: Optional[str], crop_id: int,
+                       feature_map: np.ndarray = None) -> Dict[str, Any]:
+    """Build the prediction for one image from the routed graph's outputs
+    
+    The graph already gathered the crop's head, applied softmax and picked the
+    top-k local and global class ids, so this is just a dictionary lookup.
+    """
+    num_classes = len(load_crop_to_global_classes().get(str(crop_id), ())) or outputs["probabilities"].shape[1]
+    probabilities = outputs["probabilities"][row, :num_classes]
+    local_class_idx = int(outputs["topk_indices"][row, 0])
+    global_class_idx = int(outputs["topk_class_ids"][row, 0])
+    
+    class_labels = get_class_labels()
+    top_k = []
+    for local_idx, global_idx, probability in zip(outputs["topk_indices"][row],
+                                                  outputs["topk_class_ids"][row],
+                                                  outputs["topk_probabilities"][row]):
+        top_k.append({
+            "label": class_labels[global_idx] if global_idx < len(class_labels) else f"class_{local_idx}",
+            "class_index": int(global_idx),
+            "local_class_index": int(local_idx),
+            "probability": float(probability),
+        })
+    
+    results = {
+        "label": top_k[0]["label"],
+        "confidence": max(0.0, min(1.0, top_k[0]["probability"])),
+        "class_index": global_class_idx,
+        "local_class_index": local_class_idx,
+        "raw_scores": outputs["logits"][row, :num_classes].tolist(),
+        "probabilities": probabilities.tolist(),
+        "crop_used": crop_name or "default",
+        "crop_id": int(crop_id),
+        "top_k": top_k
+    }
+    print(f"🎯 Crop used: {results['crop_used']} (ID: {crop_id}), class {global_class_idx} ({results['confidence']:.4f})")
+    
+    if feature_map is not None:
+        cam = compute_crop_cam(feature_map, str(crop_id), local_class_idx)
+        if cam is not None:
+            results["cam"] = cam
+    
+    return results
+
+
+def get_crop_feeds(session, crop_names: List[Optional[str]]):
+    """crop_id input for the routed graph, and which rows it routes itself
+    
+    Returns:
+        (crop ids, routed flag per row), or (None, None) if the graph takes no crop_id
+    """
+    if "crop_id" not in [model_input.name for model_input in session.get_inputs()]:
+        return None, None
+    # Auto-detect rows are ranked from the embedding below - any id will do here
+    routed = [crop_name is None or is_known_crop(crop_name) for crop_name in crop_names]
+    crop_ids = np.array([
+        get_crop_id(crop_name) if routed[j] and crop_name else 0
+        for j, crop_name in enumerate(crop_names)
+    ], dtype=np.int64)
+    return crop_ids, routed
+
+
+def postprocess_batch(outputs: Dict[str, np.ndarray], crop_names: List[Optional[str]],
+                      image_keys: List[Optional[str]], crop_ids: Optional[np.ndarray],
+                      routed: Optional[List[bool]], generation: int) -> List[Dict[str, Any]]:
+    """Predictions for every row of one ONNX call, caching each image's backbone outputs
+    
+    The outputs may be views of buffers the next run overwrites: the
+    predictions never reference them, and rows are copied before they are
+    stored in the embedding cache.
+    """
+    # Newer exports also return the final feature map for class activation maps
+    features = outputs.get("features")  # Shape: (batch_size, 576, h, w)
+    
+    if "embedding" in outputs:
+        # Split or routed export - backbone embedding, heads applied in NumPy
+        name = "embedding"
+    else:
+        # Fused export - we get all concatenated logits per image
+        name = "logits" if "logits" in outputs else next(iter(outputs))  # Shape: (batch_size, total_classes)
+    
+    results = []
+    for j, crop_name in enumerate(crop_names):
+        row = {"embedding" if name == "embedding" else "logits": outputs[name][j]}
+        if features is not None:
+            row["features"] = features[j]
+        if image_keys[j] is not None and embedding_cache.max_entries:
+            embedding_cache.set(image_keys[j], {key: value.copy() for key, value in row.items()}, generation)
         
-        # Extract crop-specific logits
-        crop_id_str = str(crop_id)
-        if crop_id_str in crop_to_global_classes:
-            # Get the crop-specific class indices
-            crop_class_indices = crop_to_global_classes[crop_id_str]
-            
-            # Calculate the start and end indices for this crop's logits
-            # We need to find where this crop's logits start in the concatenated output
-            start_idx = 0
-            for cid in sorted(crop_to_global_classes.keys()):
-                if cid == crop_id_str:
-                    break
-                start_idx += len(crop_to_global_classes[cid])
-            
-            end_idx = start_idx + len(crop_class_indices)
-            scores = all_logits[start_idx:end_idx]
+        if "topk_class_ids" in outputs and routed[j]:
+            results.append(postprocess_routed(outputs, j, crop_name, int(crop_ids[j]), row.get("features")))
         else:
-            # Fallback - use first few classes
-            print(f"⚠️ Crop ID {crop_id} not found in mapping, using first classes")
-            scores = all_logits[:15]  # Assume 15 classes per crop
-        
-        # Apply softmax to convert logits to probabilities
-        exp_scores = np.exp(scores - np.max(scores))  # Subtract max for numerical stability
-        probabilities = exp_scores / np.sum(exp_scores)
-        
-        # Get the index of the highest probability (local class index for this crop)
-        local_class_idx = np.argmax(probabilities)
-        
-        # Get the confidence score (probability is already between 0-1)
-        confidence = float(probabilities[local_class_idx])
-        
-        # Ensure confidence is within valid range (0-1)
-        confidence = max(0.0, min(1.0, confidence))
+            results.append(classify_entry(row, crop_name))
+    return results
+
+
+def run_inference_batch(image_tensors: List[Any], crop_names: List[Optional[str]],
+                        image_keys: Optional[List[Optional[str]]] = None) -> List[Dict[str, Any]]:
+    """Run a single ONNX call over several preprocessed images
+    
+    The exported graph has a dynamic batch axis, so images are stacked into one
+    (N, 3, H, W) input and each output row is post-processed for its own crop.
+    With the routed export each row's crop_id is fed to the graph, which does
+    the routing and softmax itself, so one call can mix crops freely.
+    Images whose backbone outputs are already cached (by image_keys) skip the
+    ONNX call entirely.
+    
+    On the model runtime the images are written into the run slot's bound
+    input buffer (decoded PIL Images are preprocessed straight into it) and
+    the outputs are post-processed in place before the slot is released.
+    
+    Args:
+        image_tensors: Preprocessed image tensors (or decoded PIL Images), one per request
+        crop_names: Crop name for each image (None uses the default crop)
+        image_keys: Optional content hash per image for the embedding cache
         
-        # Map local class index to global class index
-        if crop_id_str in crop_to_global_classes:
-            global_class_idx = crop_to_global_classes[crop_id_str][local_class_idx]
-        else:
-            # Fallback - use local index directly
-            global_class_idx = local_class_idx
-            print(f"⚠️ Crop ID {crop_id} not found in mapping, using local index")
+    Returns:
+        List of prediction result dictionaries, in the same order as the inputs
+    """
+    if image_keys is None:
+        image_keys = [None] * len(image_tensors)
+    
+    results = [None] * len(image_tensors)
+    generation = embedding_cache.generation
+    entries = [embedding_cache.get(key) for key in image_keys]
+    pending = [i for i, entry in enumerate(entries) if entry is None]
+    
+    if pending:
+        # Load the model (lazy loading - only loads on first request)
+        session = load_model()
+        input_name = get_input_name(session)
+        pending_crops = [crop_names[i] for i in pending]
+        pending_keys = [image_keys[i] for i in pending]
+        crop_ids, routed = get_crop_feeds(session, pending_crops)
         
-        # Get the class label using global class index
-        if global_class_idx < len(CLASS_LABELS):
-            label = CLASS_LABELS[global_class_idx]
+        if hasattr(session, "bind"):
+            with session.bind(len(pending)) as batch:
+                rows = batch.inputs[input_name]
+                for j, i in enumerate(pending):
+                    write_model_input(image_tensors[i], rows[j])
+                if crop_ids is not None:
+                    batch.inputs["crop_id"][:] = crop_ids
+                predictions = postprocess_batch(batch.run(), pending_crops, pending_keys,
+                                                crop_ids, routed, generation)
         else:
-            # Fallback - use local index
-            label = f"class_{local_class_idx}"
-            print(f"⚠️ Global class index {global_class_idx} out of range, using fallback")
+            feeds = {input_name: np.stack([to_model_input(image_tensors[i]) for i in pending])}
+            if crop_ids is not None:
+                feeds["crop_id"] = crop_ids
+            output_names = [output.name for output in session.get_outputs()]
+            outputs = dict(zip(output_names, session.run(None, feeds)))
+            predictions = postprocess_batch(outputs, pending_crops, pending_keys, crop_ids, routed, generation)
         
-        # Debug information
-        print(f"🎯 Crop used: {crop_name or 'default'} (ID: {crop_id})")
-        print(f"🎯 Local class index: {local_class_idx}")
-        print(f"🎯 Global class index: {global_class_idx}")
-        print(f"🎯 Raw scores: {scores[local_class_idx]:.4f}")
-        print(f"🎯 Probability: {probabilities[local_class_idx]:.4f}")
-        print(f"🎯 Confidence: {confidence:.4f} ({confidence*100:.2f}%)")
+        for i, prediction in zip(pending, predictions):
+            results[i] = prediction
+    
+    return [
+        results[i] if results[i] is not None else classify_entry(entries[i], crop_names[i])
+        for i in range(len(image_tensors))
+    ]
+
+
+def run_inference(image_tensor, crop_name: str = None, image_key: str = None) -> Dict[str, Any]:
+    """Run inference on the preprocessed image tensor with crop information
+    
+    Args:
+        image_tensor: Preprocessed image tensor ready for model input
+        crop_name: Name of the crop (optional, will use default if not provided)
+        image_key: Optional content hash of the image for the embedding cache
         
-        # Return the results
-        return {
-            "label": label,
-            "confidence": confidence,
-            "class_index": int(global_class_idx),
-            "local_class_index": int(local_class_idx),
-            "raw_scores": scores.tolist(),
-            "probabilities": probabilities.tolist(),
-            "crop_used": crop_name or "default",
-            "crop_id": int(crop_id)
-        }
+    Returns:
+        Dictionary containing prediction results
+    """
+    try:
+        return run_inference_batch([image_tensor], [crop_name], [image_key])[0]
     
     except Exception as e:
         print(f"Error during inference: {e}")
-        raise
\ No newline at end of file
+        raise
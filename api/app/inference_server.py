@@ -0,0 +1,436 @@
+"""
+Standalone inference server over a Unix domain socket
+
+With INFERENCE_SERVER enabled, one process owns the model: the session
+pool, the micro-batcher, the embedding cache and the load / warm-up / hot
+reload lifecycle. API workers don't load the model at all; they send each
+preprocessed image to this process and get the prediction back, so the web
+workers can be scaled for I/O (storage, database, LLM) while inference stays
+in one right-sized process that batches requests from all of them.
+
+Each client connection owns a shared-memory block. The worker writes the
+image tensor into it and sends only a small header over the socket; the
+server reads the tensor in place (no copy, no serialization) while the
+worker waits for the reply. Messages are length-prefixed pickles - the
+socket is local and only accessible to the service user.
+
+Run it with run.py (INFERENCE_SERVER=true starts it automatically) or on
+its own with `python -m api.app.inference_server`.
+"""
+
+import asyncio
+import os
+import pickle
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .config import (
+    INFERENCE_BATCHING,
+    INFERENCE_SERVER,
+    INFERENCE_SERVER_SOCKET,
+    INFERENCE_SERVER_CONNECTIONS,
+    INFERENCE_SERVER_TIMEOUT_SECONDS,
+    INFERENCE_SERVER_VERSION_TTL_SECONDS,
+)
+
+_HEADER = struct.Struct("!I")
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Open a client's block without letting this process's tracker unlink it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attached block with the resource
+        # tracker, which would unlink it when this process exits
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None if rtype == "shared_memory" else register(name, rtype)
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _recv_exact(conn: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = conn.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_message(conn: socket.socket) -> Optional[Dict[str, Any]]:
+    header = _recv_exact(conn, _HEADER.size)
+    if header is None:
+        return None
+    payload = _recv_exact(conn, _HEADER.unpack(header)[0])
+    return None if payload is None else pickle.loads(payload)
+
+
+def _send_message(conn: socket.socket, message: Dict[str, Any]):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    conn.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+class InferenceServer:
+    """Serves inference requests from API workers on a Unix socket"""
+
+    def __init__(self, socket_path: str = INFERENCE_SERVER_SOCKET, manage_model: bool = True):
+        self.socket_path = socket_path
+        # Run the model lifecycle (load, warm-up, hot reload) in this process
+        self.manage_model = manage_model
+        self._socket = None
+        self._stop = threading.Event()
+        self._connections = 0
+        self._requests = 0
+        self._failed_requests = 0
+        self._stats_lock = threading.Lock()
+
+    def bind(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        sock.listen(256)
+        return sock
+
+    def serve_forever(self):
+        """Load and warm the model, then accept API worker connections until stop()"""
+        from .lifecycle import model_lifecycle
+        from .runtime_profile import validate_optimized_cache
+
+        if self.manage_model:
+            try:
+                validate_optimized_cache()
+            except Exception as e:
+                print(f"⚠️ Could not validate optimized model cache: {e}")
+            model_lifecycle.start()
+
+        self._socket = self.bind()
+        print(f"✅ Inference server listening on {self.socket_path}")
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = self._socket.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._handle, args=(conn,), name="inference-conn", daemon=True).start()
+        finally:
+            if self.manage_model:
+                model_lifecycle.stop(timeout=5)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        self._stop.set()
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+
+    def _handle(self, conn: socket.socket):
+        block = None
+        with self._stats_lock:
+            self._connections += 1
+        try:
+            while True:
+                message = _recv_message(conn)
+                if message is None:
+                    break
+                op = message.get("op")
+                if op == "attach":
+                    if block is not None:
+                        block.close()
+                    block = _attach_shared_memory(message["shm"])
+                    _send_message(conn, {"ok": True})
+                elif op == "infer":
+                    _send_message(conn, self._infer(message, block))
+                elif op == "status":
+                    _send_message(conn, {"ok": True, "result": self.status()})
+                elif op == "version":
+                    _send_message(conn, self._version())
+                else:
+                    _send_message(conn, {"ok": False, "error": f"Unknown op {op!r}"})
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._stats_lock:
+                self._connections -= 1
+            conn.close()
+            if block is not None:
+                try:
+                    block.close()
+                except BufferError:
+                    # A timed-out request still holds a view; the GC releases it
+                    pass
+
+    def _infer(self, message: Dict[str, Any], block) -> Dict[str, Any]:
+        from .batching import InferenceQueueFullError, get_batcher
+        from .inference import classify_cached, get_model_version, run_inference
+
+        with self._stats_lock:
+            self._requests += 1
+        try:
+            if block is None:
+                raise RuntimeError("No shared memory attached")
+            # A view of the worker's block - it waits for this reply before reusing it
+            tensor = np.ndarray(tuple(message["shape"]), dtype=np.dtype(message["dtype"]), buffer=block.buf)
+            crop_name, image_key = message.get("crop_name"), message.get("image_key")
+
+            cached = classify_cached(image_key, [crop_name])
+            if cached is not None:
+                result = cached[0]
+            elif INFERENCE_BATCHING:
+                result = get_batcher().infer(tensor, crop_name, image_key=image_key)
+            else:
+                result = run_inference(tensor, crop_name, image_key)
+            del tensor
+            return {"ok": True, "result": result, "model_version": get_model_version()}
+        except InferenceQueueFullError as e:
+            with self._stats_lock:
+                self._failed_requests += 1
+            return {"ok": False, "error": str(e), "queue_full": True}
+        except Exception as e:
+            with self._stats_lock:
+                self._failed_requests += 1
+            return {"ok": False, "error": str(e)}
+
+    def _version(self) -> Dict[str, Any]:
+        from .inference import get_model_version
+
+        try:
+            version = get_model_version()
+            return {"ok": True, "result": version, "model_version": version}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    def status(self) -> Dict[str, Any]:
+        """Model and pipeline metrics, in the shape of the /metrics sections"""
+        from .batching import get_batching_stats
+        from .embedding_cache import embedding_cache
+        from .inference import get_model_runtime_stats
+        from .lifecycle import model_lifecycle
+        from .runtime_profile import get_runtime_profile_info
+
+        lifecycle = model_lifecycle.status()
+        with self._stats_lock:
+            server = {
+                "pid": os.getpid(),
+                "socket": self.socket_path,
+                "connections": self._connections,
+                "requests": self._requests,
+                "failed_requests": self._failed_requests,
+            }
+        return {
+            "ready": lifecycle["ready"],
+            "model_version": lifecycle["model_version"],
+            "inference_server": server,
+            "inference_batcher": get_batching_stats(),
+            "embedding_cache": embedding_cache.stats(),
+            "runtime": get_runtime_profile_info(),
+            "model_runtime": get_model_runtime_stats(),
+            "model_lifecycle": lifecycle,
+        }
+
+
+class InferenceServerError(RuntimeError):
+    """Raised when the inference server fails a request or cannot be reached"""
+
+
+class _Connection:
+    """One socket to the server plus the shared-memory block it reads tensors from"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.block = None
+
+    async def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        self.writer.write(_HEADER.pack(len(payload)) + payload)
+        await self.writer.drain()
+        size = _HEADER.unpack(await self.reader.readexactly(_HEADER.size))[0]
+        return pickle.loads(await self.reader.readexactly(size))
+
+    async def ensure_block(self, size: int):
+        if self.block is not None and self.block.size >= size:
+            return
+        self.close_block()
+        self.block = shared_memory.SharedMemory(create=True, size=size)
+        reply = await self.request({"op": "attach", "shm": self.block.name})
+        if not reply.get("ok"):
+            raise InferenceServerError(reply.get("error", "attach failed"))
+
+    def close_block(self):
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    def close(self):
+        self.writer.close()
+        self.close_block()
+
+
+class InferenceClient:
+    """Async client API workers use to run inference in the inference server
+
+    Keeps up to max_connections connections (one request in flight on each)
+    and reuses them, together with their shared-memory blocks, across
+    requests.
+    """
+
+    def __init__(self,
+                 socket_path: str = INFERENCE_SERVER_SOCKET,
+                 max_connections: int = INFERENCE_SERVER_CONNECTIONS,
+                 timeout: float = INFERENCE_SERVER_TIMEOUT_SECONDS,
+                 version_ttl: float = INFERENCE_SERVER_VERSION_TTL_SECONDS):
+        self.socket_path = socket_path
+        self.timeout = float(timeout)
+        self.version_ttl = float(version_ttl)
+        self._slots = asyncio.Semaphore(max(1, int(max_connections)))
+        self._idle = []
+        # Last model version the server reported, and when
+        self.model_version = None
+        self._version_seen_at = 0.0
+
+    def _saw_version(self, version: str):
+        self.model_version = version
+        self._version_seen_at = time.monotonic()
+
+    async def _acquire(self) -> _Connection:
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        except Exception as e:
+            self._slots.release()
+            raise InferenceServerError(f"Inference server unavailable at {self.socket_path}: {e}") from e
+        return _Connection(reader, writer)
+
+    def _release(self, connection: _Connection, healthy: bool):
+        if healthy:
+            self._idle.append(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    async def _call(self, message: Dict[str, Any], tensor: Optional[np.ndarray] = None) -> Any:
+        connection = await self._acquire()
+        healthy = False
+        try:
+            if tensor is not None:
+                await connection.ensure_block(tensor.nbytes)
+                np.copyto(np.ndarray(tensor.shape, dtype=tensor.dtype, buffer=connection.block.buf), tensor)
+                message = dict(message, shape=tensor.shape, dtype=tensor.dtype.str)
+            reply = await asyncio.wait_for(connection.request(message), self.timeout)
+            healthy = True
+        except asyncio.TimeoutError as e:
+            raise InferenceServerError(f"Inference server did not answer within {self.timeout:.0f} s") from e
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            raise InferenceServerError(f"Lost connection to the inference server: {e}") from e
+        finally:
+            self._release(connection, healthy)
+
+        if not reply.get("ok"):
+            if reply.get("queue_full"):
+                from .batching import InferenceQueueFullError
+                raise InferenceQueueFullError(reply["error"])
+            raise InferenceServerError(reply.get("error", "inference failed"))
+        if reply.get("model_version"):
+            self._saw_version(reply["model_version"])
+        return reply["result"]
+
+    async def infer(self, image_tensor, crop_name: Optional[str] = None,
+                    image_key: Optional[str] = None) -> Dict[str, Any]:
+        tensor = np.ascontiguousarray(np.asarray(image_tensor, dtype=np.float32))
+        return await self._call({"op": "infer", "crop_name": crop_name, "image_key": image_key}, tensor)
+
+    async def status(self) -> Dict[str, Any]:
+        status = await self._call({"op": "status"})
+        if status.get("model_version"):
+            self._saw_version(status["model_version"])
+        return status
+
+    async def get_model_version(self) -> str:
+        """The server's model version, asked for again once it is version_ttl old"""
+        if self.model_version is None or time.monotonic() - self._version_seen_at >= self.version_ttl:
+            await self._call({"op": "version"})
+        return self.model_version
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+_client = None
+
+
+def get_inference_client() -> InferenceClient:
+    """The worker's client (created inside its event loop on first use)"""
+    global _client
+
+    if _client is None:
+        _client = InferenceClient()
+    return _client
+
+
+async def get_served_model_version() -> str:
+    """Version of the model answering requests (the inference server's when it is used)
+
+    With the server, the worker never hashes the model files itself - it may
+    not even have them, and they can differ from what the server loaded.
+    """
+    if INFERENCE_SERVER:
+        return await get_inference_client().get_model_version()
+    from .executor import run_cpu_bound
+    from .inference import get_model_version
+    return await run_cpu_bound(get_model_version)
+
+
+def close_inference_client():
+    global _client
+
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def start_inference_server(socket_path: str = INFERENCE_SERVER_SOCKET) -> subprocess.Popen:
+    """Start the inference server in its own process (used by run.py)"""
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, INFERENCE_SERVER_SOCKET=socket_path)
+    return subprocess.Popen([sys.executable, "-m", "api.app.inference_server"], cwd=project_root, env=env)
+
+
+def main():
+    server = InferenceServer()
+
+    def handle_stop(signum, frame):
+        print("🛑 Stopping inference server...")
+        server.stop()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
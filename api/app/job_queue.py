@@ -0,0 +1,436 @@
+"""
+Durable local queue for post-inference side effects
+
+Storage uploads, the detections insert and the LLaMA enrichment are tried
+inline first. When one fails or times out, the work is written to a SQLite
+table (bytes go to a spool file next to it) and the request carries on; a
+worker task retries the job with exponential backoff until it succeeds or
+runs out of attempts. A transient Supabase or Ollama outage then delays
+part of a detection instead of failing it.
+
+Only transient failures are queued (timeouts, connection errors, 5xx); a
+request the service rejects outright would fail the same way on every
+retry, so it fails the request instead.
+
+Job IDs are derived from what the job does (e.g. "insert:<upload id>"), so
+enqueueing the same work twice is a no-op, and handlers are written to be
+safe to repeat (storage uploads upsert, inserts upsert on the ID). Claimed
+jobs carry a lease: a worker that dies mid-job - or a restart - just lets
+the lease run out and the job is picked up again, so pending work drains on
+startup. Several workers on one host can share the database.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from .config import (
+    JOB_QUEUE_ENABLED,
+    JOB_QUEUE_PATH,
+    JOB_QUEUE_MAX_ATTEMPTS,
+    JOB_QUEUE_BASE_DELAY_SECONDS,
+    JOB_QUEUE_MAX_DELAY_SECONDS,
+    JOB_QUEUE_POLL_SECONDS,
+    JOB_QUEUE_LEASE_SECONDS,
+    JOB_QUEUE_HANDLER_TIMEOUT_SECONDS,
+    JOB_QUEUE_RETENTION_SECONDS,
+)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    blob TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, next_run_at);
+"""
+
+Handler = Callable[[Dict[str, Any], Optional[bytes]], Awaitable[Any]]
+
+# PostgREST / Postgres error codes for a database that is down or overloaded
+_TRANSIENT_DB_CODES = ("PGRST000", "PGRST001", "PGRST002", "08", "53", "57P", "40001", "40P01")
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether a failed Supabase / Ollama call is worth retrying later
+
+    Timeouts, connection errors, 429 and 5xx responses are; 4xx responses,
+    constraint violations, permission errors and bugs are not.
+    """
+    import httpx
+
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    code = getattr(error, "code", None)
+    if status is None and code is not None and str(code).isdigit() and 100 <= int(code) <= 599:
+        # postgrest puts the HTTP status in the code when the body is not JSON
+        status = code
+    if status is not None and str(status).isdigit():
+        status = int(status)
+        return status == 429 or status >= 500
+    return isinstance(code, str) and code.startswith(_TRANSIENT_DB_CODES)
+
+
+class Job:
+    """One claimed job"""
+
+    __slots__ = ("id", "kind", "payload", "blob", "attempts")
+
+    def __init__(self, id: str, kind: str, payload: Dict[str, Any], blob: Optional[str], attempts: int):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.blob = blob
+        self.attempts = attempts
+
+
+class JobQueue:
+    """SQLite-backed job queue with a spool directory for binary payloads"""
+
+    def __init__(self,
+                 path: str = JOB_QUEUE_PATH,
+                 max_attempts: int = JOB_QUEUE_MAX_ATTEMPTS,
+                 base_delay: float = JOB_QUEUE_BASE_DELAY_SECONDS,
+                 max_delay: float = JOB_QUEUE_MAX_DELAY_SECONDS,
+                 poll_interval: float = JOB_QUEUE_POLL_SECONDS,
+                 lease_seconds: float = JOB_QUEUE_LEASE_SECONDS,
+                 handler_timeout: float = JOB_QUEUE_HANDLER_TIMEOUT_SECONDS,
+                 retention_seconds: float = JOB_QUEUE_RETENTION_SECONDS):
+        self.path = str(path)
+        self.spool_dir = self.path + ".spool"
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.poll_interval = max(0.01, float(poll_interval))
+        self.lease_seconds = float(lease_seconds)
+        # A handler must give up well before its lease runs out and another worker re-claims the job
+        self.handler_timeout = float(handler_timeout) or None
+        if self.lease_seconds > 0:
+            self.handler_timeout = min(self.handler_timeout or self.lease_seconds, self.lease_seconds * 0.8)
+        self.retention_seconds = float(retention_seconds)
+        # Identifies this process's leases
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Handler] = {}
+        self._worker = None
+        self._wakeup = None
+        self._loop = None
+        self._stats_lock = threading.Lock()
+
+        # Metrics
+        self._enqueued = 0
+        self._succeeded = 0
+        self._retried = 0
+        self._dead = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per operation - cheap, and safe from any thread
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+        finally:
+            db.close()
+
+    def register(self, kind: str, handler: Handler):
+        """Set the coroutine function that runs jobs of a kind: handler(payload, blob_bytes)"""
+        self._handlers[kind] = handler
+
+    # Blocking database operations (run them off the event loop)
+
+    def _spool(self, job_id: str, data: bytes) -> str:
+        name = hashlib.sha256(job_id.encode("utf-8")).hexdigest()[:32] + ".bin"
+        path = os.path.join(self.spool_dir, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return name
+
+    def _unspool(self, name: Optional[str]):
+        if name:
+            try:
+                os.remove(os.path.join(self.spool_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def enqueue(self, job_id: str, kind: str, payload: Dict[str, Any], blob: Optional[bytes] = None) -> bool:
+        """Persist a job; a job with the same ID that already exists is left alone
+
+        Returns:
+            True if the job was added
+        """
+        now = time.time()
+        name = self._spool(job_id, blob) if blob is not None else None
+        with self._connect() as db:
+            added = db.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, payload, blob, state, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), name, PENDING, now, now, now),
+            ).rowcount == 1
+            existing = None if added else db.execute("SELECT blob FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not added:
+            # The spool file is named after the job - keep it only if the existing job still uses it
+            if name and (existing is None or existing[0] != name):
+                self._unspool(name)
+            return False
+        with self._stats_lock:
+            self._enqueued += 1
+        self._wake()
+        return True
+
+    def _wake(self):
+        """Have the worker look for due jobs now (callable from any thread)"""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def claim(self, limit: int = 16) -> List[Job]:
+        """Lease up to limit due jobs (pending, or running with an expired lease)"""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT id, kind, payload, blob, attempts FROM jobs "
+                    "WHERE (state = ? AND next_run_at <= ?) OR (state = ? AND lease_until < ?) "
+                    "ORDER BY next_run_at LIMIT ?",
+                    (PENDING, now, RUNNING, now, int(limit)),
+                ).fetchall()
+                for row in rows:
+                    db.execute(
+                        "UPDATE jobs SET state = ?, lease_owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, self.owner, now + self.lease_seconds, now, row[0]),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return [Job(row[0], row[1], json.loads(row[2]), row[3], row[4]) for row in rows]
+
+    def read_blob(self, job: Job) -> Optional[bytes]:
+        if not job.blob:
+            return None
+        with open(os.path.join(self.spool_dir, job.blob), "rb") as f:
+            return f.read()
+
+    def retry_delay(self, attempts: int) -> float:
+        """Exponential backoff with jitter after the given number of failed attempts"""
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _prune(self, db: sqlite3.Connection, now: float):
+        # Finished jobs are kept a while so re-enqueueing the same work stays a no-op
+        cutoff = now - self.retention_seconds
+        blobs = db.execute("SELECT blob FROM jobs WHERE state IN (?, ?) AND updated_at < ? AND blob IS NOT NULL",
+                           (DONE, DEAD, cutoff)).fetchall()
+        db.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?", (DONE, DEAD, cutoff))
+        for (name,) in blobs:
+            self._unspool(name)
+
+    def prune(self):
+        """Forget done and dead jobs older than the retention period"""
+        with self._connect() as db:
+            self._prune(db, time.time())
+
+    def complete(self, job: Job) -> bool:
+        """Mark a job done
+
+        Returns:
+            False if the lease had expired and another worker owns the job now
+        """
+        now = time.time()
+        with self._connect() as db:
+            owned = db.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, blob = NULL, lease_owner = NULL, "
+                "lease_until = NULL, last_error = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                (DONE, now, job.id, self.owner),
+            ).rowcount == 1
+            self._prune(db, now)
+        if not owned:
+            # The new owner still needs the spooled bytes
+            return False
+        self._unspool(job.blob)
+        with self._stats_lock:
+            self._succeeded += 1
+        return True
+
+    def fail(self, job: Job, error: str) -> bool:
+        """Record a failed attempt and schedule the retry
+
+        Returns:
+            True if the job will be retried, False if it ran out of attempts
+        """
+        attempts = job.attempts + 1
+        retry = attempts < self.max_attempts
+        now = time.time()
+        with self._connect() as db:
+            owned = db.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, next_run_at = ?, blob = ?, lease_owner = NULL, "
+                "lease_until = NULL, last_error = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                (PENDING if retry else DEAD, attempts, now + (self.retry_delay(attempts) if retry else 0.0),
+                 job.blob if retry else None, error[:2000], now, job.id, self.owner),
+            ).rowcount == 1
+            if not retry:
+                self._prune(db, now)
+        if not owned:
+            return retry
+        if not retry:
+            # Nothing will read a dead job's bytes again
+            self._unspool(job.blob)
+        with self._stats_lock:
+            if retry:
+                self._retried += 1
+            else:
+                self._dead += 1
+        return retry
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as db:
+            rows = db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {state: 0 for state in (PENDING, RUNNING, DONE, DEAD)}
+        counts.update(dict(rows))
+        return counts
+
+    # Async worker
+
+    async def run_job(self, job: Job) -> bool:
+        """Run one claimed job through its handler
+
+        Returns:
+            True if it succeeded
+        """
+        from .executor import run_cpu_bound
+
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job kind '{job.kind}'")
+            blob = await run_cpu_bound(self.read_blob, job)
+            await asyncio.wait_for(handler(job.payload, blob), self.handler_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retry = await run_cpu_bound(self.fail, job, f"{type(e).__name__}: {e}")
+            print(f"⚠️ Job {job.id} failed (attempt {job.attempts + 1}/{self.max_attempts})"
+                  f"{', will retry' if retry else ', giving up'}: {e}")
+            return False
+        if not await run_cpu_bound(self.complete, job):
+            print(f"⚠️ Job {job.id} finished after its lease expired, another worker has it now")
+        return True
+
+    async def process_due(self, limit: int = 16) -> int:
+        """Claim and run every job that is due now, concurrently
+
+        Returns:
+            Number of jobs run
+        """
+        from .executor import run_cpu_bound
+
+        jobs = await run_cpu_bound(self.claim, limit)
+        if jobs:
+            await asyncio.gather(*(self.run_job(job) for job in jobs))
+        return len(jobs)
+
+    async def _run(self):
+        while True:
+            try:
+                ran = await self.process_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Job queue worker error: {e}")
+                ran = 0
+            if not ran:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self):
+        """Start the worker on the running event loop (first pass drains what is pending)"""
+        if self._worker is None or self._worker.done():
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the worker; jobs it was running are picked up again once their lease expires"""
+        worker, self._worker = self._worker, None
+        self._loop = None
+        if worker is not None:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = {
+                "enqueued": self._enqueued,
+                "succeeded": self._succeeded,
+                "retried": self._retried,
+                "dead": self._dead,
+            }
+        stats["jobs"] = self.counts()
+        stats["worker_running"] = self._worker is not None and not self._worker.done()
+        return stats
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> Optional[JobQueue]:
+    """Get or create the process-wide job queue (None when JOB_QUEUE_ENABLED is off)"""
+    global _job_queue
+
+    if not JOB_QUEUE_ENABLED:
+        return None
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
+
+
+def get_job_queue_stats() -> Dict[str, Any]:
+    job_queue = get_job_queue()
+    if job_queue is None:
+        return {"enabled": False}
+    stats = job_queue.stats()
+    stats["enabled"] = True
+    return stats
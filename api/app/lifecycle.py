@@ -0,0 +1,256 @@
+"""
+Model lifecycle: startup warm-up, readiness and hot reload
+
+On startup a background thread loads the model runtime, warms every session
+with dummy batches at the configured batch sizes and touches the rest of the
+inference path (labels, head weights, preprocessing), and only then marks
+the service ready - /ready answers 503 until it does, so the load balancer
+never sends traffic to a cold instance.
+
+The same thread then polls the model files. When they change (and have
+stopped changing, so a copy in progress is not picked up) the new model is
+loaded and warmed next to the old one and swapped in atomically; requests
+already running finish on the old sessions. A failed reload keeps serving
+the previous model.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import (
+    MODEL_WARMUP,
+    MODEL_WARMUP_BATCH_SIZES,
+    MODEL_WATCH_INTERVAL_SECONDS,
+    BACKBONE_MODEL_PATH,
+    ROUTED_MODEL_PATH,
+    HEAD_WEIGHTS_PATH,
+    MODEL_BUNDLE_PATH,
+    MODEL_VARIANT,
+)
+
+
+def get_warmup_batch_sizes() -> List[int]:
+    """Batch sizes to warm (configured, or 1 and the batcher's maximum)"""
+    from .batching import get_batch_settings
+
+    sizes = MODEL_WARMUP_BATCH_SIZES or [1, get_batch_settings()["max_batch_size"]]
+    return sorted({max(1, int(size)) for size in sizes})
+
+
+def get_watched_paths() -> List[str]:
+    """Every file that can change which model is served, or its weights"""
+    from .inference import get_model_path, get_variant_path
+
+    try:
+        fused_path = get_model_path()
+    except FileNotFoundError:
+        fused_path = None
+    paths = []
+    for path in (ROUTED_MODEL_PATH, BACKBONE_MODEL_PATH, fused_path):
+        if path:
+            paths.extend([path, get_variant_path(path)])
+    paths.extend([HEAD_WEIGHTS_PATH, MODEL_BUNDLE_PATH])
+    return list(dict.fromkeys(paths))
+
+
+def model_fingerprint() -> Tuple:
+    """Cheap (path, size, mtime) snapshot of the watched model files"""
+    fingerprint = []
+    for path in get_watched_paths():
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+
+def build_warmup_feeds(runtime, batch_sizes: List[int]) -> List[Dict[str, np.ndarray]]:
+    """Dummy inputs of every warm-up batch size for a runtime's graph"""
+    from .inference import get_input_name
+    from .utils.image_utils import get_preprocessor
+
+    image_shape = get_preprocessor().output_shape
+    input_names = [model_input.name for model_input in runtime.get_inputs()]
+    feeds_list = []
+    for size in batch_sizes:
+        feeds = {get_input_name(runtime): np.zeros((size,) + tuple(image_shape), dtype=np.float32)}
+        if "crop_id" in input_names:
+            feeds["crop_id"] = np.zeros(size, dtype=np.int64)
+        feeds_list.append(feeds)
+    return feeds_list
+
+
+class ModelLifecycle:
+    """Loads, warms and hot-swaps the served model; gates readiness"""
+
+    def __init__(self,
+                 warmup: bool = MODEL_WARMUP,
+                 watch_interval: float = MODEL_WATCH_INTERVAL_SECONDS):
+        self.warmup = warmup
+        self.watch_interval = float(watch_interval)
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._fingerprint = None
+
+        # Status
+        self._state = "starting"
+        self._model_path = None
+        self._model_version = None
+        self._loaded_at = None
+        self._warmup_ms = 0.0
+        self._reloads = 0
+        self._failed_reloads = 0
+        self._last_error = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        """Load and warm the model in the background, then watch for new versions"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-lifecycle", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def _set_state(self, state: str, error: Optional[str] = None):
+        with self._lock:
+            self._state = state
+            if error is not None:
+                self._last_error = error
+
+    def load_initial(self):
+        """Load and warm the model through the normal inference path"""
+        from . import inference
+
+        self._set_state("loading")
+        self._fingerprint = model_fingerprint()
+        runtime = inference.load_model()
+
+        self._set_state("warming")
+        warmup_ms = 0.0
+        if self.warmup:
+            warmup_ms = runtime.warm_up(build_warmup_feeds(runtime, get_warmup_batch_sizes()))
+            # Touch the Python side too: labels, head weights, segment tables, CAM
+            from .utils.image_utils import get_preprocessor
+            image = np.zeros(get_preprocessor().output_shape, dtype=np.float32)
+            inference.run_inference_batch([image, image], [inference.get_crop_labels()[0], inference.AUTO_CROP])
+
+        self._mark_loaded(runtime, inference.get_model_version(), warmup_ms)
+
+    def reload(self) -> bool:
+        """Load the current model files next to the active model and swap them in
+
+        Returns:
+            True if a new model was swapped in
+        """
+        from . import inference
+        from .model_bundle import open_model_bundle
+        from .model_runtime import ModelRuntime
+
+        fingerprint = model_fingerprint()
+        self._set_state("reloading")
+        try:
+            bundle = open_model_bundle()
+            inference.check_head_weights(bundle)
+            if bundle is not None:
+                runtime = ModelRuntime(bundle.describe(MODEL_VARIANT), bundle=bundle,
+                                       session_factory=bundle.session_factory(MODEL_VARIANT)).load()
+            else:
+                runtime = ModelRuntime(inference.get_loose_model_path()).load()
+            warmup_ms = 0.0
+            if self.warmup:
+                warmup_ms = runtime.warm_up(build_warmup_feeds(runtime, get_warmup_batch_sizes()))
+        except Exception as e:
+            print(f"❌ Model reload failed, still serving {self._model_version}: {e}")
+            with self._lock:
+                self._failed_reloads += 1
+            self._fingerprint = fingerprint
+            self._set_state("ready", error=str(e))
+            return False
+
+        inference.swap_model_runtime(runtime)
+        self._fingerprint = fingerprint
+        with self._lock:
+            self._reloads += 1
+        self._mark_loaded(runtime, inference.get_model_version(), warmup_ms)
+        print(f"🔄 Swapped in model {self._model_version} from {runtime.model_path}")
+        return True
+
+    def _mark_loaded(self, runtime, version: str, warmup_ms: float):
+        with self._lock:
+            self._model_path = runtime.model_path
+            self._model_version = version
+            self._loaded_at = time.time()
+            self._warmup_ms = warmup_ms
+            self._state = "ready"
+        self._ready.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.load_initial()
+                print(f"✅ Model {self._model_version} ready (warm-up {self._warmup_ms:.0f} ms)")
+                break
+            except Exception as e:
+                print(f"❌ Model startup failed, retrying: {e}")
+                self._set_state("failed", error=str(e))
+                self._stop.wait(max(self.watch_interval, 5.0))
+
+        if self.watch_interval <= 0:
+            return
+
+        pending = None
+        while not self._stop.wait(self.watch_interval):
+            try:
+                current = model_fingerprint()
+            except Exception as e:
+                print(f"⚠️ Could not check model files: {e}")
+                continue
+            if current == self._fingerprint:
+                pending = None
+            elif current == pending:
+                # Unchanged for a full interval - the new files are complete
+                self.reload()
+                pending = None
+            else:
+                pending = current
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._state,
+                "ready": self._ready.is_set(),
+                "model_path": self._model_path,
+                "model_version": self._model_version,
+                "loaded_at": self._loaded_at,
+                "warmup_ms": self._warmup_ms,
+                "warmup_batch_sizes": get_warmup_batch_sizes() if self.warmup else [],
+                "watch_interval_seconds": self.watch_interval,
+                "reloads": self._reloads,
+                "failed_reloads": self._failed_reloads,
+                "last_error": self._last_error,
+            }
+
+
+# Shared lifecycle manager
+model_lifecycle = ModelLifecycle()
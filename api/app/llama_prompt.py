@@ -1,10 +1,115 @@
 import os
+import httpx
 import requests
 from typing import Optional
 from dotenv import load_dotenv
 
 # Import config here to avoid circular imports
-from .config import OLLAMA_BASE_URL, OLLAMA_MODEL
+from .config import OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT
+
+# Shared async HTTP client for Ollama - created on first use
+_async_client = None
+
+
+def _build_prompt(image_url: str, pest_name: str, confidence: float, crop_name: Optional[str] = None) -> str:
+    """Build the diagnosis prompt sent to Ollama"""
+    crop_info = f"{crop_name} crop" if crop_name else "crop"
+    
+    return f"""
+        A farmer uploaded an image of a {crop_info}. Our AI model detected '{pest_name}' with {confidence:.1f}% confidence.
+        Image URL: {image_url}
+
+        Please provide a detailed response with the following information:
+        1. What is {pest_name} and how does it affect {crop_info}?
+        2. What are the typical symptoms that can be observed?
+        3. What are the recommended treatments or management practices?
+        4. What preventive measures can farmers take to avoid this issue in the future?
+        
+        Keep your response concise but informative, focusing on practical advice for farmers.
+        """
+
+
+def _fallback_diagnosis(pest_name: str, confidence: float) -> str:
+    """Response used when Ollama is not available"""
+    return f"Detected {pest_name} with {confidence:.1f}% confidence. Unable to generate detailed diagnosis at this time."
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Get or create the shared async HTTP client used for Ollama calls"""
+    global _async_client
+    
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(base_url=OLLAMA_BASE_URL, timeout=OLLAMA_TIMEOUT)
+    return _async_client
+
+
+async def close_async_client():
+    """Close the shared async HTTP client (called on application shutdown)"""
+    global _async_client
+    
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def request_llama_diagnosis(image_url: str, pest_name: str, confidence: float,
+                                  crop_name: Optional[str] = None) -> str:
+    """Generate a diagnosis using LLaMA model via Ollama, raising when Ollama fails
+    
+    Callers that can retry later (the upload pipeline, queued enrichment jobs)
+    need the connection error or 5xx response rather than the fallback text.
+    
+    Args:
+        image_url: URL of the uploaded image
+        pest_name: Detected pest/disease name
+        confidence: Confidence score of the detection (0-100)
+        crop_name: Optional name of the crop
+        
+    Returns:
+        Diagnosis text from LLaMA
+        
+    Raises:
+        httpx.HTTPError: If Ollama is unreachable or the request fails
+    """
+    response = await get_async_client().post(
+        "/api/generate",
+        json={
+            "model": OLLAMA_MODEL,
+            "prompt": _build_prompt(image_url, pest_name, confidence, crop_name),
+            "stream": False
+        }
+    )
+    
+    # Check if the request was successful
+    response.raise_for_status()
+    
+    # Return the diagnosis
+    return response.json().get("response", "")
+
+
+async def llama_prompt_async(image_url: str, pest_name: str, confidence: float, crop_name: Optional[str] = None) -> str:
+    """Generate a diagnosis using LLaMA model via Ollama without blocking the event loop
+    
+    Args:
+        image_url: URL of the uploaded image
+        pest_name: Detected pest/disease name
+        confidence: Confidence score of the detection (0-100)
+        crop_name: Optional name of the crop
+        
+    Returns:
+        Diagnosis text from LLaMA, or a fallback if Ollama is not available
+    """
+    try:
+        return await request_llama_diagnosis(image_url, pest_name, confidence, crop_name)
+    
+    except httpx.HTTPError as e:
+        print(f"Error calling Ollama API: {e}")
+        # Fallback response if Ollama is not available
+        return _fallback_diagnosis(pest_name, confidence)
+    
+    except Exception as e:
+        print(f"Error generating diagnosis: {e}")
+        return _fallback_diagnosis(pest_name, confidence)
 
 
 def llama_prompt(image_url: str, pest_name: str, confidence: float, crop_name: Optional[str] = None) -> str:
@@ -21,20 +126,7 @@ def llama_prompt(image_url: str, pest_name: str, confidence: float, crop_name: O
     """
     try:
         # Create the prompt
-        crop_info = f"{crop_name} crop" if crop_name else "crop"
-        
-        prompt = f"""
-        A farmer uploaded an image of a {crop_info}. Our AI model detected '{pest_name}' with {confidence:.1f}% confidence.
-        Image URL: {image_url}
-
-        Please provide a detailed response with the following information:
-        1. What is {pest_name} and how does it affect {crop_info}?
-        2. What are the typical symptoms that can be observed?
-        3. What are the recommended treatments or management practices?
-        4. What preventive measures can farmers take to avoid this issue in the future?
-        
-        Keep your response concise but informative, focusing on practical advice for farmers.
-        """
+        prompt = _build_prompt(image_url, pest_name, confidence, crop_name)
         
         # Call Ollama API
         response = requests.post(
@@ -43,7 +135,8 @@ def llama_prompt(image_url: str, pest_name: str, confidence: float, crop_name: O
                 "model": OLLAMA_MODEL,
                 "prompt": prompt,
                 "stream": False
-            }
+            },
+            timeout=OLLAMA_TIMEOUT
         )
         
         # Check if the request was successful
@@ -58,8 +151,8 @@ def llama_prompt(image_url: str, pest_name: str, confidence: float, crop_name: O
     except requests.exceptions.RequestException as e:
         print(f"Error calling Ollama API: {e}")
         # Fallback response if Ollama is not available
-        return f"Detected {pest_name} with {confidence:.1f}% confidence. Unable to generate detailed diagnosis at this time."
+        return _fallback_diagnosis(pest_name, confidence)
     
     except Exception as e:
         print(f"Error generating diagnosis: {e}")
-        return f"Detected {pest_name} with {confidence:.1f}% confidence. Unable to generate detailed diagnosis at this time."
\ No newline at end of file
+        return _fallback_diagnosis(pest_name, confidence)
\ No newline at end of file
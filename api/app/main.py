@@ -1,6 +1,7 @@
 import os
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 
 # Import API routes
@@ -29,6 +30,74 @@ app.add_middleware(
 app.include_router(api_router, prefix="/api")
 
 
+@app.on_event("startup")
+async def startup():
+    """Share fast-upload progress, start the job queue worker, drop stale
+    optimized-model cache entries, then load and warm the model
+    
+    Loading runs in the background; /ready reports not ready until it is done.
+    """
+    from .api import register_job_handlers
+    from .config import INFERENCE_SERVER
+    from .enrichment import enrichment_tracker, get_enrichment_store
+    from .job_queue import get_job_queue
+    from .lifecycle import model_lifecycle
+    from .prefork import get_worker_id
+    from .runtime_profile import validate_optimized_cache
+    
+    # Fast-upload progress visible to the other workers
+    try:
+        enrichment_tracker.store = get_enrichment_store()
+    except Exception as e:
+        print(f"⚠️ Could not open the shared enrichment state, progress stays per worker: {e}")
+    
+    # Retry side effects queued before the last shutdown (or crash)
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        register_job_handlers(job_queue)
+        job_queue.start()
+    
+    if INFERENCE_SERVER:
+        # The inference server loads and warms the model; just learn its version
+        from .inference_server import get_inference_client
+        try:
+            await get_inference_client().status()
+        except Exception as e:
+            print(f"⚠️ Inference server not reachable yet: {e}")
+        return
+    
+    # The pre-fork parent already did this before forking the workers
+    if get_worker_id() is None:
+        try:
+            validate_optimized_cache()
+        except Exception as e:
+            print(f"⚠️ Could not validate optimized model cache: {e}")
+    
+    model_lifecycle.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release worker pools and shared HTTP clients"""
+    from .config import ENRICHMENT_SHUTDOWN_TIMEOUT_SECONDS
+    from .enrichment import enrichment_tracker
+    from .executor import shutdown_cpu_pool
+    from .inference_server import close_inference_client
+    from .job_queue import get_job_queue
+    from .lifecycle import model_lifecycle
+    from .llama_prompt import close_async_client
+    
+    # Fast-path uploads still enriching need the clients and CPU pool
+    await enrichment_tracker.drain(ENRICHMENT_SHUTDOWN_TIMEOUT_SECONDS)
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        await job_queue.stop()
+    model_lifecycle.stop(timeout=5)
+    close_inference_client()
+    await close_async_client()
+    shutdown_cpu_pool()
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -46,23 +115,27 @@ async def ready_check():
     """Readiness check - verifies the API is ready to handle requests"""
     try:
         # Import config here to avoid circular imports
-        from .config import get_model_paths, validate_config
+        from .config import get_model_paths, validate_config, INFERENCE_SERVER
+        
+        from .lifecycle import model_lifecycle
         
         # Check configuration
         config_errors = validate_config()
         if config_errors:
-            return {"status": "not_ready", "errors": config_errors}
+            return JSONResponse(status_code=503, content={"status": "not_ready", "errors": config_errors})
         
-        # Check if we can access the models directory
-        from pathlib import Path
-        models_dir = Path(__file__).parent.parent / "models"
-        
-        if models_dir.exists():
-            return {"status": "ready", "models": "available"}
+        # Only ready once the model is loaded and warmed
+        if INFERENCE_SERVER:
+            from .inference_server import get_inference_client
+            model = (await get_inference_client().status())["model_lifecycle"]
         else:
-            return {"status": "not_ready", "models": "missing"}
+            model = model_lifecycle.status()
+        if not model["ready"]:
+            return JSONResponse(status_code=503, content={"status": "not_ready", "model": model})
+        
+        return {"status": "ready", "models": "available", "model": model}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return JSONResponse(status_code=503, content={"status": "error", "message": str(e)})
 
 
 if __name__ == "__main__":
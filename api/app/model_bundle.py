@@ -0,0 +1,454 @@
+"""
+Single-file model bundle
+
+One uncompressed zip archive carries everything the API needs to serve a
+model: the ONNX graph (plus precision variants), the class / crop label
+tables, the crop-to-class mapping, the preprocessing config, the
+precomputed crop segment tables and the stacked crop head weights. A
+manifest lists every member with its SHA-256 and a checksum over all of
+them, so a half-copied or mixed-up bundle is rejected instead of served.
+
+Members are stored uncompressed and 64-byte aligned, so the API maps the
+file once and reads the NumPy tables straight out of the mapping: their
+pages live in the OS page cache and are shared by every worker process
+instead of each one holding a private copy.
+
+The ONNX graph is not shared that way. ONNX Runtime only builds a session
+from a path or from bytes, so each worker copies the graph member out of
+the mapping and ORT copies its initializers again while loading; the
+graph weights stay private to every worker's session.
+
+Layout:
+    manifest.json          format, layout, model version, member checksums
+    model.onnx             graph for the manifest's layout
+    model_<variant>.onnx   optional precision variants (e.g. int8)
+    labels.json            class_labels, crop_labels, crop_to_global_classes, preprocess
+    tables/*.npy           crop segment tables (see build_crop_segments)
+    heads/weight.npy       all crop heads stacked (total_classes, 576), optional
+    heads/bias.npy
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import (
+    BACKBONE_MODEL_PATH,
+    HEAD_WEIGHTS_PATH,
+    MODEL_BUNDLE,
+    MODEL_BUNDLE_PATH,
+    MODEL_VARIANT,
+    ROUTED_MODEL_PATH,
+    get_model_paths,
+)
+
+BUNDLE_FORMAT = "crop-disease-model-bundle"
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+LABELS_NAME = "labels.json"
+TABLE_NAMES = ("crop_ids", "starts", "global_classes", "table")
+ALIGNMENT = 64
+
+# Zip extra-field ID used for alignment padding (same as Android's zipalign)
+_PADDING_EXTRA_ID = 0xD935
+_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+
+
+def variant_member(variant: Optional[str] = None) -> str:
+    """Archive member holding a precision variant of the graph"""
+    variant = (variant or "fp32").lower()
+    return "model.onnx" if variant == "fp32" else f"model_{variant}.onnx"
+
+
+def variant_path(path: str, variant: Optional[str] = None) -> str:
+    """Loose file of a precision variant (mobilenet.onnx -> mobilenet_int8.onnx)"""
+    variant = (variant or "fp32").lower()
+    if variant in ("", "fp32"):
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{variant}{ext}"
+
+
+def loose_model_files(variant: Optional[str] = None) -> List[str]:
+    """The unbundled model files that exist - graphs (with their variant) and head weights"""
+    paths = []
+    for path in (ROUTED_MODEL_PATH, BACKBONE_MODEL_PATH, *get_model_paths()):
+        if path:
+            paths.extend([path, variant_path(path, variant)])
+    paths.append(HEAD_WEIGHTS_PATH)
+    return [path for path in dict.fromkeys(paths) if os.path.exists(path)]
+
+
+def build_crop_segments(crop_to_global_classes: Dict[str, List[int]]) -> Dict[str, Any]:
+    """Layout of the concatenated logits, one segment per crop head
+
+    Returns:
+        crop_ids: crop ID of each segment, in concatenation (string-sorted) order
+        starts: offset of each segment in the logits vector
+        offsets: crop ID string -> offset of its segment
+        global_classes: global class index of every logit
+        table: (num_crops, max_classes) logit indices per crop, padded with -1
+    """
+    crop_id_strs = sorted(crop_to_global_classes.keys())
+    lengths = np.array([len(crop_to_global_classes[cid]) for cid in crop_id_strs], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+    table = np.full((len(crop_id_strs), int(lengths.max())), -1, dtype=np.int64)
+    for row, (start, length) in enumerate(zip(starts, lengths)):
+        table[row, :length] = np.arange(start, start + length)
+
+    return {
+        "crop_ids": np.array([int(cid) for cid in crop_id_strs], dtype=np.int64),
+        "starts": starts,
+        "offsets": {cid: int(start) for cid, start in zip(crop_id_strs, starts)},
+        "global_classes": np.concatenate([crop_to_global_classes[cid] for cid in crop_id_strs]).astype(np.int64),
+        "table": table,
+    }
+
+
+def _npy_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _bundle_checksum(members: Dict[str, Dict[str, Any]]) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(members):
+        digest.update(f"{name}:{members[name]['sha256']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _write_archive(path: str, members: Dict[str, bytes], manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Write members (stored, aligned) plus the manifest, replacing path atomically"""
+    manifest = dict(manifest)
+    manifest["members"] = {
+        name: {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+        for name, data in members.items()
+    }
+    manifest["checksum"] = _bundle_checksum(manifest["members"])
+    manifest.setdefault("model_version", manifest["checksum"][:16])
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            entries = [(MANIFEST_NAME, json.dumps(manifest, indent=2).encode("utf-8"))]
+            entries.extend(members.items())
+            for name, data in entries:
+                info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                # Pad the local header so the member's data starts on an aligned offset
+                header_end = archive.fp.tell() + _LOCAL_HEADER.size + len(name.encode("utf-8")) + 4
+                padding = -header_end % ALIGNMENT
+                info.extra = struct.pack("<HH", _PADDING_EXTRA_ID, padding) + b"\0" * padding
+                archive.writestr(info, data)
+        # Readers that already mapped the old bundle keep their (unlinked) copy
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return manifest
+
+
+def write_bundle(path: str,
+                 model_path: str,
+                 layout: str,
+                 crop_to_global_classes: Dict[str, List[int]],
+                 class_labels: List[str],
+                 crop_labels: List[str],
+                 preprocess_config: Dict[str, Any],
+                 head_weights: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None,
+                 variants: Optional[Dict[str, str]] = None,
+                 model_version: Optional[str] = None) -> Dict[str, Any]:
+    """Write a model bundle
+
+    Args:
+        path: Bundle file to write
+        model_path: ONNX graph for the layout ("routed", "split" or "fused")
+        head_weights: crop ID string -> (weight, bias), stacked into heads/*.npy
+        variants: extra precision variants, e.g. {"int8": "mobilenet_routed_int8.onnx"}
+        model_version: explicit version (defaults to a prefix of the bundle checksum)
+
+    Returns:
+        The manifest that was written
+    """
+    if layout not in ("routed", "split", "fused"):
+        raise ValueError(f"Unknown model layout: {layout}")
+    if layout == "split" and not head_weights:
+        raise ValueError("The split layout needs the crop head weights")
+
+    crop_to_global_classes = {str(cid): [int(c) for c in classes] for cid, classes in crop_to_global_classes.items()}
+    with open(model_path, "rb") as f:
+        members = {variant_member(): f.read()}
+    for variant, variant_path in (variants or {}).items():
+        with open(variant_path, "rb") as f:
+            members[variant_member(variant)] = f.read()
+
+    members[LABELS_NAME] = json.dumps({
+        "class_labels": list(class_labels),
+        "crop_labels": list(crop_labels),
+        "crop_to_global_classes": crop_to_global_classes,
+        "preprocess": preprocess_config,
+    }, indent=2).encode("utf-8")
+
+    segments = build_crop_segments(crop_to_global_classes)
+    for name in TABLE_NAMES:
+        members[f"tables/{name}.npy"] = _npy_bytes(segments[name])
+
+    if head_weights:
+        crop_ids = sorted(head_weights.keys())
+        if crop_ids != sorted(crop_to_global_classes.keys()):
+            raise ValueError("Head weights and crop_to_global_classes cover different crops")
+        members["heads/weight.npy"] = _npy_bytes(np.concatenate(
+            [np.asarray(head_weights[cid][0], dtype=np.float32) for cid in crop_ids], axis=0))
+        members["heads/bias.npy"] = _npy_bytes(np.concatenate(
+            [np.asarray(head_weights[cid][1], dtype=np.float32) for cid in crop_ids], axis=0))
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "layout": layout,
+        "variants": sorted(["fp32"] + [variant.lower() for variant in (variants or {})]),
+        "created_at": time.time(),
+    }
+    if model_version:
+        manifest["model_version"] = model_version
+    return _write_archive(path, members, manifest)
+
+
+def add_bundle_variant(path: str, variant: str, model_path: str) -> Dict[str, Any]:
+    """Add (or replace) a precision variant of the graph in an existing bundle"""
+    bundle = ModelBundle(path)
+    members = {name: bundle.read_bytes(name) for name in bundle.manifest["members"]}
+    with open(model_path, "rb") as f:
+        members[variant_member(variant)] = f.read()
+
+    manifest = {key: value for key, value in bundle.manifest.items()
+                if key not in ("members", "checksum", "model_version")}
+    manifest["variants"] = sorted(set(manifest.get("variants", ["fp32"])) | {variant.lower()})
+    manifest["created_at"] = time.time()
+    return _write_archive(path, members, manifest)
+
+
+class ModelBundle:
+    """Read-only, memory-mapped view of a model bundle
+
+    Arrays returned by array() point into the mapping (no copy), so keep
+    them read-only. The mapping stays open as long as any of them is alive.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._members = self._index(f)
+        # Missing variants already warned about
+        self._missing_variants = set()
+
+        self.manifest = json.loads(self.read_bytes(MANIFEST_NAME))
+        if self.manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{path} is not a model bundle")
+        if self.manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle version {self.manifest.get('format_version')} in {path}")
+        if verify:
+            self.verify()
+        self.labels = json.loads(self.read_bytes(LABELS_NAME))
+
+    def _index(self, f) -> Dict[str, Tuple[int, int]]:
+        """Member name -> (data offset, size) from the zip directory"""
+        members = {}
+        with zipfile.ZipFile(f) as archive:
+            for info in archive.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError(f"Bundle member {info.filename} is compressed")
+                header = _LOCAL_HEADER.unpack_from(self._map, info.header_offset)
+                name_length, extra_length = header[-2], header[-1]
+                start = info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+                members[info.filename] = (start, info.file_size)
+        return members
+
+    def verify(self):
+        """Check every member against the manifest checksums"""
+        expected = self.manifest.get("members", {})
+        if _bundle_checksum(expected) != self.manifest.get("checksum"):
+            raise ValueError(f"Model bundle manifest checksum mismatch in {self.path}")
+        for name, entry in expected.items():
+            if name not in self._members:
+                raise ValueError(f"Model bundle {self.path} is missing {name}")
+            if hashlib.sha256(self.view(name)).hexdigest() != entry["sha256"]:
+                raise ValueError(f"Model bundle member {name} is corrupt in {self.path}")
+
+    @property
+    def layout(self) -> str:
+        return self.manifest["layout"]
+
+    @property
+    def model_version(self) -> str:
+        return self.manifest["model_version"]
+
+    @property
+    def checksum(self) -> str:
+        return self.manifest["checksum"]
+
+    @property
+    def variants(self) -> List[str]:
+        return list(self.manifest.get("variants", ["fp32"]))
+
+    def has(self, name: str) -> bool:
+        return name in self._members
+
+    def view(self, name: str) -> memoryview:
+        """Zero-copy view of a member's bytes"""
+        start, size = self._members[name]
+        return memoryview(self._map)[start:start + size]
+
+    def read_bytes(self, name: str) -> bytes:
+        return bytes(self.view(name))
+
+    def member_checksum(self, name: str) -> str:
+        return self.manifest["members"][name]["sha256"]
+
+    def array(self, name: str) -> np.ndarray:
+        """A .npy member as an array backed by the mapping"""
+        start, size = self._members[name]
+        header = io.BytesIO(self.view(name)[:min(size, 64 * 1024)])
+        version = np.lib.format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+        count = int(np.prod(shape)) if shape else 1
+        array = np.frombuffer(self._map, dtype=dtype, count=count, offset=start + header.tell())
+        return array.reshape(shape, order="F" if fortran_order else "C")
+
+    def crop_segments(self) -> Dict[str, Any]:
+        """The precomputed crop segment tables (same keys as build_crop_segments)"""
+        segments = {name: self.array(f"tables/{name}.npy") for name in TABLE_NAMES}
+        segments["offsets"] = {str(int(cid)): int(start) for cid, start in zip(segments["crop_ids"], segments["starts"])}
+        return segments
+
+    def fused_heads(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Stacked (weight, bias) of all crop heads, or None if not bundled"""
+        if not self.has("heads/weight.npy"):
+            return None
+        return self.array("heads/weight.npy"), self.array("heads/bias.npy")
+
+    def head_weights(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Crop ID string -> (weight, bias), as views into the stacked heads"""
+        heads = self.fused_heads()
+        if heads is None:
+            return {}
+        weight, bias = heads
+        crop_to_global_classes = self.labels["crop_to_global_classes"]
+        offsets = self.crop_segments()["offsets"]
+        return {
+            cid: (weight[offsets[cid]:offsets[cid] + len(classes)], bias[offsets[cid]:offsets[cid] + len(classes)])
+            for cid, classes in crop_to_global_classes.items()
+        }
+
+    def model_member(self, variant: Optional[str] = None) -> str:
+        """Archive member of the requested variant, falling back to fp32"""
+        member = variant_member(variant)
+        if not self.has(member):
+            if member not in self._missing_variants:
+                self._missing_variants.add(member)
+                print(f"⚠️ Model variant '{variant}' not in bundle {self.path}, using fp32")
+            member = variant_member()
+        return member
+
+    def describe(self, variant: Optional[str] = None) -> str:
+        """Display path of a bundled graph, e.g. models/model_bundle.zip#model.onnx"""
+        return f"{self.path}#{self.model_member(variant)}"
+
+    def session_factory(self, variant: Optional[str] = None):
+        """ModelRuntime session factory that builds sessions from the bundled graph
+
+        Each session gets its own copy of the graph bytes (see the module docstring).
+        """
+        from .runtime_profile import create_session
+
+        member = self.model_member(variant)
+
+        def factory(model_path: str):
+            return create_session(model_path, model_bytes=self.read_bytes(member),
+                                  checksum=self.member_checksum(member))
+        return factory
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "layout": self.layout,
+            "model_version": self.model_version,
+            "checksum": self.checksum,
+            "variants": self.variants,
+            "size_bytes": len(self._map),
+            "created_at": self.manifest.get("created_at"),
+        }
+
+
+_bundle = None
+_bundle_checked = False
+_bundle_lock = threading.Lock()
+
+
+def open_model_bundle(path: Optional[str] = None) -> Optional[ModelBundle]:
+    """Open the configured bundle, or None to serve the loose model files
+    
+    The converter writes both, bundle last. With MODEL_BUNDLE=auto the bundle
+    is skipped when a loose file is newer than it (swapped in for a hot
+    reload, or quantized without --bundle), or when only the loose files
+    have MODEL_VARIANT. MODEL_BUNDLE=true always uses it, false never does.
+    """
+    path = path or MODEL_BUNDLE_PATH
+    if MODEL_BUNDLE == "false" or not path or not os.path.exists(path):
+        return None
+    if MODEL_BUNDLE == "auto":
+        bundle_mtime = os.stat(path).st_mtime_ns
+        newer = [loose for loose in loose_model_files(MODEL_VARIANT) if os.stat(loose).st_mtime_ns > bundle_mtime]
+        if newer:
+            print(f"ℹ️ {newer[0]} is newer than the model bundle {path}, serving the loose model files")
+            return None
+    bundle = ModelBundle(path)
+    if MODEL_BUNDLE == "auto" and not bundle.has(variant_member(MODEL_VARIANT)):
+        graphs = [path for path in (ROUTED_MODEL_PATH, BACKBONE_MODEL_PATH, *get_model_paths()) if path]
+        loose_variants = [variant_path(graph, MODEL_VARIANT) for graph in graphs
+                          if variant_path(graph, MODEL_VARIANT) != graph and os.path.exists(variant_path(graph, MODEL_VARIANT))]
+        if loose_variants:
+            print(f"ℹ️ Model variant '{MODEL_VARIANT}' is not in the bundle but {loose_variants[0]} is, "
+                  f"serving the loose model files")
+            return None
+    return bundle
+
+
+def get_model_bundle() -> Optional[ModelBundle]:
+    """The active bundle (opened once), or None to use the loose model files"""
+    global _bundle, _bundle_checked
+
+    if not _bundle_checked:
+        with _bundle_lock:
+            if not _bundle_checked:
+                _bundle = open_model_bundle()
+                if _bundle is not None:
+                    print(f"✅ Mapped model bundle {_bundle.model_version} from: {_bundle.path}")
+                _bundle_checked = True
+    return _bundle
+
+
+def set_model_bundle(bundle: Optional[ModelBundle]):
+    """Make a (newly loaded) bundle the active one"""
+    global _bundle, _bundle_checked
+
+    with _bundle_lock:
+        _bundle = bundle
+        _bundle_checked = True
@@ -0,0 +1,327 @@
+"""
+ONNX Runtime session pool for model inference
+
+One ModelRuntime owns every session for a model file. Sessions are created
+once, on first use, behind a lock so concurrent first requests never load the
+model twice (single-flight). Calls are spread over a fixed number of run
+slots: with several sessions each slot maps to its own session, and with one
+shared session (InferenceSession.run is thread-safe) the slots simply bound
+how many runs execute at once. Utilization metrics show whether the slots
+are saturated.
+
+Each slot can also own preallocated input and output buffers bound to its
+session with IOBinding (bind()), so steady-state runs write into the same
+memory every time instead of allocating fresh arrays per call.
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .config import INFERENCE_SESSION_POOL_SIZE, INFERENCE_MAX_CONCURRENT_RUNS, INFERENCE_IO_BINDING
+
+# ONNX tensor element types the exported graphs use
+_ONNX_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+}
+
+
+class BoundBuffers:
+    """Preallocated inputs and outputs of one run slot, bound with IOBinding
+
+    Buffers are sized for the largest batch seen so far. A batch of n uses
+    their first n rows, which stay contiguous, so each batch size gets its
+    own IOBinding over the same memory. The arrays handed out by inputs and
+    run() are views into these buffers: they are overwritten by the slot's
+    next run, so copy anything that has to outlive it.
+    """
+
+    def __init__(self, session, io_binding: bool = True):
+        self.session = session
+        self.io_binding = io_binding and hasattr(session, "io_binding")
+        self.capacity = 0
+        self._inputs = {}
+        self._outputs = {}
+        self._bindings = {}
+        self._input_specs = [
+            (model_input.name, tuple(model_input.shape[1:]), _ONNX_DTYPES.get(model_input.type, np.float32))
+            for model_input in session.get_inputs()
+        ]
+        self._output_specs = None
+
+    def _probe_outputs(self):
+        """Output row shapes and dtypes, from one run at batch size 1"""
+        feeds = {name: np.zeros((1,) + shape, dtype=dtype) for name, shape, dtype in self._input_specs}
+        names = [output.name for output in self.session.get_outputs()]
+        return [(name, value.shape[1:], value.dtype) for name, value in zip(names, self.session.run(None, feeds))]
+
+    def reserve(self, batch_size: int):
+        """Grow the buffers to hold at least batch_size rows"""
+        if batch_size <= self.capacity:
+            return
+        if self.io_binding and self._output_specs is None:
+            self._output_specs = self._probe_outputs()
+        self._inputs = {name: np.zeros((batch_size,) + shape, dtype=dtype)
+                        for name, shape, dtype in self._input_specs}
+        self._outputs = {name: np.zeros((batch_size,) + shape, dtype=dtype)
+                         for name, shape, dtype in (self._output_specs or [])}
+        self._bindings = {}
+        self.capacity = batch_size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (*self._inputs.values(), *self._outputs.values()))
+
+    def inputs(self, batch_size: int) -> Dict[str, np.ndarray]:
+        """Input rows to fill for a batch of this size"""
+        self.reserve(batch_size)
+        return {name: array[:batch_size] for name, array in self._inputs.items()}
+
+    def _binding(self, batch_size: int):
+        binding = self._bindings.get(batch_size)
+        if binding is None:
+            binding = self.session.io_binding()
+            for name, array in self._inputs.items():
+                binding.bind_cpu_input(name, array[:batch_size])
+            for name, array in self._outputs.items():
+                rows = array[:batch_size]
+                binding.bind_output(name, "cpu", 0, rows.dtype, rows.shape, rows.ctypes.data)
+            self._bindings[batch_size] = binding
+        return binding
+
+    def run(self, batch_size: int, run_options=None) -> Dict[str, np.ndarray]:
+        """Run the session on the first batch_size input rows
+
+        Returns:
+            Output name -> views of the bound output rows
+        """
+        self.reserve(batch_size)
+        if not self.io_binding:
+            # Sessions without IOBinding still reuse the input buffers
+            names = [output.name for output in self.session.get_outputs()]
+            return dict(zip(names, self.session.run(None, self.inputs(batch_size), run_options)))
+        self.session.run_with_iobinding(self._binding(batch_size), run_options)
+        return {name: array[:batch_size] for name, array in self._outputs.items()}
+
+
+class BoundBatch:
+    """One batch on a held run slot: fill inputs, run(), read the output views"""
+
+    def __init__(self, runtime: "ModelRuntime", slot: int, buffers: BoundBuffers, batch_size: int):
+        self._runtime = runtime
+        self._slot = slot
+        self._buffers = buffers
+        self.batch_size = batch_size
+        self.inputs = buffers.inputs(batch_size)
+
+    def run(self, run_options=None) -> Dict[str, np.ndarray]:
+        return self._runtime._run_on_slot(self._slot, self._buffers.run, self.batch_size, run_options)
+
+
+class ModelRuntime:
+    """Pool of InferenceSessions for one model with bounded concurrent runs
+
+    Exposes the subset of the InferenceSession API the inference code uses
+    (get_inputs, get_outputs, get_providers, run), so it can stand in for a
+    single session.
+    """
+
+    def __init__(self,
+                 model_path: str,
+                 pool_size: int = INFERENCE_SESSION_POOL_SIZE,
+                 max_concurrent_runs: int = INFERENCE_MAX_CONCURRENT_RUNS,
+                 session_factory: Optional[Callable[[str], Any]] = None,
+                 bundle: Any = None,
+                 io_binding: bool = INFERENCE_IO_BINDING):
+        if session_factory is None:
+            from .runtime_profile import create_session
+            session_factory = create_session
+
+        self.model_path = model_path
+        # Model bundle the sessions are built from (None for loose model files)
+        self.bundle = bundle
+        self.pool_size = max(1, int(pool_size))
+        # Never fewer slots than sessions, or some sessions would sit idle
+        self.slots = max(self.pool_size, int(max_concurrent_runs or 0))
+        self.io_binding = io_binding
+        self._session_factory = session_factory
+        self._sessions = []
+        # Preallocated IOBinding buffers per run slot, created on first bind()
+        self._bound = []
+        self._free_slots = queue.Queue()
+        self._init_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._stats_lock = threading.Lock()
+
+        # Metrics
+        self._load_seconds = 0.0
+        self._created_at = time.monotonic()
+        self._runs = 0
+        self._failed_runs = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._busy_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._session_runs = []
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    def load(self) -> "ModelRuntime":
+        """Create the sessions if needed (single-flight across threads)"""
+        if self._loaded.is_set():
+            return self
+        with self._init_lock:
+            if not self._loaded.is_set():
+                started = time.monotonic()
+                sessions = [self._session_factory(self.model_path) for _ in range(self.pool_size)]
+                for slot in range(self.slots):
+                    self._free_slots.put(slot)
+                self._sessions = sessions
+                self._bound = [None] * self.slots
+                self._session_runs = [0] * len(sessions)
+                self._load_seconds = time.monotonic() - started
+                self._created_at = time.monotonic()
+                self._loaded.set()
+                print(f"✅ Model runtime ready: {self.pool_size} session(s), {self.slots} run slot(s) "
+                      f"in {self._load_seconds * 1000:.0f} ms")
+        return self
+
+    def warm_up(self, feeds_list: List[Dict[str, Any]]) -> float:
+        """Run every feed dict through every session once (not counted in metrics)
+
+        The first runs at a given batch shape allocate buffers and pick
+        kernels, so doing them up front keeps that cost off real requests.
+        Every slot's bound buffers are preallocated for the largest batch.
+
+        Returns:
+            Warm-up time in milliseconds
+        """
+        self.load()
+        started = time.monotonic()
+        for session in self._sessions:
+            for feeds in feeds_list:
+                session.run(None, feeds)
+        sizes = [len(value) for feeds in feeds_list for value in feeds.values()]
+        if sizes:
+            self.reserve(max(sizes))
+        return (time.monotonic() - started) * 1000.0
+
+    # InferenceSession-compatible metadata
+
+    def get_inputs(self):
+        return self.load()._sessions[0].get_inputs()
+
+    def get_outputs(self):
+        return self.load()._sessions[0].get_outputs()
+
+    def get_providers(self):
+        return self.load()._sessions[0].get_providers()
+
+    def _session_for(self, slot: int):
+        return self._sessions[slot % self.pool_size]
+
+    def _acquire(self) -> int:
+        """Wait for a free run slot"""
+        self.load()
+        waited = time.monotonic()
+        slot = self._free_slots.get()
+        with self._stats_lock:
+            self._wait_seconds += time.monotonic() - waited
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        return slot
+
+    def _release(self, slot: int):
+        self._free_slots.put(slot)
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def _run_on_slot(self, slot: int, run: Callable[..., Any], *args):
+        started = time.monotonic()
+        failed = False
+        try:
+            return run(*args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._stats_lock:
+                self._runs += 1
+                self._failed_runs += int(failed)
+                self._busy_seconds += time.monotonic() - started
+                self._session_runs[slot % self.pool_size] += 1
+
+    def run(self, output_names: Optional[List[str]], feeds: Dict[str, Any], run_options=None):
+        """Run on a free slot's session, waiting for one if all are busy"""
+        slot = self._acquire()
+        try:
+            return self._run_on_slot(slot, self._session_for(slot).run, output_names, feeds, run_options)
+        finally:
+            self._release(slot)
+
+    @contextmanager
+    def bind(self, batch_size: int) -> Iterator[BoundBatch]:
+        """Hold a run slot and its preallocated buffers for one batch
+
+        Write the inputs into batch.inputs, call batch.run() and read the
+        returned output views before leaving the block; the slot (and its
+        buffers) goes back to the pool on exit.
+        """
+        slot = self._acquire()
+        try:
+            buffers = self._bound[slot]
+            if buffers is None:
+                buffers = self._bound[slot] = BoundBuffers(self._session_for(slot), self.io_binding)
+            yield BoundBatch(self, slot, buffers, batch_size)
+        finally:
+            self._release(slot)
+
+    def reserve(self, batch_size: int):
+        """Preallocate every slot's bound buffers for batches up to batch_size
+
+        Takes all the slots first, so no batch is using the buffers while
+        they are replaced.
+        """
+        self.load()
+        held = [self._free_slots.get() for _ in range(self.slots)]
+        try:
+            for slot in held:
+                if self._bound[slot] is None:
+                    self._bound[slot] = BoundBuffers(self._session_for(slot), self.io_binding)
+                self._bound[slot].reserve(batch_size)
+        finally:
+            for slot in held:
+                self._free_slots.put(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size and utilization metrics"""
+        with self._stats_lock:
+            elapsed = max(time.monotonic() - self._created_at, 1e-9)
+            runs = self._runs
+            return {
+                "model_path": self.model_path,
+                "loaded": self._loaded.is_set(),
+                "load_ms": self._load_seconds * 1000.0,
+                "sessions": self.pool_size,
+                "run_slots": self.slots,
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+                "runs": runs,
+                "failed_runs": self._failed_runs,
+                "session_runs": list(self._session_runs),
+                "io_binding": self.io_binding,
+                "bound_buffer_bytes": sum(buffers.nbytes for buffers in self._bound if buffers is not None),
+                "avg_run_ms": (self._busy_seconds / runs * 1000.0) if runs else 0.0,
+                "avg_slot_wait_ms": (self._wait_seconds / runs * 1000.0) if runs else 0.0,
+                # Share of slot-time spent running since the runtime loaded
+                "utilization": self._busy_seconds / (elapsed * self.slots) if self._loaded.is_set() else 0.0,
+            }
@@ -0,0 +1,219 @@
+"""
+Dependency-aware fan-out of the post-inference request stages
+
+After inference an upload still has to store the image, render and store the
+heatmap, build the diagnosis text and ask Ollama for more, and only the final
+database insert needs all of them. A Pipeline runs every stage as soon as the
+stages it depends on have finished, so the request takes about as long as
+its slowest chain instead of the sum of all stages.
+
+Every stage has its own timeout. A stage that fails or times out can hand
+over to a fallback (e.g. queue the work for a retry later). Otherwise a
+required stage cancels the rest and fails the request, and an optional one
+(the heatmap, the LLM text) gets its default and the request carries on.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+
+class PipelineError(RuntimeError):
+    """Raised when a required pipeline stage fails or times out"""
+
+    def __init__(self, stage: str, error: BaseException):
+        self.stage = stage
+        self.error = error
+        super().__init__(f"Stage '{stage}' failed: {error or type(error).__name__}")
+
+
+class _Stage:
+    __slots__ = ("name", "func", "after", "timeout", "required", "default", "fallback")
+
+    def __init__(self, name, func, after, timeout, required, default, fallback):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.required = required
+        self.default = default
+        self.fallback = fallback
+
+
+class PipelineStats:
+    """Per-stage run counts, timeouts, failures and latency"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._runs = 0
+        self._total_seconds = 0.0
+
+    def record_stage(self, name: str, seconds: float, outcome: str):
+        with self._lock:
+            stage = self._stages.setdefault(name, {"runs": 0, "timeouts": 0, "failures": 0, "fallbacks": 0,
+                                                       "total_seconds": 0.0})
+            stage["runs"] += 1
+            stage["total_seconds"] += seconds
+            if outcome == "timeout":
+                stage["timeouts"] += 1
+            elif outcome == "failed":
+                stage["failures"] += 1
+            elif outcome == "fallback":
+                stage["fallbacks"] += 1
+
+    def record_run(self, seconds: float):
+        with self._lock:
+            self._runs += 1
+            self._total_seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runs": self._runs,
+                "avg_ms": (self._total_seconds / self._runs * 1000.0) if self._runs else 0.0,
+                "stages": {
+                    name: {
+                        "runs": stage["runs"],
+                        "timeouts": stage["timeouts"],
+                        "failures": stage["failures"],
+                        "fallbacks": stage["fallbacks"],
+                        "avg_ms": stage["total_seconds"] / stage["runs"] * 1000.0,
+                    }
+                    for name, stage in self._stages.items()
+                },
+            }
+
+
+class Pipeline:
+    """A set of async stages wired by their dependencies
+
+    Each stage function receives the dict of results produced so far, which
+    always holds the results of the stages it runs after.
+    """
+
+    def __init__(self, stats: Optional[PipelineStats] = None,
+                 on_stage: Optional[Callable[[str, Any], None]] = None):
+        self._stages = {}
+        self.stats = stats
+        # Called with (stage name, result) as each stage finishes, defaults included
+        self.on_stage = on_stage
+        self.timings = {}
+
+    def add(self,
+            name: str,
+            func: Callable[[Dict[str, Any]], Awaitable[Any]],
+            after: Iterable[str] = (),
+            timeout: Optional[float] = None,
+            required: bool = True,
+            default: Any = None,
+            fallback: Optional[Callable[[Dict[str, Any], BaseException], Awaitable[Any]]] = None) -> "Pipeline":
+        """Add a stage
+
+        Args:
+            name: Stage name, also the key of its result
+            func: Coroutine function taking the results so far
+            after: Stages that must finish first
+            timeout: Seconds the stage may take (None or 0 = no limit)
+            required: Whether failing or timing out fails the whole pipeline
+            default: Result used when an optional stage fails or times out
+            fallback: Coroutine function taking (results, error) whose result is
+                      used instead when the stage fails or times out
+        """
+        if name in self._stages:
+            raise ValueError(f"Duplicate pipeline stage '{name}'")
+        self._stages[name] = _Stage(name, func, after, timeout or None, required, default, fallback)
+        return self
+
+    def _validate(self):
+        for stage in self._stages.values():
+            for dependency in stage.after:
+                if dependency not in self._stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+        # Kahn's algorithm - every stage must be reachable without a cycle
+        remaining = {name: set(stage.after) for name, stage in self._stages.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Pipeline stages form a cycle: {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    async def _run_stage(self, stage: _Stage, tasks: Dict[str, asyncio.Task], results: Dict[str, Any]):
+        if stage.after:
+            await asyncio.gather(*(tasks[name] for name in stage.after))
+
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            result = await asyncio.wait_for(stage.func(results), stage.timeout)
+        except asyncio.TimeoutError as e:
+            outcome = "timeout"
+            error = e
+        except Exception as e:
+            outcome = "failed"
+            error = e
+
+        if outcome != "ok" and stage.fallback is not None:
+            try:
+                result = await stage.fallback(results, error)
+                print(f"⚠️ Stage '{stage.name}' {'timed out' if outcome == 'timeout' else 'failed'} "
+                      f"({error or type(error).__name__}), used its fallback")
+                outcome = "fallback"
+            except Exception as e:
+                error = e
+
+        elapsed = time.monotonic() - started
+        self.timings[stage.name] = elapsed * 1000.0
+        if self.stats is not None:
+            self.stats.record_stage(stage.name, elapsed, outcome)
+
+        if outcome not in ("ok", "fallback"):
+            if stage.required:
+                raise PipelineError(stage.name, error)
+            print(f"⚠️ Optional stage '{stage.name}' {'timed out' if outcome == 'timeout' else 'failed'}, "
+                  f"continuing without it: {error}")
+            result = stage.default
+        results[stage.name] = result
+        if self.on_stage is not None:
+            self.on_stage(stage.name, result)
+        return result
+
+    async def run(self, results: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Run every stage, each as soon as its dependencies are done
+
+        Args:
+            results: Initial values visible to every stage (optional)
+
+        Returns:
+            The results dict, with one entry per stage
+
+        Raises:
+            PipelineError: If a required stage failed or timed out
+        """
+        self._validate()
+        results = dict(results or {})
+        started = time.monotonic()
+
+        tasks = {}
+        for name, stage in self._stages.items():
+            tasks[name] = asyncio.ensure_future(self._run_stage(stage, tasks, results))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # Let the cancelled stages unwind before the error propagates
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            if self.stats is not None:
+                self.stats.record_run(time.monotonic() - started)
+        return results
+
+
+# Stage metrics of the /api/upload pipeline
+upload_pipeline_stats = PipelineStats()
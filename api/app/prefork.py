@@ -0,0 +1,218 @@
+"""
+Pre-fork server: load once in the parent, then fork the workers
+
+uvicorn's --workers starts every worker as a fresh interpreter, so each one
+imports the app and loads the labels, crop tables, head weights and model
+bundle on its own. PreforkServer instead does all of that once in the
+parent, binds the listening socket and then forks the workers. Read-only
+data stays in pages shared copy-on-write (gc.freeze keeps the collector from
+writing to them) and the bundle's mapping is shared outright. ONNX Runtime
+sessions still hold private copies of the graph weights, one per worker.
+
+Anything that does not survive a fork is created in each worker after it:
+ONNX Runtime sessions and their thread pools, the batcher and CPU pool
+threads, the Supabase and HTTP clients. ORT intra-op threads are split
+across the workers so N workers don't each size a pool for the whole
+machine.
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Any, Dict, Optional
+
+# Worker number in a pre-fork worker process, None otherwise
+_worker_id = None
+
+# Seconds to wait before restarting a worker that exited unexpectedly
+RESTART_DELAY_SECONDS = 1.0
+# Seconds workers get to finish in-flight requests on shutdown
+SHUTDOWN_TIMEOUT_SECONDS = 30.0
+
+
+def get_worker_id() -> Optional[int]:
+    return _worker_id
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects affinity / cgroup cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def split_intra_op_threads(workers: int, cpus: Optional[int] = None) -> int:
+    """Intra-op threads per worker so all workers together use each CPU once"""
+    cpus = cpus or available_cpus()
+    return max(1, cpus // max(1, workers))
+
+
+def get_server_workers() -> int:
+    """WEB_CONCURRENCY if set, else the runtime profile's tuned worker count, else 1"""
+    from .config import SERVER_WORKERS
+    from .runtime_profile import load_profile_section
+
+    if "WEB_CONCURRENCY" in os.environ:
+        return SERVER_WORKERS
+    return int(load_profile_section("server").get("workers", SERVER_WORKERS))
+
+
+def preload() -> Dict[str, Any]:
+    """Import the app and load every read-only model table in this process
+
+    Never creates ONNX Runtime sessions or starts threads: both would be
+    unusable in the forked children.
+    """
+    from . import inference
+    from .main import app  # noqa: F401 - imports every route module
+    from .model_bundle import get_model_bundle
+    from .runtime_profile import validate_optimized_cache
+    from .utils.cam import load_head_weights
+    from .utils.image_utils import get_preprocessor
+
+    started = time.monotonic()
+    bundle = get_model_bundle()
+    inference.load_crop_to_global_classes()
+    inference.get_crop_segments()
+    if load_head_weights():
+        inference.get_fused_heads()
+    get_preprocessor()
+    version = inference.get_model_version()
+    # Once here instead of racing in every worker's startup
+    validate_optimized_cache()
+
+    return {
+        "bundle": bundle.path if bundle is not None else None,
+        "model_version": version,
+        "preload_ms": (time.monotonic() - started) * 1000.0,
+    }
+
+
+class PreforkServer:
+    """Preloads the app, binds the socket and supervises forked uvicorn workers"""
+
+    def __init__(self, app: str, host: str, port: int, workers: int, log_level: str = "info"):
+        self.app = app
+        self.host = host
+        self.port = int(port)
+        self.workers = max(1, int(workers))
+        self.log_level = log_level
+        self._socket = None
+        self._children = {}
+        self._stopping = False
+
+    def bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def configure_threads(self):
+        """Give each worker its share of the CPUs unless threads are set explicitly"""
+        from .runtime_profile import get_runtime_profile
+
+        profile = get_runtime_profile()
+        if not profile["intra_op_threads"]:
+            profile["intra_op_threads"] = split_intra_op_threads(self.workers)
+        return profile["intra_op_threads"]
+
+    def run(self):
+        self._socket = self.bind()
+        threads = self.configure_threads()
+        info = preload()
+        print(f"✅ Preloaded model {info['model_version']} in {info['preload_ms']:.0f} ms"
+              f"{' from ' + info['bundle'] if info['bundle'] else ''}; "
+              f"forking {self.workers} worker(s) with {threads} intra-op thread(s) each")
+
+        # Everything allocated so far is shared with the workers; keep the
+        # cyclic GC from touching (and so copying) those pages
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        try:
+            self._supervise()
+        finally:
+            self._socket.close()
+
+    def _spawn(self, worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(worker_id)
+            except BaseException as e:
+                print(f"❌ Worker {worker_id} crashed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self._children[pid] = (worker_id, time.monotonic())
+        print(f"🚀 Started worker {worker_id} (pid {pid})")
+
+    def _run_worker(self, worker_id: int):
+        global _worker_id
+        import uvicorn
+
+        _worker_id = worker_id
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        config = uvicorn.Config(self.app, log_level=self.log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self._socket])
+
+    def _handle_stop(self, signum, frame):
+        if not self._stopping:
+            print(f"🛑 Stopping {len(self._children)} worker(s)...")
+        self._stopping = True
+        self._signal_children(signal.SIGTERM)
+
+    def _signal_children(self, signum: int):
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _supervise(self):
+        deadline = None
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if self._stopping:
+                    deadline = deadline or time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+                    if time.monotonic() > deadline:
+                        print("⚠️ Workers did not stop in time, killing them")
+                        self._signal_children(signal.SIGKILL)
+                time.sleep(0.2)
+                continue
+
+            worker_id, started = self._children.pop(pid)
+            if self._stopping:
+                continue
+            print(f"⚠️ Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)} "
+                  f"after {time.monotonic() - started:.0f} s, restarting")
+            time.sleep(RESTART_DELAY_SECONDS)
+            if not self._stopping:
+                self._spawn(worker_id)
+
+
+def serve(app: str, host: str, port: int, workers: int, log_level: str = "info"):
+    """Run the app with preloaded, forked workers (uvicorn's own workers where fork is unavailable)"""
+    if not hasattr(os, "fork"):
+        import uvicorn
+        print("⚠️ os.fork is not available, falling back to uvicorn workers")
+        uvicorn.run(app, host=host, port=port, workers=workers, log_level=log_level)
+        return
+    PreforkServer(app, host, port, workers, log_level).run()
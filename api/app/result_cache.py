@@ -0,0 +1,257 @@
+"""
+Content-hash result cache for repeat uploads
+
+Mobile clients on poor connections often retry the same upload after a
+timeout. Results are keyed by a hash of the image bytes plus the normalized
+crop name and the model version, so a retry returns the stored detection
+without decoding, inference, heatmap rendering, storage or the LLM call.
+
+The in-memory tier is an LRU bounded by entry count and approximate size,
+with a TTL. An optional on-disk tier (one JSON file per entry) survives
+restarts and is shared by workers on the same host.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from .config import (
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_DIR,
+)
+
+# How many writes between sweeps of expired files in the disk tier
+_DISK_PRUNE_INTERVAL = 100
+
+
+def normalize_crop_name(crop_name: Optional[str]) -> str:
+    """Crop names are matched case-insensitively by the model"""
+    return (crop_name or "").strip().lower()
+
+
+def hash_image(image_data: bytes) -> str:
+    """Content hash of the uploaded image bytes"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def make_cache_key(image_hash: str, crop_name: Optional[str], model_version: str) -> str:
+    """Cache key for an image hash, crop and model version"""
+    raw = f"{image_hash}|{normalize_crop_name(crop_name)}|{model_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache of JSON-serialisable results
+
+    The memory tier keeps its own copy of every value and get() hands out
+    copies, so callers can change what they store or get back without
+    changing the cached entry.
+    """
+
+    def __init__(self,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+                 disk_dir: Optional[str] = None,
+                 clock: Callable[[], float] = time.time):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl_seconds = float(ttl_seconds)
+        self.disk_dir = disk_dir
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+
+        # Metrics
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached value, or None on a miss or expired entry"""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, _, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return copy.deepcopy(value)
+                self._remove(key)
+
+        record = self._disk_get(key, now)
+        with self._lock:
+            if record is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._hits += 1
+        # Promote into memory with its remaining lifetime
+        expires_at, value = record
+        self._memory_set(key, value, expires_at)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a value for the configured TTL"""
+        expires_at = self._clock() + self.ttl_seconds
+        self._memory_set(key, value, expires_at)
+        self._disk_set(key, value, expires_at)
+
+    def invalidate(self, key: str):
+        """Drop a key from both tiers"""
+        with self._lock:
+            self._remove(key)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Drop all in-memory entries (the disk tier is left alone)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_tier": bool(self.disk_dir),
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+    # Memory tier
+
+    def _memory_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    # Disk tier
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key: str, now: float):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if record.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return record["expires_at"], record["value"]
+
+    def _disk_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, default=str)
+            # Atomic rename so concurrent readers never see a partial file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not write result cache entry to disk: {e}")
+            return
+
+        with self._lock:
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= _DISK_PRUNE_INTERVAL
+            if prune:
+                self._writes_since_prune = 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Delete expired entries from the disk tier"""
+        if not self.disk_dir:
+            return
+        now = self._clock()
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                with open(path, "r") as f:
+                    expires_at = json.load(f).get("expires_at", 0)
+                if expires_at <= now:
+                    os.remove(path)
+            except (OSError, ValueError):
+                continue
+
+
+# Shared cache - lazily created on first use
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Get the process-wide result cache, or None when caching is disabled"""
+    global _result_cache
+
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(disk_dir=RESULT_CACHE_DIR or None)
+    return _result_cache
+
+
+def get_result_cache_stats() -> Dict[str, Any]:
+    """Cache metrics, or a disabled marker when caching is off"""
+    cache = get_result_cache()
+    if cache is None:
+        return {"enabled": False}
+    stats = cache.stats()
+    stats["enabled"] = True
+    return stats
@@ -0,0 +1,380 @@
+"""
+ONNX Runtime session profile and optimized-graph cache
+
+Sessions are created from a runtime profile: thread counts, execution mode,
+graph optimization level, memory arena / pattern settings, spinning and
+execution providers. Defaults come from config.py and can be overridden by a
+JSON file (RUNTIME_PROFILE_PATH), e.g. one written by an autotuning run.
+
+Graph optimization runs every time a session is built from the plain ONNX
+file. To keep cold starts short the optimized graph is saved once to
+ORT_OPTIMIZED_CACHE_DIR, keyed by the source model's checksum, the ONNX
+Runtime version, the CPU's instruction set features (the optimizer picks
+kernels and fusions for the CPU it runs on) and the settings that shape the
+optimized graph, and loaded directly on later boots. Entries are
+re-validated (checksums, version and CPU) before use and rebuilt if
+anything is off.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import onnxruntime as ort
+
+from .config import (
+    ORT_INTRA_OP_THREADS,
+    ORT_INTER_OP_THREADS,
+    ORT_EXECUTION_MODE,
+    ORT_GRAPH_OPTIMIZATION,
+    ORT_ENABLE_CPU_MEM_ARENA,
+    ORT_ENABLE_MEM_PATTERN,
+    ORT_ALLOW_SPINNING,
+    ORT_PROVIDERS,
+    RUNTIME_PROFILE_PATH,
+    ORT_OPTIMIZED_CACHE_DIR,
+    ORT_OPTIMIZED_FORMAT,
+)
+
+_EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+_OPTIMIZATION_LEVELS = {
+    "disabled": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_FORMATS = ("onnx", "ort")
+
+# Settings that change the optimized graph itself (and so the cache key)
+_GRAPH_KEYS = ("graph_optimization", "providers", "optimized_format")
+
+
+def default_profile() -> Dict[str, Any]:
+    """Runtime profile built from environment configuration"""
+    return {
+        "intra_op_threads": ORT_INTRA_OP_THREADS,
+        "inter_op_threads": ORT_INTER_OP_THREADS,
+        "execution_mode": ORT_EXECUTION_MODE,
+        "graph_optimization": ORT_GRAPH_OPTIMIZATION,
+        "enable_cpu_mem_arena": ORT_ENABLE_CPU_MEM_ARENA,
+        "enable_mem_pattern": ORT_ENABLE_MEM_PATTERN,
+        "allow_spinning": ORT_ALLOW_SPINNING,
+        "providers": list(ORT_PROVIDERS),
+        "optimized_cache_dir": ORT_OPTIMIZED_CACHE_DIR,
+        "optimized_format": ORT_OPTIMIZED_FORMAT,
+    }
+
+
+def validate_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Check a profile's values, raising ValueError on anything ONNX Runtime would reject"""
+    if profile["execution_mode"] not in _EXECUTION_MODES:
+        raise ValueError(f"Unknown execution_mode {profile['execution_mode']!r}, expected one of {sorted(_EXECUTION_MODES)}")
+    if profile["graph_optimization"] not in _OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph_optimization {profile['graph_optimization']!r}, expected one of {sorted(_OPTIMIZATION_LEVELS)}")
+    if profile["optimized_format"] not in _FORMATS:
+        raise ValueError(f"Unknown optimized_format {profile['optimized_format']!r}, expected one of {list(_FORMATS)}")
+    for key in ("intra_op_threads", "inter_op_threads"):
+        if int(profile[key]) < 0:
+            raise ValueError(f"{key} must be >= 0")
+    available = ort.get_available_providers()
+    missing = [p for p in profile["providers"] if p not in available]
+    if missing:
+        raise ValueError(f"Execution providers not available: {missing} (available: {available})")
+    return profile
+
+
+def load_runtime_profile(path: Optional[str] = None) -> Dict[str, Any]:
+    """Default profile with overrides from a JSON profile file, if one exists"""
+    profile = default_profile()
+    path = path if path is not None else RUNTIME_PROFILE_PATH
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            overrides = json.load(f)
+        # Autotuning output nests the session settings under "session"
+        overrides = overrides.get("session", overrides)
+        unknown = sorted(set(overrides) - set(profile))
+        if unknown:
+            print(f"⚠️ Ignoring unknown runtime profile keys in {path}: {unknown}")
+        profile.update({key: value for key, value in overrides.items() if key in profile})
+        print(f"✅ Loaded runtime profile from: {path}")
+    return validate_profile(profile)
+
+
+def load_profile_section(section: str, path: Optional[str] = None) -> Dict[str, Any]:
+    """Another section of the profile file ("batching", "server"), or {} without one
+
+    scripts/autotune_runtime.py writes the tuned batch settings and worker
+    count next to the session settings.
+    """
+    path = path if path is not None else RUNTIME_PROFILE_PATH
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        values = json.load(f).get(section, {})
+    return values if isinstance(values, dict) else {}
+
+
+_profile = None
+_profile_lock = threading.Lock()
+
+
+def get_runtime_profile() -> Dict[str, Any]:
+    """Process-wide runtime profile (loaded once)"""
+    global _profile
+
+    if _profile is None:
+        with _profile_lock:
+            if _profile is None:
+                _profile = load_runtime_profile()
+    return _profile
+
+
+def build_session_options(profile: Dict[str, Any]) -> ort.SessionOptions:
+    """Translate a runtime profile into ONNX Runtime SessionOptions"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = int(profile["intra_op_threads"])
+    options.inter_op_num_threads = int(profile["inter_op_threads"])
+    options.execution_mode = _EXECUTION_MODES[profile["execution_mode"]]
+    options.graph_optimization_level = _OPTIMIZATION_LEVELS[profile["graph_optimization"]]
+    options.enable_cpu_mem_arena = bool(profile["enable_cpu_mem_arena"])
+    options.enable_mem_pattern = bool(profile["enable_mem_pattern"])
+    spinning = "1" if profile["allow_spinning"] else "0"
+    options.add_session_config_entry("session.intra_op.allow_spinning", spinning)
+    options.add_session_config_entry("session.inter_op.allow_spinning", spinning)
+    return options
+
+
+def file_checksum(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_cpu_features = None
+
+
+def cpu_features() -> str:
+    """Short digest of the CPU architecture and its feature flags (AVX2, AVX-512, NEON, ...)"""
+    global _cpu_features
+
+    if _cpu_features is None:
+        flags = ""
+        try:
+            with open("/proc/cpuinfo", "r") as f:
+                for line in f:
+                    # "flags" on x86, "Features" on ARM
+                    if line.split(":")[0].strip().lower() in ("flags", "features"):
+                        flags = " ".join(sorted(line.split(":", 1)[1].split()))
+                        break
+        except OSError:
+            # No /proc (macOS, Windows) - fall back to the processor description
+            flags = platform.processor()
+        description = f"{platform.machine()}|{flags}"
+        _cpu_features = hashlib.sha256(description.encode("utf-8")).hexdigest()[:12]
+    return _cpu_features
+
+
+def _cache_paths(checksum: str, profile: Dict[str, Any]):
+    settings = json.dumps({key: profile[key] for key in _GRAPH_KEYS}, sort_keys=True)
+    settings_digest = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:8]
+    name = f"{checksum[:16]}-ort{ort.__version__}-cpu{cpu_features()}-{settings_digest}"
+    base = os.path.join(profile["optimized_cache_dir"], name)
+    return f"{base}.{profile['optimized_format']}", f"{base}.json"
+
+
+def _read_meta(meta_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _is_valid_entry(model_path: str, meta: Optional[Dict[str, Any]], source_checksum: Optional[str] = None) -> bool:
+    if meta is None or meta.get("ort_version") != ort.__version__ or meta.get("cpu_features") != cpu_features():
+        return False
+    if source_checksum is not None and meta.get("source_checksum") != source_checksum:
+        return False
+    return os.path.exists(model_path) and file_checksum(model_path) == meta.get("optimized_checksum")
+
+
+def _remove_entry(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_stats_lock = threading.Lock()
+_stats = {"cache_hits": 0, "cache_misses": 0, "cache_rebuilds": 0, "sessions": []}
+
+
+def _record(model_path: str, source: str, started: float, session: ort.InferenceSession):
+    with _stats_lock:
+        _stats["sessions"] = (_stats["sessions"] + [{
+            "model_path": model_path,
+            "loaded_from": source,
+            "load_ms": (time.monotonic() - started) * 1000.0,
+            "providers": session.get_providers(),
+        }])[-8:]
+
+
+def create_session(model_path: str, profile: Optional[Dict[str, Any]] = None,
+                   providers: Optional[List[str]] = None,
+                   model_bytes: Optional[bytes] = None,
+                   checksum: Optional[str] = None) -> ort.InferenceSession:
+    """Create an InferenceSession for a model using the runtime profile
+
+    The optimized graph is loaded from the cache when a valid entry exists;
+    otherwise the model is optimized as usual and the result is written to
+    the cache for the next boot.
+
+    Args:
+        model_path: Model file (only used as a label when model_bytes is given)
+        model_bytes: Serialized model, e.g. read from a model bundle
+        checksum: SHA-256 of the model if already known
+    """
+    profile = profile or get_runtime_profile()
+    providers = providers or profile["providers"] or None
+    source = model_bytes if model_bytes is not None else model_path
+    started = time.monotonic()
+
+    if not profile["optimized_cache_dir"] or profile["graph_optimization"] == "disabled":
+        session = ort.InferenceSession(source, sess_options=build_session_options(profile), providers=providers)
+        _record(model_path, "source", started, session)
+        return session
+
+    if checksum is None:
+        checksum = hashlib.sha256(model_bytes).hexdigest() if model_bytes is not None else file_checksum(model_path)
+    cached_path, meta_path = _cache_paths(checksum, profile)
+
+    if _is_valid_entry(cached_path, _read_meta(meta_path), checksum):
+        try:
+            options = build_session_options(profile)
+            # Already optimized - don't spend boot time doing it again
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            session = ort.InferenceSession(cached_path, sess_options=options, providers=providers)
+            with _stats_lock:
+                _stats["cache_hits"] += 1
+            _record(model_path, "optimized_cache", started, session)
+            print(f"✅ Loaded optimized model from cache: {cached_path}")
+            return session
+        except Exception as e:
+            print(f"⚠️ Optimized model cache entry unusable, rebuilding: {e}")
+            with _stats_lock:
+                _stats["cache_rebuilds"] += 1
+    elif os.path.exists(meta_path) or os.path.exists(cached_path):
+        print(f"⚠️ Optimized model cache entry is stale or corrupt, rebuilding: {cached_path}")
+        with _stats_lock:
+            _stats["cache_rebuilds"] += 1
+    _remove_entry(cached_path, meta_path)
+
+    with _stats_lock:
+        _stats["cache_misses"] += 1
+
+    options = build_session_options(profile)
+    tmp_path = None
+    try:
+        os.makedirs(profile["optimized_cache_dir"], exist_ok=True)
+        tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp.{profile['optimized_format']}"
+        options.optimized_model_filepath = tmp_path
+        if profile["optimized_format"] == "ort":
+            options.add_session_config_entry("session.save_model_format", "ORT")
+    except OSError as e:
+        print(f"⚠️ Optimized model cache directory unavailable: {e}")
+        tmp_path = None
+
+    session = ort.InferenceSession(source, sess_options=options, providers=providers)
+    _record(model_path, "source", started, session)
+
+    if tmp_path and os.path.exists(tmp_path):
+        try:
+            meta = {
+                "source_path": model_path if model_bytes is not None else os.path.abspath(model_path),
+                "source_checksum": checksum,
+                "ort_version": ort.__version__,
+                "cpu_features": cpu_features(),
+                "settings": {key: profile[key] for key in _GRAPH_KEYS},
+                "optimized_checksum": file_checksum(tmp_path),
+                "created_at": time.time(),
+            }
+            # Model first, then metadata - an entry without metadata is never used
+            os.replace(tmp_path, cached_path)
+            tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_meta, "w") as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp_meta, meta_path)
+            print(f"✅ Saved optimized model to cache: {cached_path}")
+        except OSError as e:
+            print(f"⚠️ Could not save optimized model to cache: {e}")
+            _remove_entry(tmp_path)
+
+    return session
+
+
+def validate_optimized_cache(cache_dir: Optional[str] = None) -> Dict[str, int]:
+    """Drop cache entries that are stale (other ONNX Runtime version or CPU) or corrupt
+
+    Run at startup so a bad entry never reaches a request.
+
+    Returns:
+        Counts of entries kept and removed
+    """
+    cache_dir = cache_dir if cache_dir is not None else get_runtime_profile()["optimized_cache_dir"]
+    summary = {"kept": 0, "removed": 0}
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return summary
+
+    names = os.listdir(cache_dir)
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        if ".tmp" in name:
+            # Left behind by a crash mid-write
+            _remove_entry(path)
+            continue
+        if not name.endswith(".json"):
+            continue
+        base = path[:-len(".json")]
+        meta = _read_meta(path)
+        model_path = f"{base}.{(meta or {}).get('settings', {}).get('optimized_format', 'onnx')}"
+        if _is_valid_entry(model_path, meta):
+            summary["kept"] += 1
+        else:
+            _remove_entry(path, model_path)
+            summary["removed"] += 1
+
+    # Optimized graphs whose metadata is gone can never be trusted
+    for name in os.listdir(cache_dir):
+        if name.endswith(tuple(f".{fmt}" for fmt in _FORMATS)) and ".tmp" not in name:
+            base = os.path.join(cache_dir, name).rsplit(".", 1)[0]
+            if not os.path.exists(f"{base}.json"):
+                _remove_entry(os.path.join(cache_dir, name))
+                summary["removed"] += 1
+
+    if summary["removed"]:
+        print(f"🧹 Removed {summary['removed']} stale optimized model cache entries from {cache_dir}")
+    return summary
+
+
+def get_runtime_profile_info() -> Dict[str, Any]:
+    """Active profile and optimized-model cache metrics"""
+    with _stats_lock:
+        stats = {key: (list(value) if isinstance(value, list) else value) for key, value in _stats.items()}
+    return {
+        "ort_version": ort.__version__,
+        "profile": get_runtime_profile(),
+        "optimized_cache": stats,
+    }
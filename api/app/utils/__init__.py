@@ -11,7 +11,7 @@ This package contains utility functions for:
 __version__ = "1.0.0"
 
 # Import utility functions for easy access
-from .image_utils import preprocess_image, save_image_locally, resize_image, tensor_to_image
+from .image_utils import preprocess_image, save_image_locally, read_upload, decode_image, load_image, resize_image, tensor_to_image
 from .model_loader import get_model_session, get_model_metadata
 from .heatmap import generate_heatmap
 from .heatmap_simple import generate_heatmap_simple
@@ -20,6 +20,9 @@ from .supabase_client import get_supabase_client
 __all__ = [
     "preprocess_image",
     "save_image_locally", 
+    "read_upload",
+    "decode_image",
+    "load_image",
     "resize_image",
     "tensor_to_image",
     "get_model_session",
@@ -0,0 +1,101 @@
+"""
+Class activation maps (CAM) from the exported feature map
+
+The model pools MobileNetV3's final (576, h, w) feature map and feeds it to a
+per-crop Linear(576, n) head, so the activation map for a class is just that
+class's weight vector dotted with the feature map at every location. The
+feature map comes out of the same ONNX call as the logits, so explanations
+cost one small NumPy contraction instead of another inference pass.
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ..config import HEAD_WEIGHTS_PATH
+
+_head_weights = None
+_head_weights_lock = threading.Lock()
+
+
+def load_head_weights(path: str = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Load each crop head's (weight, bias) from the converter's .npz archive
+    
+    Returns:
+        Mapping of crop ID string -> (weight (n, 576), bias (n,)); empty if the
+        archive is missing (older exports), which disables CAM.
+    """
+    global _head_weights
+    
+    if _head_weights is None:
+        with _head_weights_lock:
+            if _head_weights is None:
+                from ..model_bundle import get_model_bundle
+                bundle = get_model_bundle() if path is None else None
+                path = path or HEAD_WEIGHTS_PATH
+                weights = {}
+                if bundle is not None and bundle.fused_heads() is not None:
+                    # Views into the mapped bundle, no copy
+                    weights = bundle.head_weights()
+                    print(f"✅ Loaded crop head weights from bundle: {bundle.path}")
+                elif os.path.exists(path):
+                    with np.load(path) as archive:
+                        for key in archive.files:
+                            if key.startswith("weight_"):
+                                crop_id_str = key[len("weight_"):]
+                                weights[crop_id_str] = (
+                                    np.ascontiguousarray(archive[key], dtype=np.float32),
+                                    np.ascontiguousarray(archive[f"bias_{crop_id_str}"], dtype=np.float32),
+                                )
+                    print(f"✅ Loaded crop head weights from: {path}")
+                else:
+                    print(f"⚠️ Crop head weights not found at {path}, class activation maps disabled")
+                _head_weights = weights
+    
+    return _head_weights
+
+
+def clear_head_weights():
+    """Forget the loaded head weights so the next use reloads them (model swap)"""
+    global _head_weights
+    
+    with _head_weights_lock:
+        _head_weights = None
+
+
+def compute_cam(feature_map: np.ndarray, class_weights: np.ndarray) -> np.ndarray:
+    """Weighted sum of feature map channels for one class
+    
+    Args:
+        feature_map: Backbone output for one image, shape (C, h, w)
+        class_weights: Head weight row for the predicted class, shape (C,)
+        
+    Returns:
+        Activation map of shape (h, w) scaled to [0, 1]
+    """
+    cam = np.tensordot(class_weights, feature_map, axes=(0, 0))
+    cam = np.maximum(cam, 0)
+    peak = cam.max()
+    if peak > 0:
+        cam /= peak
+    return cam.astype(np.float32)
+
+
+def compute_crop_cam(feature_map: np.ndarray, crop_id_str: str, local_class_idx: int) -> Optional[np.ndarray]:
+    """CAM for a crop's local class, or None if that crop's head weights are unavailable"""
+    head = load_head_weights().get(crop_id_str)
+    if head is None or feature_map is None:
+        return None
+    weight, _ = head
+    if weight.shape[1] != feature_map.shape[0]:
+        return None
+    return compute_cam(feature_map, weight[local_class_idx])
+
+
+def upsample_cam(cam: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Bilinearly resize a low-resolution CAM to (width, height), keeping [0, 1]"""
+    resized = Image.fromarray(np.asarray(cam, dtype=np.float32)).resize(size, Image.BILINEAR)
+    return np.clip(np.asarray(resized), 0.0, 1.0)
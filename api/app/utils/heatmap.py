@@ -1,78 +1,132 @@
-import os
-import torch
+import io
 import numpy as np
 from PIL import Image
-import matplotlib.pyplot as plt
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Sequence
 
+from ..config import HEATMAP_IMAGE_SIZE, HEATMAP_FORMAT
+from .image_utils import ImageSource, load_image
+from .cam import upsample_cam
 
-def generate_heatmap(image_path: str, image_tensor: torch.Tensor, prediction_results: Dict[str, Any]) -> Optional[str]:
+# Blend weight of the colormap in the overlay panel
+OVERLAY_ALPHA = 0.5
+
+
+def _build_jet_lut() -> np.ndarray:
+    """Precompute the 256-entry "jet" colormap as a uint8 RGB lookup table
+
+    Same piecewise-linear control points matplotlib uses, so heatmaps keep their
+    familiar blue -> cyan -> yellow -> red look without importing matplotlib.
+    """
+    x = np.linspace(0.0, 1.0, 256)
+    red = np.interp(x, [0.0, 0.35, 0.66, 0.89, 1.0], [0.0, 0.0, 1.0, 1.0, 0.5])
+    green = np.interp(x, [0.0, 0.125, 0.375, 0.64, 0.91, 1.0], [0.0, 0.0, 1.0, 1.0, 0.0, 0.0])
+    blue = np.interp(x, [0.0, 0.11, 0.34, 0.65, 1.0], [0.5, 1.0, 1.0, 0.0, 0.0])
+    lut = np.stack([red, green, blue], axis=1)
+    lut = np.round(lut * 255.0).astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+# Read-only, so safe to share between worker threads
+JET_LUT = _build_jet_lut()
+
+
+def colorize(heatmap: np.ndarray) -> np.ndarray:
+    """Map a [0, 1] heatmap of any leading shape to uint8 RGB via the jet LUT"""
+    indices = np.clip(np.asarray(heatmap, dtype=np.float32) * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    return JET_LUT[indices]
+
+
+def blend(images: np.ndarray, colors: np.ndarray, alpha: float = OVERLAY_ALPHA) -> np.ndarray:
+    """Alpha-blend colormapped heatmaps over images (uint8, same shape)"""
+    weight = int(round(alpha * 256))
+    mixed = images.astype(np.uint16) * (256 - weight) + colors.astype(np.uint16) * weight
+    return (mixed >> 8).astype(np.uint8)
+
+
+def encode_heatmap(pixels: np.ndarray) -> bytes:
+    """Encode an RGB uint8 array once, as JPEG or WebP (HEATMAP_FORMAT)"""
+    buffer = io.BytesIO()
+    if HEATMAP_FORMAT == "webp":
+        Image.fromarray(pixels).save(buffer, "WEBP", quality=80, method=2)
+    else:
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def get_heatmap_extension() -> str:
+    """File extension matching the configured heatmap encoding"""
+    return "webp" if HEATMAP_FORMAT == "webp" else "jpg"
+
+
+def _placeholder_heatmap(size: int) -> np.ndarray:
+    """Smooth random heatmap for models exported without a feature map"""
+    return upsample_cam(np.random.rand(7, 7).astype(np.float32), (size, size))
+
+
+def _prediction_heatmap(prediction_results: Dict[str, Any], size: int) -> np.ndarray:
+    cam = prediction_results.get("cam")
+    if cam is not None:
+        # Real class activation map from the model's feature map
+        return upsample_cam(cam, (size, size))
+    return _placeholder_heatmap(size)
+
+
+def render_panels(images: np.ndarray, heatmaps: np.ndarray, alpha: float = OVERLAY_ALPHA) -> np.ndarray:
+    """Build "original | heatmap | overlay" strips for a batch
+
+    Args:
+        images: uint8 array of shape (N, H, W, 3)
+        heatmaps: float array of shape (N, H, W) in [0, 1]
+        alpha: Blend weight of the colormap in the overlay panel
+
+    Returns:
+        uint8 array of shape (N, H, 3 * W, 3)
+    """
+    colors = colorize(heatmaps)
+    overlays = blend(images, colors, alpha)
+    return np.concatenate([images, colors, overlays], axis=2)
+
+
+def generate_heatmaps_batch(images: Sequence[ImageSource], prediction_results: Sequence[Dict[str, Any]]) -> List[Optional[bytes]]:
+    """Render heatmaps for several predictions with one vectorized pass
+
+    Args:
+        images: Decoded original images (or raw bytes / paths)
+        prediction_results: Matching results from the model inference
+
+    Returns:
+        Encoded heatmap image per input (None where rendering failed)
+    """
+    size = HEATMAP_IMAGE_SIZE
+    try:
+        pixels = np.stack([
+            np.asarray(load_image(image).resize((size, size), Image.BILINEAR), dtype=np.uint8)
+            for image in images
+        ])
+        heatmaps = np.stack([_prediction_heatmap(results, size) for results in prediction_results])
+        panels = render_panels(pixels, heatmaps)
+        return [encode_heatmap(panel) for panel in panels]
+    except Exception as e:
+        print(f"Error generating heatmaps: {e}")
+        return [None] * len(images)
+
+
+def generate_heatmap(image: ImageSource, image_tensor: np.ndarray, prediction_results: Dict[str, Any]) -> Optional[bytes]:
     """Generate a heatmap visualization for the model's prediction
-    
-    This is a simplified implementation of Grad-CAM. In a real implementation,
-    you would need to hook into the model's forward pass to get the feature maps
-    and gradients. This function simulates that process with a placeholder.
-    
+
+    Uses the class activation map computed during inference (prediction_results["cam"])
+    when the model exports its feature map; older models without it fall back
+    to a simulated placeholder heatmap. Rendering is a colormap lookup plus a
+    NumPy blend and a single encode - no matplotlib, and safe to call from
+    several worker threads at once.
+
     Args:
-        image_path: Path to the original image
+        image: Decoded original image (or raw bytes / path)
         image_tensor: Preprocessed image tensor used for inference
         prediction_results: Results from the model inference
-        
+
     Returns:
-        Path to the generated heatmap image, or None if generation failed
+        Encoded bytes of the generated heatmap image, or None if generation failed
     """
-    try:
-        # Create temp directory if it doesn't exist
-        os.makedirs("temp", exist_ok=True)
-        
-        # Get the upload ID from the image path
-        upload_id = os.path.splitext(os.path.basename(image_path))[0]
-        
-        # Create heatmap path
-        heatmap_path = os.path.join("temp", f"{upload_id}_heatmap.jpg")
-        
-        # Load the original image
-        original_image = Image.open(image_path).convert("RGB")
-        original_image = original_image.resize((224, 224))
-        
-        # In a real implementation, you would generate the actual heatmap here
-        # using Grad-CAM or a similar technique. For now, we'll create a simulated heatmap.
-        
-        # Create a simulated heatmap (random for demonstration)
-        # In a real implementation, this would be based on the model's attention
-        heatmap = np.random.rand(224, 224)
-        
-        # Apply a gaussian filter to make it look more realistic
-        from scipy.ndimage import gaussian_filter
-        heatmap = gaussian_filter(heatmap, sigma=10)
-        
-        # Normalize the heatmap
-        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min())
-        
-        # Create a color map
-        plt.figure(figsize=(10, 8))
-        plt.subplot(1, 3, 1)
-        plt.imshow(original_image)
-        plt.title("Original Image")
-        plt.axis('off')
-        
-        plt.subplot(1, 3, 2)
-        plt.imshow(heatmap, cmap='jet')
-        plt.title("Heatmap")
-        plt.axis('off')
-        
-        plt.subplot(1, 3, 3)
-        plt.imshow(original_image)
-        plt.imshow(heatmap, cmap='jet', alpha=0.5)
-        plt.title(f"Prediction: {prediction_results['label']} ({prediction_results['confidence']:.1f}%)")
-        plt.axis('off')
-        
-        plt.tight_layout()
-        plt.savefig(heatmap_path)
-        plt.close()
-        
-        return heatmap_path
-    
-    except Exception as e:
-        print(f"Error generating heatmap: {e}")
-        return None
\ No newline at end of file
+    return generate_heatmaps_batch([image], [prediction_results])[0]
@@ -1,39 +1,114 @@
+import io
 import os
-import torch
 import numpy as np
 from PIL import Image
-from torchvision import transforms
 from fastapi import UploadFile
-from typing import Tuple
+from typing import Optional, Tuple, Union
 
-# Define image preprocessing transformations - will be updated dynamically from model config
-def get_preprocess_transforms():
-    """Get preprocessing transforms based on the trained model configuration"""
+from ..config import PREPROCESS_BACKEND, JPEG_DRAFT_DECODE, HEATMAP_IMAGE_SIZE, STORED_IMAGE_MAX_SIDE
+
+# Anything the preprocessing/heatmap stages accept as an image source
+ImageSource = Union[Image.Image, bytes, str]
+
+DEFAULT_IMG_SIZE = 160
+DEFAULT_MEAN = [0.485, 0.456, 0.406]
+DEFAULT_STD = [0.229, 0.224, 0.225]
+
+
+def _get_preprocess_settings() -> Tuple[int, list, list]:
+    """Read img_size / mean / std from the trained model configuration"""
     try:
         # Import here to avoid circular imports
         from ..inference import load_preprocess_config
         
         config = load_preprocess_config()
-        img_size = config.get("img_size", 160)
-        mean = config.get("normalize_mean", [0.485, 0.456, 0.406])
-        std = config.get("normalize_std", [0.229, 0.224, 0.225])
-        
-        return transforms.Compose([
-            transforms.Resize((img_size, img_size)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=mean, std=std),
-        ])
+        return (
+            config.get("img_size", DEFAULT_IMG_SIZE),
+            config.get("normalize_mean", DEFAULT_MEAN),
+            config.get("normalize_std", DEFAULT_STD),
+        )
     except Exception as e:
         print(f"Error loading preprocessing config, using defaults: {e}")
-        # Fallback to default values
-        return transforms.Compose([
-            transforms.Resize((160, 160)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
+        return DEFAULT_IMG_SIZE, DEFAULT_MEAN, DEFAULT_STD
+
+
+class NumpyPreprocessor:
+    """Torch-free equivalent of Resize -> ToTensor -> Normalize
+    
+    ToTensor's 1/255 and Normalize's (x - mean) / std are folded into a single
+    per-channel scale and bias, so each pixel costs one multiply-add and the
+    result is written straight into a contiguous float32 CHW buffer.
+    """
+    
+    def __init__(self, img_size: int = DEFAULT_IMG_SIZE, mean=DEFAULT_MEAN, std=DEFAULT_STD):
+        self.img_size = int(img_size)
+        mean = np.asarray(mean, dtype=np.float32)
+        std = np.asarray(std, dtype=np.float32)
+        self.scale = (1.0 / (255.0 * std)).reshape(3, 1, 1).astype(np.float32)
+        self.bias = (-mean / std).reshape(3, 1, 1).astype(np.float32)
+    
+    @property
+    def output_shape(self) -> Tuple[int, int, int]:
+        return (3, self.img_size, self.img_size)
+    
+    def __call__(self, image: Image.Image, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Preprocess an RGB PIL Image
+        
+        Args:
+            image: RGB PIL Image
+            out: Optional preallocated float32 (3, H, W) buffer to write into
+            
+        Returns:
+            Contiguous float32 array of shape (3, img_size, img_size)
+        """
+        # Same resampling torchvision's Resize uses for PIL images
+        size = (self.img_size, self.img_size)
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        
+        # HWC uint8 -> CHW view, then one fused multiply-add into the output
+        chw = np.asarray(image, dtype=np.uint8).transpose(2, 0, 1)
+        if out is None:
+            out = np.empty(self.output_shape, dtype=np.float32)
+        np.multiply(chw, self.scale, out=out)
+        out += self.bias
+        return out
+
 
-# Default transforms for backward compatibility
-preprocess_transforms = get_preprocess_transforms()
+_preprocessor = None
+
+
+def get_preprocessor() -> NumpyPreprocessor:
+    """Get the NumPy preprocessor configured from the trained model"""
+    global _preprocessor
+    
+    if _preprocessor is None:
+        img_size, mean, std = _get_preprocess_settings()
+        _preprocessor = NumpyPreprocessor(img_size, mean, std)
+    return _preprocessor
+
+
+def clear_preprocessor():
+    """Drop the cached preprocessor so the next call rereads the model's config"""
+    global _preprocessor
+    _preprocessor = None
+
+
+# Define image preprocessing transformations - will be updated dynamically from model config
+def get_preprocess_transforms():
+    """Get the torchvision preprocessing pipeline based on the trained model configuration
+    
+    Only used by the "torchvision" preprocessing backend and for parity checks;
+    importing torchvision here keeps it out of the default serving path.
+    """
+    from torchvision import transforms
+    
+    img_size, mean, std = _get_preprocess_settings()
+    return transforms.Compose([
+        transforms.Resize((img_size, img_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=mean, std=std),
+    ])
 
 
 async def save_image_locally(file: UploadFile, upload_id: str) -> str:
@@ -74,59 +149,156 @@ async def save_image_locally(file: UploadFile, upload_id: str) -> str:
     return file_path
 
 
-def preprocess_image(image_path: str) -> torch.Tensor:
-    """Preprocess image for model inference
+async def read_upload(file: UploadFile) -> bytes:
+    """Read the uploaded file into memory once
     
     Args:
-        image_path: Path to the image file
+        file: Uploaded file object
         
     Returns:
-        Preprocessed image tensor
+        Raw image bytes as sent by the client
     """
-    # Open image
-    image = Image.open(image_path).convert("RGB")
+    return await file.read()
+
+
+def get_decode_size() -> int:
+    """Smallest square size every stage of the upload pipeline can work from
     
-    # Get the current preprocessing transforms (may be updated from model config)
-    transforms = get_preprocess_transforms()
+    The model input, the heatmap and (if enabled) the stored derivative are all
+    produced from one decode, so it must be at least as large as the largest.
+    """
+    return max(get_preprocessor().img_size, HEATMAP_IMAGE_SIZE, STORED_IMAGE_MAX_SIDE)
+
+
+def decode_image(image_data: bytes, min_size: Optional[int] = None) -> Image.Image:
+    """Decode raw image bytes into an RGB PIL Image
+    
+    For JPEGs, passing min_size lets libjpeg scale the image down by 1/2, 1/4
+    or 1/8 while decoding (PIL's draft mode), so a 12-50 MP phone photo is
+    decoded close to the size we actually need instead of at full resolution.
+    
+    Args:
+        image_data: Encoded image bytes (JPEG, PNG, ...)
+        min_size: Both sides of the decoded image will be at least this large
+                  (None decodes at full resolution)
+        
+    Returns:
+        Fully loaded RGB PIL Image. image.info["original_size"] and
+        image.info["original_format"] describe the encoded upload.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    original_size = image.size
+    original_format = image.format
+    
+    if min_size and JPEG_DRAFT_DECODE and image.format == "JPEG":
+        # The draft size is a lower bound - the decoder picks the largest
+        # DCT reduction that keeps both sides >= min_size
+        image.draft("RGB", (min_size, min_size))
+    
+    image = image.convert("RGB")
+    image.info["original_size"] = original_size
+    image.info["original_format"] = original_format
+    return image
+
+
+def load_image(image: ImageSource) -> Image.Image:
+    """Get an RGB PIL Image from a decoded image, raw bytes or a file path
+    
+    Already-decoded images are returned as-is so callers can share one decode
+    across preprocessing, heatmap rendering and storage.
+    """
+    if isinstance(image, Image.Image):
+        return image if image.mode == "RGB" else image.convert("RGB")
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return decode_image(bytes(image))
+    return Image.open(image).convert("RGB")
+
+
+def encode_jpeg(image: Image.Image, quality: int = 85) -> bytes:
+    """Encode a PIL Image as JPEG bytes in memory"""
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def make_storage_image(image_data: bytes, image: Image.Image) -> bytes:
+    """Bytes to keep in storage for an upload
+    
+    With STORED_IMAGE_MAX_SIDE set, a downscaled JPEG derivative is built from
+    the already decoded image; otherwise the original upload bytes are kept.
+    """
+    if STORED_IMAGE_MAX_SIDE <= 0:
+        return image_data
+    
+    original_size = image.info.get("original_size", image.size)
+    if max(original_size) <= STORED_IMAGE_MAX_SIDE and image.info.get("original_format") == "JPEG":
+        return image_data
+    
+    derivative = image.copy()
+    derivative.thumbnail((STORED_IMAGE_MAX_SIDE, STORED_IMAGE_MAX_SIDE), Image.BILINEAR)
+    return encode_jpeg(derivative, quality=90)
+
+
+def preprocess_image(image: ImageSource, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Preprocess image for model inference
+    
+    Args:
+        image: Decoded PIL Image, raw image bytes or path to the image file
+        out: Optional preallocated float32 (3, H, W) buffer to write into
+        
+    Returns:
+        Preprocessed float32 CHW array
+    """
+    # Open image (no-op if the caller already decoded it)
+    image = load_image(image)
     
-    # Apply preprocessing transformations
-    image_tensor = transforms(image)
+    if PREPROCESS_BACKEND == "torchvision":
+        # Reference pipeline - pulls in torch, only for debugging/parity
+        image_tensor = get_preprocess_transforms()(image).numpy()
+        if out is not None:
+            out[...] = image_tensor
+            return out
+        return image_tensor
     
-    return image_tensor
+    return get_preprocessor()(image, out=out)
 
 
-def resize_image(image_path: str, target_size: Tuple[int, int] = (224, 224)) -> Image.Image:
+def resize_image(image: ImageSource, target_size: Tuple[int, int] = (224, 224)) -> Image.Image:
     """Resize image to target size
     
     Args:
-        image_path: Path to the image file
+        image: Decoded PIL Image, raw image bytes or path to the image file
         target_size: Target size (width, height)
         
     Returns:
         Resized PIL Image
     """
-    image = Image.open(image_path).convert("RGB")
+    image = load_image(image)
     resized_image = image.resize(target_size, Image.LANCZOS)
     return resized_image
 
 
-def tensor_to_image(tensor: torch.Tensor) -> Image.Image:
-    """Convert tensor to PIL Image
+def tensor_to_image(tensor) -> Image.Image:
+    """Convert a preprocessed CHW tensor back to a PIL Image
     
     Args:
-        tensor: Image tensor
+        tensor: Image tensor (numpy array or torch tensor)
         
     Returns:
         PIL Image
     """
+    if hasattr(tensor, 'numpy'):
+        tensor = tensor.numpy()
+    tensor = np.asarray(tensor, dtype=np.float32)
+    
     # Denormalize
-    mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
-    std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+    mean = np.array(DEFAULT_MEAN, dtype=np.float32).reshape(3, 1, 1)
+    std = np.array(DEFAULT_STD, dtype=np.float32).reshape(3, 1, 1)
     tensor = tensor * std + mean
     
     # Convert to PIL Image
-    tensor = tensor.clamp(0, 1) * 255
-    tensor = tensor.permute(1, 2, 0).numpy().astype(np.uint8)
+    tensor = np.clip(tensor, 0, 1) * 255
+    tensor = tensor.transpose(1, 2, 0).astype(np.uint8)
     image = Image.fromarray(tensor)
     
     return image
\ No newline at end of file
@@ -1,7 +1,4 @@
 import os
-import onnxruntime as ort
-import torch
-import torch.nn as nn
 from typing import Dict, Any
 from dotenv import load_dotenv
 
@@ -11,50 +8,13 @@ load_dotenv()
 # Import config here to avoid circular imports
 from ..config import get_model_paths
 
-# Multi-head crop disease model architecture
-class MultiHeadCropDiseaseModel(nn.Module):
-    def __init__(self, crop_id_to_num_classes, weights="DEFAULT"):
-        super().__init__()
-        # Load MobileNet backbone
-        if hasattr(torch.hub, "load_state_dict_from_url"):
-            # Use torchvision models
-            import torchvision.models as models
-            if hasattr(models, "MobileNet_V3_Small_Weights"):
-                weight_enum = getattr(models.MobileNet_V3_Small_Weights, weights)
-                mobilenet = models.mobilenet_v3_small(weights=weight_enum)
-            else:
-                mobilenet = models.mobilenet_v3_small(pretrained=True)
-        else:
-            # Fallback for older torchvision
-            import torchvision.models as models
-            mobilenet = models.mobilenet_v3_small(pretrained=True)
-
-        self.backbone = mobilenet.features
-        self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
-
-        # Per-crop classification heads
-        self.heads = nn.ModuleDict({
-            str(crop_id): nn.Linear(576, num_classes)
-            for crop_id, num_classes in crop_id_to_num_classes.items()
-        })
-
-    def forward_features(self, x):
-        """Extract backbone features"""
-        x = self.backbone(x)
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        return x
-
-    def forward_head(self, feats, crop_id: int):
-        """Run features through the correct crop-specific head"""
-        return self.heads[str(int(crop_id))](feats)
-
-    def forward(self, images, crop_ids):
-        feats = self.forward_features(images)
-        outputs = []
-        for i, cid in enumerate(crop_ids):
-            outputs.append(self.forward_head(feats[i].unsqueeze(0), cid))
-        return torch.cat(outputs, dim=0)
+def __getattr__(name):
+    # The training architecture needs torch - only import it when asked for,
+    # so the serving path never loads torch
+    if name == "MultiHeadCropDiseaseModel":
+        from .model_arch import MultiHeadCropDiseaseModel
+        return MultiHeadCropDiseaseModel
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Get the resolved model path
 MODEL_PATH = None
@@ -83,40 +43,17 @@ def get_model_path():
     
     return MODEL_PATH
 
-# Singleton pattern for model session
-_model_session = None
-
-
-def get_model_session() -> ort.InferenceSession:
-    """Get or create the ONNX model inference session
+def get_model_session():
+    """Get the shared ONNX model runtime
     
-    Uses a singleton pattern to avoid loading the model multiple times.
+    Delegates to the inference module so the API keeps a single pool of
+    sessions (loaded at most once) instead of a second singleton here.
     
     Returns:
-        ONNX InferenceSession object
+        ModelRuntime, which exposes the InferenceSession API used here
     """
-    global _model_session
-    
-    if _model_session is None:
-        try:
-            # Check if model file exists
-            if not os.path.exists(MODEL_PATH):
-                raise FileNotFoundError(f"Model file not found at {MODEL_PATH}")
-            
-            # Set execution providers - use CUDA if available, otherwise CPU
-            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            
-            # Create session
-            _model_session = ort.InferenceSession(MODEL_PATH, providers=providers)
-            
-            print(f"Model loaded successfully from {MODEL_PATH}")
-            print(f"Using providers: {_model_session.get_providers()}")
-            
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise
-    
-    return _model_session
+    from ..inference import load_model
+    return load_model()
 
 
 def get_model_metadata() -> Dict[str, Any]:
@@ -148,7 +85,8 @@ def get_model_metadata() -> Dict[str, Any]:
         })
     
     return {
-        "model_path": MODEL_PATH,
+        "model_path": session.model_path,
+        "pool": session.stats(),
         "providers": session.get_providers(),
         "inputs": input_details,
         "outputs": output_details
@@ -1,4 +1,5 @@
 import os
+import threading
 from typing import Dict, Any, Optional, List
 import uuid
 from datetime import datetime
@@ -11,15 +12,22 @@ from ..config import SUPABASE_URL, SUPABASE_KEY, STORAGE_BUCKET
 # Heatmap bucket configuration
 HEATMAP_BUCKET = "heatmaps"  # Default heatmap bucket
 
-# Singleton pattern for Supabase client
+# Singleton pattern for Supabase client - one per process, created on first
+# use so a pre-fork parent never hands its connections to the workers
 class SupabaseClient:
     _instance = None
     _client = None
+    _pid = None
+    _lock = threading.Lock()
     
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(SupabaseClient, cls).__new__(cls)
-            cls._client = cls._create_client()
+        if cls._instance is None or cls._pid != os.getpid():
+            with cls._lock:
+                if cls._instance is None or cls._pid != os.getpid():
+                    instance = super(SupabaseClient, cls).__new__(cls)
+                    cls._client = cls._create_client()
+                    cls._pid = os.getpid()
+                    cls._instance = instance
         return cls._instance
     
     @staticmethod
@@ -179,9 +187,12 @@ class SupabaseClient:
         
         return result.data if result.data else []
 
-# Create a singleton instance
-supabase_client = SupabaseClient()
-
 def get_supabase_client() -> SupabaseClient:
-    """Get the singleton Supabase client instance"""
-    return supabase_client
\ No newline at end of file
+    """Get this process's Supabase client instance (created on first use)"""
+    return SupabaseClient()
+
+def __getattr__(name):
+    # Kept for callers of the old module-level instance, without creating it at import
+    if name == "supabase_client":
+        return get_supabase_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import argparse
 import uvicorn
 from dotenv import load_dotenv
@@ -17,13 +18,21 @@ def main():
                         help='Port to run the API on')
     parser.add_argument('--reload', action='store_true',
                         help='Enable auto-reload for development')
-    parser.add_argument('--workers', type=int, default=1,
-                        help='Number of worker processes')
+    parser.add_argument('--workers', type=int,
+                        help='Number of worker processes (default: WEB_CONCURRENCY, '
+                             'else the autotuned runtime profile, else 1)')
+    parser.add_argument('--no-prefork', dest='prefork', action='store_false',
+                        default=os.getenv('SERVER_PREFORK', 'true').lower() in ('1', 'true', 'yes'),
+                        help='Use plain uvicorn workers instead of preloading the model and forking them')
     parser.add_argument('--log-level', default='info',
                         choices=['critical', 'error', 'warning', 'info', 'debug', 'trace'],
                         help='Log level')
     
     args = parser.parse_args()
+    if args.workers is None:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from api.app.prefork import get_server_workers
+        args.workers = get_server_workers()
     
     # Print startup message
     print(f"Starting Crop Disease Detection API on {args.host}:{args.port}")
@@ -73,7 +82,31 @@ def main():
         for env_file in env_files:
             print(f"  - {env_file} (exists: {os.path.exists(env_file)})")
     
-    # Run the API
+    # One process owns the model and batches for every web worker
+    inference_server = None
+    if os.getenv('INFERENCE_SERVER', 'false').lower() in ('1', 'true', 'yes'):
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from api.app.inference_server import start_inference_server
+        inference_server = start_inference_server()
+    
+    try:
+        serve_api(args)
+    finally:
+        if inference_server is not None:
+            inference_server.terminate()
+            inference_server.wait(10)
+
+
+def serve_api(args):
+    """Run uvicorn (or the pre-fork server for several workers)"""
+    if args.workers > 1 and args.prefork and not args.reload:
+        # Load the model tables once, then fork workers that share them
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from api.app.prefork import serve
+        serve("api.app.main:app", host=args.host, port=args.port,
+              workers=args.workers, log_level=args.log_level)
+        return
+    
     uvicorn.run(
         "api.app.main:app",
         host=args.host,
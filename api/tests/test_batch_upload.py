@@ -0,0 +1,134 @@
+import asyncio
+import io
+import json
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from api.app import api
+
+
+def _jpeg(color=(40, 120, 60)):
+    buffer = io.BytesIO()
+    Image.new("RGB", (48, 48), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class _FakePipeline:
+    def __init__(self, upload_id, prediction_results, crop_name):
+        self.row = {"id": upload_id, "pest_name": prediction_results["label"],
+                    "confidence": prediction_results["confidence"], "crop_name": crop_name,
+                    "image_url": f"https://storage/images/{upload_id}.jpg", "heatmap_url": None,
+                    "diagnosis": "diagnosis"}
+
+    async def run(self):
+        return {"detection": self.row}
+
+
+@pytest.fixture
+def batch_client(monkeypatch):
+    inserted = []
+
+    async def fake_infer(images, crop_names, image_keys):
+        return [{"label": f"{crop}_blight", "confidence": 0.9} for crop in crop_names]
+
+    async def fake_lookup(data, crop):
+        return str(len(data)), None, None
+
+    async def fake_insert(rows):
+        inserted.append([row["id"] for row in rows])
+        return {"stored": len(rows), "queued": 0, "failed": 0}
+
+    monkeypatch.setattr(api, "lookup_cached_result", fake_lookup)
+    monkeypatch.setattr(api, "get_decode_size", lambda: 32)
+    monkeypatch.setattr(api, "get_batch_settings", lambda: {"max_batch_size": 2})
+    monkeypatch.setattr(api, "infer_batch", fake_infer)
+    monkeypatch.setattr(api, "insert_detections", fake_insert)
+    monkeypatch.setattr(api, "build_upload_pipeline",
+                        lambda upload_id, data, image, tensor, results, crop, **kwargs:
+                        _FakePipeline(upload_id, results, crop))
+    monkeypatch.setattr(api, "BATCH_INSERT_SIZE", 2)
+    monkeypatch.setattr(api, "BATCH_INSERT_INTERVAL_SECONDS", 0)
+
+    app = FastAPI()
+    app.include_router(api.router, prefix="/api")
+    with TestClient(app) as client:
+        yield client, inserted
+
+
+def _post(client, images, crop_names=None):
+    files = [("files", (f"{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+    data = {"crop_names": crop_names} if crop_names is not None else None
+    return client.post("/api/upload/batch", files=files, data=data)
+
+
+def test_batch_crops_are_resolved_per_file():
+    assert api.resolve_batch_crops(None, 3) == [api.AUTO_CROP] * 3
+    assert api.resolve_batch_crops(["tomato"], 3) == ["tomato"] * 3
+    assert api.resolve_batch_crops(["tomato", " ", "rice"], 3) == ["tomato", api.AUTO_CROP, "rice"]
+    with pytest.raises(HTTPException) as error:
+        api.resolve_batch_crops(["tomato", "rice"], 3)
+    assert error.value.status_code == 400
+
+
+def test_every_image_reports_once_and_the_summary_comes_last(batch_client):
+    client, inserted = batch_client
+    images = [_jpeg((i * 40, 100, 50)) for i in range(5)] + [b"not an image"]
+    response = _post(client, images, ["tomato"])
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    items, summary = lines[:-1], lines[-1]
+    assert sorted(item["index"] for item in items) == list(range(6))
+    assert "error" in items[[item["index"] for item in items].index(5)]
+    assert all(item["prediction"] == "tomato_blight" for item in items if item["index"] != 5)
+    assert summary == {"summary": {"total": 6, "succeeded": 5, "failed": 1, "cached": 0,
+                                   "stored": 5, "queued": 0, "unstored": 0}}
+    # Rows go out BATCH_INSERT_SIZE at a time, the remainder at the end
+    assert [len(chunk) for chunk in inserted] == [2, 2, 1]
+    ids = {item["id"] for item in items if "id" in item}
+    assert {row_id for chunk in inserted for row_id in chunk} == ids
+
+
+def test_batch_failure_reports_the_missing_images(batch_client, monkeypatch):
+    client, _ = batch_client
+
+    def broken_settings():
+        raise RuntimeError("batcher unavailable")
+
+    monkeypatch.setattr(api, "get_batch_settings", broken_settings)
+    response = _post(client, [_jpeg(), b"not an image", _jpeg()])
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines[:-1]) == [0, 1, 2]
+    assert all("error" in line for line in lines[:-1])
+    assert lines[-1] == {"error": "batcher unavailable"}
+
+
+def test_batch_file_limit(batch_client, monkeypatch):
+    client, _ = batch_client
+    monkeypatch.setattr(api, "BATCH_UPLOAD_MAX_FILES", 2)
+    assert _post(client, [_jpeg()] * 3).status_code == 413
+
+
+def test_rows_are_flushed_on_a_timer(batch_client, monkeypatch):
+    client, inserted = batch_client
+
+    class SlowPipeline(_FakePipeline):
+        async def run(self):
+            await asyncio.sleep(0.05 * int(self.row["crop_name"]))
+            return await super().run()
+
+    monkeypatch.setattr(api, "build_upload_pipeline",
+                        lambda upload_id, data, image, tensor, results, crop, **kwargs:
+                        SlowPipeline(upload_id, results, crop))
+    monkeypatch.setattr(api, "BATCH_INSERT_SIZE", 50)
+    monkeypatch.setattr(api, "BATCH_INSERT_INTERVAL_SECONDS", 0.02)
+    response = _post(client, [_jpeg(), _jpeg()], ["1", "4"])
+
+    assert json.loads(response.text.splitlines()[-1])["summary"]["stored"] == 2
+    # The first image was stored while the second was still running
+    assert [len(chunk) for chunk in inserted] == [1, 1]
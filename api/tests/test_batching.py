@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api.app.batching import InferenceBatcher, InferenceQueueFullError
+
+
+def _echo_batch(batch_sizes):
+    def run_batch(image_tensors, crop_names, image_keys=None):
+        batch_sizes.append(len(image_tensors))
+        time.sleep(0.01)
+        return [{"value": float(t[0, 0, 0]), "crop_used": c} for t, c in zip(image_tensors, crop_names)]
+    return run_batch
+
+
+def test_concurrent_requests_are_batched_and_routed_back():
+    batch_sizes = []
+    batcher = InferenceBatcher(_echo_batch(batch_sizes), max_batch_size=8, max_wait_ms=50)
+    results = {}
+
+    def worker(i):
+        image = np.full((3, 4, 4), i, dtype=np.float32)
+        results[i] = batcher.infer(image, f"crop{i}", timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.stop(timeout=5)
+
+    for i in range(16):
+        assert results[i] == {"value": float(i), "crop_used": f"crop{i}"}
+    assert max(batch_sizes) > 1
+    assert max(batch_sizes) <= 8
+
+    stats = batcher.stats()
+    assert stats["requests_processed"] == 16
+    assert stats["batches_run"] == len(batch_sizes)
+    assert stats["queue_depth"] == 0
+
+
+def test_batch_failure_is_propagated_to_every_caller():
+    def failing(image_tensors, crop_names, image_keys=None):
+        raise ValueError("boom")
+
+    batcher = InferenceBatcher(failing, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(ValueError):
+        batcher.infer(np.zeros((3, 4, 4), dtype=np.float32), timeout=5)
+    batcher.stop(timeout=5)
+    assert batcher.stats()["requests_failed"] == 1
+
+
+def test_full_queue_rejects_new_requests():
+    release = threading.Event()
+
+    def blocking(image_tensors, crop_names, image_keys=None):
+        release.wait(5)
+        return [{} for _ in image_tensors]
+
+    batcher = InferenceBatcher(blocking, max_batch_size=1, max_wait_ms=0, max_queue_size=1)
+    first = batcher.submit(np.zeros((3, 4, 4), dtype=np.float32))
+    time.sleep(0.05)  # let the scheduler pick up the first request
+    batcher.submit(np.zeros((3, 4, 4), dtype=np.float32))
+    with pytest.raises(InferenceQueueFullError):
+        batcher.submit(np.zeros((3, 4, 4), dtype=np.float32))
+    release.set()
+    first.result(timeout=5)
+    batcher.stop(timeout=5)
+
+
+def test_cancelled_waiter_does_not_break_its_batch():
+    batch_sizes = []
+    release = threading.Event()
+    echo = _echo_batch(batch_sizes)
+
+    def gated(image_tensors, crop_names, image_keys=None):
+        release.wait(5)
+        return echo(image_tensors, crop_names, image_keys)
+
+    batcher = InferenceBatcher(gated, max_batch_size=3, max_wait_ms=1)
+    images = [np.full((3, 4, 4), i, dtype=np.float32) for i in range(5)]
+
+    # Keep the scheduler busy, then queue three requests and cancel the middle one
+    blocker = batcher.submit(images[0])
+    time.sleep(0.05)
+    queued = [batcher.submit(image) for image in images[1:4]]
+    assert queued[1].cancel()
+    release.set()
+
+    assert blocker.result(5)["value"] == 0.0
+    assert queued[0].result(5)["value"] == 1.0 and queued[2].result(5)["value"] == 3.0
+    assert batch_sizes[-1] == 2
+
+    # A caller cancelled while its batch is running (asyncio waiter timed out)
+    async def scenario():
+        release.clear()
+        tasks = [asyncio.create_task(batcher.infer_async(image)) for image in images[1:4]]
+        await asyncio.sleep(0.05)
+        tasks[1].cancel()
+        release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    first, cancelled, third = asyncio.run(scenario())
+    assert first["value"] == 1.0 and third["value"] == 3.0
+    assert isinstance(cancelled, asyncio.CancelledError)
+
+    # The scheduler thread survived and serves later requests
+    assert batcher.infer(images[4], timeout=5)["value"] == 4.0
+    batcher.stop(timeout=5)
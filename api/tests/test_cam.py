@@ -0,0 +1,35 @@
+import numpy as np
+
+from api.app.utils.cam import compute_cam, upsample_cam
+
+
+def test_cam_is_consistent_with_pooled_head_logits():
+    rng = np.random.RandomState(0)
+    feature_map = rng.rand(576, 5, 5).astype(np.float32)
+    weight = rng.randn(15, 576).astype(np.float32)
+    bias = rng.randn(15).astype(np.float32)
+
+    # The head sees the average-pooled feature map...
+    logits = weight @ feature_map.mean(axis=(1, 2)) + bias
+    cls = int(np.argmax(logits))
+
+    # ...so the unnormalised CAM averages back to the class logit
+    raw_cam = np.tensordot(weight[cls], feature_map, axes=(0, 0))
+    np.testing.assert_allclose(raw_cam.mean() + bias[cls], logits[cls], rtol=1e-4)
+
+    cam = compute_cam(feature_map, weight[cls])
+    assert cam.shape == (5, 5)
+    assert cam.min() >= 0.0 and np.isclose(cam.max(), 1.0)
+    np.testing.assert_allclose(cam, np.maximum(raw_cam, 0) / np.maximum(raw_cam, 0).max(), rtol=1e-5)
+
+
+def test_upsample_cam_keeps_range_and_peak_location():
+    cam = np.zeros((5, 5), dtype=np.float32)
+    cam[0, 4] = 1.0
+
+    heatmap = upsample_cam(cam, (224, 224))
+
+    assert heatmap.shape == (224, 224)
+    assert heatmap.min() >= 0.0 and heatmap.max() <= 1.0
+    row, col = np.unravel_index(np.argmax(heatmap), heatmap.shape)
+    assert row < 56 and col > 168
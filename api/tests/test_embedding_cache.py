@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from api.app import inference
+from api.app.embedding_cache import EmbeddingCache
+from api.app.model_runtime import ModelRuntime
+from api.app.utils import cam
+
+
+class FakeBackboneSession:
+    """Stands in for the split export: (embedding, features) per image"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_inputs(self):
+        return [type("Input", (), {"name": "image", "shape": ["batch", 3, 160, 160], "type": "tensor(float)"})()]
+
+    def get_outputs(self):
+        return [type("Output", (), {"name": name})() for name in ("embedding", "features")]
+
+    def run(self, _, feeds, run_options=None):
+        self.calls += 1
+        batch = feeds["image"]
+        features = np.repeat(batch[:, :1, :5, :5], 576, axis=1) * np.linspace(0.5, 1.5, 576, dtype=np.float32)[None, :, None, None]
+        return [features.mean(axis=(2, 3)), features]
+
+
+@pytest.fixture
+def split_model(monkeypatch):
+    rng = np.random.RandomState(0)
+    heads = {
+        cid: (rng.randn(len(classes), 576).astype(np.float32), rng.randn(len(classes)).astype(np.float32))
+        for cid, classes in inference.load_crop_to_global_classes().items()
+    }
+    session = FakeBackboneSession()
+    monkeypatch.setattr(cam, "_head_weights", heads)
+    monkeypatch.setattr(inference, "_fused_heads", None)
+    monkeypatch.setattr(inference, "load_model", lambda: session)
+    monkeypatch.setattr(inference, "embedding_cache", EmbeddingCache(max_entries=4))
+    return session, heads
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(max_entries=2)
+    cache.set("a", {"embedding": 1})
+    cache.set("b", {"embedding": 2})
+    assert cache.get("a") == {"embedding": 1}
+    cache.set("c", {"embedding": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.get(None) is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_split_heads_match_per_crop_linear_layers(split_model):
+    session, heads = split_model
+    image = np.random.RandomState(1).rand(3, 160, 160).astype(np.float32)
+    crop = inference.CROP_LABELS[0]
+
+    result = inference.run_inference_batch([image], [crop])[0]
+
+    weight, bias = heads[str(inference.get_crop_id(crop))]
+    embedding = session.run(None, {"image": image[None]})[0][0]
+    np.testing.assert_allclose(result["raw_scores"], weight @ embedding + bias, rtol=1e-4, atol=1e-4)
+    assert result["cam"].shape == (5, 5)
+
+
+def test_other_crop_reuses_cached_embedding(split_model):
+    session, _ = split_model
+    image = np.random.RandomState(2).rand(3, 160, 160).astype(np.float32)
+    first, second = inference.CROP_LABELS[0], inference.CROP_LABELS[1]
+
+    expected = inference.run_inference_batch([image], [second])[0]
+    inference.embedding_cache.clear()
+    inference.run_inference_batch([image], [first], ["img-hash"])
+    calls = session.calls
+
+    cached = inference.classify_cached("img-hash", [second])[0]
+    again = inference.run_inference_batch([image], [second], ["img-hash"])[0]
+
+    assert session.calls == calls
+    assert cached["label"] == expected["label"] == again["label"]
+    np.testing.assert_allclose(cached["probabilities"], expected["probabilities"], rtol=1e-5)
+    assert inference.classify_cached("unknown", [second]) is None
+
+
+def test_runtime_batches_write_into_bound_rows(split_model, monkeypatch):
+    from PIL import Image
+    from api.app.utils.image_utils import preprocess_image
+
+    session, _ = split_model
+    crop = inference.CROP_LABELS[0]
+    photo = Image.fromarray(np.random.RandomState(3).randint(0, 255, (160, 160, 3), dtype=np.uint8))
+    tensor = np.random.RandomState(4).rand(3, 160, 160).astype(np.float32)
+    expected = inference.run_inference_batch([preprocess_image(photo), tensor], [crop, crop])
+
+    runtime = ModelRuntime("backbone.onnx", session_factory=lambda path: session)
+    monkeypatch.setattr(inference, "load_model", lambda: runtime.load())
+    results = inference.run_inference_batch([photo, tensor], [crop, crop], ["photo", "tensor"])
+
+    for result, reference in zip(results, expected):
+        np.testing.assert_allclose(result["raw_scores"], reference["raw_scores"], rtol=1e-5)
+    # The PIL image was preprocessed straight into the slot's input buffer
+    rows = runtime._bound[0]._inputs["image"]
+    np.testing.assert_allclose(rows[0], preprocess_image(photo))
+    assert not np.shares_memory(inference.embedding_cache.get("photo")["embedding"], rows)
@@ -0,0 +1,110 @@
+import asyncio
+
+from api.app.enrichment import EnrichmentStore, EnrichmentTracker
+
+
+def test_subscribers_see_each_field_become_ready():
+    async def enrich(entry):
+        await asyncio.sleep(0.01)
+        entry.update("image_url", "https://storage/images/1.jpg")
+        entry.update("heatmap_url", None)
+        await asyncio.sleep(0.01)
+        entry.update("diagnosis", "full diagnosis")
+        entry.update("stored")
+
+    async def scenario():
+        tracker = EnrichmentTracker()
+        entry = tracker.start("1", {"id": "1", "prediction": "blight", "image_url": None,
+                                    "heatmap_url": None, "diagnosis": "short"}, enrich)
+        first = entry.snapshot()
+        queue = entry.subscribe()
+        snapshots = []
+        while True:
+            snapshot = await asyncio.wait_for(queue.get(), 1)
+            snapshots.append(snapshot)
+            if snapshot["status"] != "enriching":
+                break
+        return tracker, first, snapshots
+
+    tracker, first, snapshots = asyncio.run(scenario())
+
+    assert first["status"] == "enriching" and set(first["fields"].values()) == {"pending"}
+    assert [s["fields"]["image_url"] for s in snapshots[:2]] == ["pending", "ready"]
+    final = snapshots[-1]
+    assert final["status"] == "complete" and set(final["fields"].values()) == {"ready"}
+    assert final["image_url"] == "https://storage/images/1.jpg" and final["diagnosis"] == "full diagnosis"
+    assert "stored" not in final
+    assert tracker.get("1").snapshot() == final
+    assert tracker.stats()["completed"] == 1 and tracker.stats()["in_flight"] == 0
+
+
+def test_failed_enrichment_marks_pending_fields_failed():
+    async def enrich(entry):
+        entry.update("heatmap_url", "https://storage/heatmaps/2.jpg")
+        raise ConnectionError("storage down")
+
+    async def scenario():
+        tracker = EnrichmentTracker()
+        tracker.start("2", {"id": "2", "heatmap_url": None}, enrich)
+        await tracker.drain(1)
+        return tracker
+
+    tracker = asyncio.run(scenario())
+    snapshot = tracker.get("2").snapshot()
+    assert snapshot["status"] == "failed" and "storage down" in snapshot["error"]
+    assert snapshot["fields"]["heatmap_url"] == "ready"
+    assert snapshot["fields"]["stored"] == "failed"
+
+
+def test_finished_entries_expire_and_drain_cancels_stragglers():
+    async def slow(entry):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        tracker = EnrichmentTracker(retention_seconds=0)
+        tracker.start("3", {"id": "3"}, slow)
+        await tracker.drain(0.05)
+        await asyncio.sleep(0.01)
+        return tracker
+
+    tracker = asyncio.run(scenario())
+    assert tracker.get("3") is None
+    assert tracker.stats()["in_flight"] == 0
+
+
+def test_other_workers_see_progress_through_the_shared_store(tmp_path):
+    path = str(tmp_path / "enrichment.sqlite3")
+    release = asyncio.Event()
+
+    async def enrich(entry):
+        entry.update("image_url", "https://storage/images/4.jpg")
+        await release.wait()
+        entry.update("diagnosis", "full diagnosis")
+
+    async def scenario():
+        uploader = EnrichmentTracker(store=EnrichmentStore(path))
+        other = EnrichmentTracker(store=EnrichmentStore(path))
+        uploader.start("4", {"id": "4", "image_url": None, "diagnosis": "short"}, enrich)
+        await asyncio.sleep(0.05)
+        during = await other.lookup("4")
+        release.set()
+        await uploader.drain(1)
+        after = await other.lookup("4")
+        return during, after, await other.lookup("missing")
+
+    during, after, missing = asyncio.run(scenario())
+
+    assert during[1]["status"] == "enriching" and during[1]["fields"]["image_url"] == "ready"
+    assert after[0] > during[0]
+    assert after[1]["status"] == "complete" and after[1]["diagnosis"] == "full diagnosis"
+    assert missing is None
+
+
+def test_shared_store_keeps_the_newest_snapshot(tmp_path):
+    store = EnrichmentStore(str(tmp_path / "enrichment.sqlite3"), retention_seconds=60)
+    store.put("5", 3, {"status": "complete"})
+    store.put("5", 2, {"status": "enriching"})
+    assert store.get("5") == (3, {"status": "complete"})
+
+    expired = EnrichmentStore(str(tmp_path / "enrichment.sqlite3"), retention_seconds=0)
+    assert expired.get("5") is None
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+from api.app import api
+from api.app.executor import run_cpu_bound
+
+
+def test_blocking_work_leaves_the_event_loop_free():
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        def blocking():
+            time.sleep(0.2)
+            return threading.current_thread().name
+
+        task = asyncio.create_task(ticker())
+        thread_name = await run_cpu_bound(blocking)
+        task.cancel()
+        return thread_name, ticks
+
+    thread_name, ticks = asyncio.run(scenario())
+
+    assert thread_name.startswith("cpu-worker")
+    # The loop kept running other coroutines while the worker slept
+    assert ticks >= 10
+
+
+def test_upload_stages_run_on_the_worker_pool(monkeypatch):
+    threads = {}
+
+    def recorded(name, result=None):
+        def stage(*args, **kwargs):
+            threads[name] = threading.current_thread()
+            return result
+        return stage
+
+    class Query:
+        async def execute(self):
+            threads["insert"] = threading.current_thread()
+
+    class Bucket:
+        async def upload(self, path, data, options=None):
+            pass
+
+        async def get_public_url(self, path):
+            return f"https://storage/{path}"
+
+    class Client:
+        class storage:
+            @staticmethod
+            def from_(bucket):
+                return Bucket()
+
+        def table(self, name):
+            return type("Table", (), {"insert": lambda self, row: Query()})()
+
+    async def fake_client():
+        return Client()
+
+    async def fake_inference(tensor, crop_name, key):
+        return {"label": "tomato_blight", "confidence": 0.9}
+
+    async def fake_llama(*args):
+        return None
+
+    monkeypatch.setattr(api, "get_supabase_client", fake_client)
+    monkeypatch.setattr(api, "get_job_queue", lambda: None)
+    monkeypatch.setattr(api, "get_result_cache", lambda: None)
+    monkeypatch.setattr(api, "hash_image", recorded("hash", "hash"))
+    monkeypatch.setattr(api, "decode_image", recorded("decode"))
+    monkeypatch.setattr(api, "preprocess_image", recorded("preprocess"))
+    monkeypatch.setattr(api, "make_storage_image", recorded("storage_image", b"jpeg"))
+    monkeypatch.setattr(api, "render_heatmap", recorded("heatmap"))
+    monkeypatch.setattr(api, "run_inference_async", fake_inference)
+    monkeypatch.setattr(api, "request_llama_diagnosis", fake_llama)
+
+    async def scenario():
+        response = await api.process_upload("upload-1", b"jpeg bytes", "tomato", fast=False)
+        return response, threading.current_thread()
+
+    response, loop_thread = asyncio.run(scenario())
+
+    assert response["prediction"] == "tomato_blight"
+    assert set(threads) == {"hash", "decode", "preprocess", "storage_image", "heatmap", "insert"}
+    for name in ("hash", "decode", "preprocess", "storage_image", "heatmap"):
+        assert threads[name] is not loop_thread and threads[name].name.startswith("cpu-worker"), name
+    # The database call itself is awaited on the loop
+    assert threads["insert"] is loop_thread
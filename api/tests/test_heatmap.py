@@ -0,0 +1,49 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from api.app.utils.heatmap import JET_LUT, colorize, generate_heatmap, generate_heatmaps_batch, render_panels
+
+
+def _image(seed=0, size=(300, 200)):
+    pixels = np.random.RandomState(seed).randint(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _cam(seed=0):
+    return np.random.RandomState(seed).rand(5, 5).astype(np.float32)
+
+
+def test_lut_matches_matplotlib_jet():
+    matplotlib = pytest.importorskip("matplotlib")
+    reference = np.round(matplotlib.colormaps["jet"](np.linspace(0, 1, 256))[:, :3] * 255)
+
+    assert JET_LUT.shape == (256, 3)
+    assert JET_LUT.dtype == np.uint8
+    assert np.abs(JET_LUT.astype(int) - reference.astype(int)).max() <= 1
+
+
+def test_colorize_and_panels_shapes():
+    heatmaps = np.random.rand(3, 224, 224).astype(np.float32)
+    images = np.random.randint(0, 255, (3, 224, 224, 3), dtype=np.uint8)
+
+    assert colorize(heatmaps).shape == (3, 224, 224, 3)
+    panels = render_panels(images, heatmaps)
+    assert panels.shape == (3, 224, 3 * 224, 3)
+    np.testing.assert_array_equal(panels[:, :, :224], images)
+
+
+def test_batched_render_matches_single_and_is_thread_safe():
+    images = [_image(i) for i in range(4)]
+    results = [{"cam": _cam(i)} for i in range(4)]
+
+    batched = generate_heatmaps_batch(images, results)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        single = list(pool.map(lambda i: generate_heatmap(images[i], None, results[i]), range(4)))
+
+    assert batched == single
+    decoded = Image.open(io.BytesIO(batched[0]))
+    assert decoded.size == (3 * 224, 224)
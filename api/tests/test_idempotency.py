@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+from api.app.idempotency import (
+    IdempotencyConflictError,
+    IdempotencyStore,
+    request_fingerprint,
+    upload_id_for_key,
+)
+
+
+def test_concurrent_and_later_duplicates_share_one_run():
+    calls = []
+
+    async def upload():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"id": upload_id_for_key("key-1"), "prediction": "blight"}
+
+    async def scenario():
+        store = IdempotencyStore()
+        fingerprint = request_fingerprint("image-hash", "tomato", False)
+        first, second = await asyncio.gather(store.run("key-1", fingerprint, upload),
+                                             store.run("key-1", fingerprint, upload))
+        later = await store.run("key-1", fingerprint, upload)
+        return store, first, second, later
+
+    store, first, second, later = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert first == ({"id": upload_id_for_key("key-1"), "prediction": "blight"}, False)
+    assert second == (first[0], True) and later == (first[0], True)
+    assert upload_id_for_key("key-1") == upload_id_for_key("key-1") != upload_id_for_key("key-2")
+    stats = store.stats()
+    assert stats["executed"] == 1 and stats["joined"] == 1 and stats["replayed"] == 1
+    assert stats["in_flight"] == 0 and stats["stored"] == 1
+
+
+def test_failed_attempt_is_not_stored_and_waiters_see_the_error():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        await asyncio.sleep(0.02)
+        if len(attempts) == 1:
+            raise ConnectionError("storage down")
+        return {"id": "1"}
+
+    async def scenario():
+        store = IdempotencyStore()
+        first, waiter = await asyncio.gather(store.run("key", "fp", flaky), store.run("key", "fp", flaky),
+                                             return_exceptions=True)
+        retry = await store.run("key", "fp", flaky)
+        return first, waiter, retry
+
+    first, waiter, retry = asyncio.run(scenario())
+
+    assert isinstance(first, ConnectionError) and isinstance(waiter, ConnectionError)
+    assert retry == ({"id": "1"}, False)
+    assert len(attempts) == 2
+
+
+def test_key_reused_for_another_request_is_rejected():
+    async def upload():
+        return {"id": "1"}
+
+    async def scenario():
+        store = IdempotencyStore()
+        await store.run("key", request_fingerprint("image-a", "tomato", False), upload)
+        with pytest.raises(IdempotencyConflictError):
+            await store.run("key", request_fingerprint("image-b", "tomato", False), upload)
+        return store
+
+    assert asyncio.run(scenario()).stats()["conflicts"] == 1
+
+
+def test_failed_response_store_does_not_fail_the_upload():
+    async def upload():
+        return {"id": "1"}
+
+    def broken_set(key, value):
+        raise OSError("disk full")
+
+    async def scenario():
+        store = IdempotencyStore()
+        store.completed.set = broken_set
+        return await store.run("key", "fp", upload)
+
+    assert asyncio.run(scenario()) == ({"id": "1"}, False)
+
+
+def test_key_retry_after_partial_failure_overwrites_the_first_attempt(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from api.app import api
+
+    objects, rows = {}, {}
+    outage = {"database": True}
+
+    class Query:
+        def __init__(self, row, upsert):
+            self.row, self.upsert = row, upsert
+
+        async def execute(self):
+            if outage["database"]:
+                raise ConnectionError("database down")
+            if self.row["id"] in rows and not self.upsert:
+                raise ValueError("duplicate key value violates unique constraint")
+            rows[self.row["id"]] = self.row
+
+    class Table:
+        def insert(self, row):
+            return Query(row, upsert=False)
+
+        def upsert(self, row):
+            return Query(row, upsert=True)
+
+    class Bucket:
+        async def upload(self, path, data, options=None):
+            if path in objects and not (options or {}).get("upsert"):
+                raise ValueError("The resource already exists")
+            objects[path] = data
+
+        async def get_public_url(self, path):
+            return f"https://storage/{path}"
+
+    class Client:
+        class storage:
+            @staticmethod
+            def from_(bucket):
+                return Bucket()
+
+        def table(self, name):
+            return Table()
+
+    async def fake_client():
+        return Client()
+
+    async def fake_inference(tensor, crop_name, key):
+        return {"label": "tomato_blight", "confidence": 0.9}
+
+    async def fake_llama(*args):
+        return None
+
+    async def fake_lookup(data, crop):
+        return "hash", None, None
+
+    monkeypatch.setattr(api, "get_supabase_client", fake_client)
+    monkeypatch.setattr(api, "get_job_queue", lambda: None)
+    monkeypatch.setattr(api, "lookup_cached_result", fake_lookup)
+    monkeypatch.setattr(api, "decode_image", lambda data, size: None)
+    monkeypatch.setattr(api, "preprocess_image", lambda image: None)
+    monkeypatch.setattr(api, "make_storage_image", lambda data, image: data)
+    monkeypatch.setattr(api, "render_heatmap", lambda image, tensor, results: None)
+    monkeypatch.setattr(api, "run_inference_async", fake_inference)
+    monkeypatch.setattr(api, "request_llama_diagnosis", fake_llama)
+    monkeypatch.setattr(api, "idempotency_store", IdempotencyStore())
+
+    app = FastAPI()
+    app.include_router(api.router, prefix="/api")
+    request = {"files": {"file": ("leaf.jpg", b"jpeg bytes", "image/jpeg")},
+               "data": {"crop_name": "tomato"}, "headers": {"Idempotency-Key": "retry-key"}}
+    with TestClient(app) as client:
+        # The image is stored, then the insert fails
+        assert client.post("/api/upload", **request).status_code == 500
+        assert f"images/{upload_id_for_key('retry-key')}.jpg" in objects and not rows
+
+        outage["database"] = False
+        retry = client.post("/api/upload", **request)
+
+    assert retry.status_code == 200
+    assert retry.json()["id"] == upload_id_for_key("retry-key")
+    assert list(rows) == [upload_id_for_key("retry-key")]
@@ -0,0 +1,91 @@
+import io
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from api.app.utils.image_utils import decode_image, get_preprocessor, load_image, preprocess_image
+
+
+def _jpeg_bytes(width=320, height=240, seed=0):
+    pixels = np.random.RandomState(seed).randint(0, 255, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_preprocess_accepts_decoded_image_bytes_and_path(tmp_path):
+    data = _jpeg_bytes()
+    path = tmp_path / "leaf.jpg"
+    path.write_bytes(data)
+
+    image = decode_image(data)
+    assert load_image(image) is image
+
+    from_image = np.asarray(preprocess_image(image))
+    from_bytes = np.asarray(preprocess_image(data))
+    from_path = np.asarray(preprocess_image(str(path)))
+
+    np.testing.assert_array_equal(from_image, from_bytes)
+    np.testing.assert_array_equal(from_image, from_path)
+
+
+def test_numpy_preprocessor_matches_torchvision():
+    pytest.importorskip("torchvision")
+    from api.app.utils.image_utils import get_preprocess_transforms, get_preprocessor
+
+    for seed, (width, height) in enumerate([(320, 240), (160, 160), (97, 203)]):
+        image = decode_image(_jpeg_bytes(width, height, seed))
+
+        reference = get_preprocess_transforms()(image).numpy()
+        result = get_preprocessor()(image)
+
+        assert result.dtype == np.float32
+        assert result.flags["C_CONTIGUOUS"]
+        assert result.shape == reference.shape
+        np.testing.assert_allclose(result, reference, atol=1e-5)
+
+
+def test_preprocess_writes_into_preallocated_buffer():
+    image = decode_image(_jpeg_bytes())
+    batch = np.zeros((2,) + get_preprocessor().output_shape, dtype=np.float32)
+
+    result = preprocess_image(image, out=batch[1])
+
+    assert np.shares_memory(result, batch)
+    np.testing.assert_array_equal(batch[1], preprocess_image(image))
+    assert not batch[0].any()
+
+
+def test_serving_imports_do_not_load_torch():
+    code = (
+        "import sys; import api.app.main, api.app.utils; "
+        "sys.exit(1 if 'torch' in sys.modules or 'torchvision' in sys.modules else 0)"
+    )
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    result = subprocess.run([sys.executable, "-c", code], cwd=project_root, capture_output=True)
+    assert result.returncode == 0, result.stderr.decode()
+
+
+def test_draft_decode_reduces_large_jpegs_but_keeps_min_size():
+    data = _jpeg_bytes(2000, 1500)
+
+    image = decode_image(data, min_size=224)
+
+    assert image.mode == "RGB"
+    assert image.info["original_size"] == (2000, 1500)
+    assert min(image.size) >= 224
+    assert image.size[0] < 2000
+    assert preprocess_image(image).shape == get_preprocessor().output_shape
+
+
+def test_draft_decode_leaves_png_untouched():
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (10, 200, 30)).save(buffer, "PNG")
+
+    image = decode_image(buffer.getvalue(), min_size=160)
+
+    assert image.size == (640, 480)
@@ -0,0 +1,213 @@
+import os
+
+import numpy as np
+import pytest
+
+from api.app import inference
+
+
+def _random_logits(seed=0):
+    total = sum(len(classes) for classes in inference.load_crop_to_global_classes().values())
+    return np.random.RandomState(seed).randn(total).astype(np.float32)
+
+
+def test_segment_softmax_matches_per_crop_postprocessing():
+    logits = _random_logits()
+    probabilities, _ = inference.segment_softmax(logits)
+
+    for crop in inference.CROP_LABELS:
+        result = inference.postprocess_logits(logits, crop)
+        start = inference.get_crop_segments()["offsets"][str(inference.get_crop_id(crop))]
+        segment = probabilities[start:start + len(result["probabilities"])]
+        np.testing.assert_allclose(segment, result["probabilities"], rtol=1e-5, atol=1e-7)
+
+
+def test_segment_softmax_handles_batches():
+    batch = np.stack([_random_logits(1), _random_logits(2)])
+    probabilities, energy = inference.segment_softmax(batch)
+
+    assert probabilities.shape == batch.shape
+    assert energy.shape == (2, len(inference.get_crop_segments()["starts"]))
+    np.testing.assert_allclose(probabilities[1], inference.segment_softmax(batch[1])[0], rtol=1e-6)
+
+
+def test_rank_crops_returns_top_k_for_every_crop():
+    logits = _random_logits()
+    crop = inference.CROP_LABELS[5]
+    start = inference.get_crop_segments()["offsets"][str(inference.get_crop_id(crop))]
+    logits[start:start + 15] += 6.0
+    logits[start + 4] += 3.0
+
+    ranked = inference.rank_crops(logits, top_k=3)
+
+    assert len(ranked) == len(inference.load_crop_to_global_classes())
+    assert ranked[0]["crop_name"] == crop
+    assert np.isclose(sum(entry["crop_probability"] for entry in ranked), 1.0)
+    assert all(len(entry["predictions"]) == 3 for entry in ranked)
+    top = ranked[0]["predictions"]
+    assert top[0]["local_class_index"] == 4
+    assert top[0]["probability"] >= top[1]["probability"] >= top[2]["probability"]
+
+
+def test_unknown_crop_is_detected_instead_of_defaulting():
+    logits = _random_logits(3)
+
+    auto = inference.classify_entry({"logits": logits}, "not-a-crop")
+    explicit = inference.classify_entry({"logits": logits}, inference.CROP_LABELS[2])
+
+    assert auto["crop_detected"] and auto["crop_requested"] == "not-a-crop"
+    assert auto["crop_used"] == auto["all_crops"][0]["crop_name"]
+    assert auto["label"] == auto["all_crops"][0]["predictions"][0]["label"]
+    assert "all_crops" not in explicit
+
+
+def test_routed_outputs_match_python_postprocessing():
+    logits = _random_logits(4)
+    crop = inference.CROP_LABELS[7]
+    crop_id = inference.get_crop_id(crop)
+    start = inference.get_crop_segments()["offsets"][str(crop_id)]
+    crop_logits = logits[start:start + 15]
+
+    # What the routed graph emits for one row (padded to the widest head)
+    probabilities = np.exp(crop_logits - crop_logits.max())
+    probabilities /= probabilities.sum()
+    top = np.argsort(-probabilities)[:3]
+    outputs = {
+        "logits": crop_logits[None],
+        "probabilities": probabilities[None],
+        "topk_probabilities": probabilities[top][None],
+        "topk_indices": top[None],
+        "topk_class_ids": np.array(inference.load_crop_to_global_classes()[str(crop_id)])[top][None],
+    }
+
+    routed = inference.postprocess_routed(outputs, 0, crop, crop_id)
+    expected = inference.postprocess_logits(logits, crop)
+
+    for key in ("label", "class_index", "local_class_index", "crop_id"):
+        assert routed[key] == expected[key]
+    np.testing.assert_allclose(routed["probabilities"], expected["probabilities"], rtol=1e-5)
+    assert [entry["local_class_index"] for entry in routed["top_k"]] == top.tolist()
+
+
+def test_variant_path_sits_next_to_the_fp32_model():
+    assert inference.get_variant_path("models/mobilenet.onnx", "fp32") == "models/mobilenet.onnx"
+    assert inference.get_variant_path("models/mobilenet.onnx", "int8") == "models/mobilenet_int8.onnx"
+    assert inference.get_variant_path("models/backbone.onnx", "INT8") == "models/backbone_int8.onnx"
+
+
+def _export_routed_model(path, heads):
+    """A tiny graph with the routed export's inputs and outputs (pooled 576-d backbone, gathered heads)"""
+    from onnx import TensorProto, helper, numpy_helper, save
+
+    num_crops = len(heads)
+    width = max(len(bias) for _, bias in heads.values())
+    weight = np.zeros((num_crops, width, 576), dtype=np.float32)
+    bias = np.full((num_crops, width), -1e4, dtype=np.float32)
+    class_ids = np.zeros((num_crops, width), dtype=np.int64)
+    for cid, (head_weight, head_bias) in heads.items():
+        rows = len(head_bias)
+        weight[int(cid), :rows], bias[int(cid), :rows] = head_weight, head_bias
+        class_ids[int(cid), :rows] = inference.load_crop_to_global_classes()[cid]
+
+    rng = np.random.RandomState(1)
+    initializers = [
+        numpy_helper.from_array(rng.randn(576, 3, 1, 1).astype(np.float32), "conv_weight"),
+        numpy_helper.from_array(weight, "head_weight"),
+        numpy_helper.from_array(bias, "head_bias"),
+        numpy_helper.from_array(class_ids, "class_ids"),
+        numpy_helper.from_array(np.array([2], dtype=np.int64), "axis"),
+        numpy_helper.from_array(np.array([3], dtype=np.int64), "k"),
+    ]
+    node = helper.make_node
+    nodes = [
+        node("AveragePool", ["image"], ["pooled_image"], kernel_shape=[32, 32], strides=[32, 32]),
+        node("Conv", ["pooled_image", "conv_weight"], ["conv"]),
+        node("Relu", ["conv"], ["features"]),
+        node("GlobalAveragePool", ["features"], ["pooled"]),
+        node("Flatten", ["pooled"], ["embedding"]),
+        node("Gather", ["head_weight", "crop_id"], ["crop_weight"], axis=0),
+        node("Unsqueeze", ["embedding", "axis"], ["column"]),
+        node("MatMul", ["crop_weight", "column"], ["scores"]),
+        node("Squeeze", ["scores", "axis"], ["squeezed"]),
+        node("Gather", ["head_bias", "crop_id"], ["crop_bias"], axis=0),
+        node("Add", ["squeezed", "crop_bias"], ["logits"]),
+        node("Softmax", ["logits"], ["probabilities"], axis=1),
+        node("TopK", ["probabilities", "k"], ["topk_probabilities", "topk_indices"], axis=1),
+        node("Gather", ["class_ids", "crop_id"], ["crop_class_ids"], axis=0),
+        node("GatherElements", ["crop_class_ids", "topk_indices"], ["topk_class_ids"], axis=1),
+    ]
+    float_output = lambda name, shape: helper.make_tensor_value_info(name, TensorProto.FLOAT, shape)
+    graph = helper.make_graph(
+        nodes, "tiny_routed",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["batch", 3, 160, 160]),
+         helper.make_tensor_value_info("crop_id", TensorProto.INT64, ["batch"])],
+        [float_output("logits", ["batch", width]), float_output("probabilities", ["batch", width]),
+         float_output("topk_probabilities", ["batch", 3]),
+         helper.make_tensor_value_info("topk_indices", TensorProto.INT64, ["batch", 3]),
+         helper.make_tensor_value_info("topk_class_ids", TensorProto.INT64, ["batch", 3]),
+         float_output("embedding", ["batch", 576]), float_output("features", ["batch", 576, 5, 5])],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    save(model, str(path))
+
+
+@pytest.fixture
+def routed_files(tmp_path, monkeypatch):
+    from api.app import model_bundle, runtime_profile
+    from api.app.embedding_cache import EmbeddingCache
+    from api.app.utils import cam
+
+    pytest.importorskip("onnx")
+    rng = np.random.RandomState(0)
+    heads = {cid: (rng.randn(len(classes), 576).astype(np.float32), rng.randn(len(classes)).astype(np.float32))
+             for cid, classes in inference.load_crop_to_global_classes().items()}
+    routed_path, heads_path = tmp_path / "mobilenet_routed.onnx", tmp_path / "crop_heads.npz"
+    _export_routed_model(routed_path, heads)
+    np.savez(heads_path, **{f"{kind}_{cid}": arrays[index] for cid, arrays in heads.items()
+                            for index, kind in enumerate(("weight", "bias"))})
+
+    no_bundle = lambda: None
+    monkeypatch.setattr(inference, "get_model_bundle", no_bundle)
+    monkeypatch.setattr(model_bundle, "get_model_bundle", no_bundle)
+    monkeypatch.setattr(inference, "ROUTED_MODEL_PATH", str(routed_path))
+    monkeypatch.setattr(inference, "HEAD_WEIGHTS_PATH", str(heads_path))
+    monkeypatch.setattr(cam, "HEAD_WEIGHTS_PATH", str(heads_path))
+    monkeypatch.setattr(inference, "get_model_paths", lambda: [str(tmp_path / "mobilenet.onnx")])
+    monkeypatch.setattr(cam, "_head_weights", None)
+    for name in ("_model_runtime", "_model_version", "_fused_heads"):
+        monkeypatch.setattr(inference, name, None)
+    monkeypatch.setattr(inference, "embedding_cache", EmbeddingCache(max_entries=4))
+    profile = dict(runtime_profile.get_runtime_profile(), optimized_cache_dir=str(tmp_path / "ort_cache"))
+    monkeypatch.setattr(runtime_profile, "_profile", profile)
+    return tmp_path
+
+
+def test_routed_export_runs_end_to_end(routed_files):
+    images = np.random.RandomState(2).rand(2, 3, 160, 160).astype(np.float32)
+    crop, other = inference.CROP_LABELS[3], inference.CROP_LABELS[6]
+
+    assert inference.get_model_layout() == "routed"
+    routed, auto = inference.run_inference_batch(list(images), [crop, inference.AUTO_CROP], ["a", "b"])
+
+    assert routed["crop_used"] == crop and len(routed["top_k"]) == 3
+    assert auto["crop_detected"] and auto["crop_used"] == auto["all_crops"][0]["crop_name"]
+    # Cached embeddings are re-classified with the head weights, agreeing with the graph
+    cached = inference.classify_cached("a", [crop, other])
+    assert cached[0]["label"] == routed["label"]
+    np.testing.assert_allclose(cached[0]["confidence"], routed["confidence"], rtol=1e-4)
+    assert cached[1]["crop_used"] == other
+
+
+def test_routed_export_without_head_weights(routed_files):
+    from api.app.utils import cam
+
+    os.remove(routed_files / "crop_heads.npz")
+    cam.clear_head_weights()
+    with pytest.raises(FileNotFoundError, match="crop head weights"):
+        inference.load_model()
+
+    # With the fused export next to it, that one is served instead
+    (routed_files / "mobilenet.onnx").write_bytes(b"fused graph")
+    assert inference.get_model_layout() == "fused"
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api.app import inference, inference_server
+from api.app.batching import InferenceQueueFullError
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_run_inference(image_tensor, crop_name=None, image_key=None):
+        calls.append(image_key)
+        if crop_name == "overloaded":
+            raise InferenceQueueFullError("queue full")
+        return {"label": crop_name, "checksum": float(np.asarray(image_tensor).sum()), "cam": np.ones((2, 2))}
+
+    monkeypatch.setattr(inference_server, "INFERENCE_BATCHING", False)
+    monkeypatch.setattr(inference, "run_inference", fake_run_inference)
+    monkeypatch.setattr(inference, "classify_cached", lambda image_key, crop_names: None)
+    monkeypatch.setattr(inference, "get_model_version", lambda: "v1")
+
+    instance = inference_server.InferenceServer(str(tmp_path / "inference.sock"), manage_model=False)
+    thread = threading.Thread(target=instance.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if instance._socket is not None:
+            break
+        time.sleep(0.01)
+    instance.calls = calls
+    yield instance
+    instance.stop()
+    thread.join(5)
+
+
+def test_tensors_round_trip_through_shared_memory(server):
+    async def scenario():
+        client = inference_server.InferenceClient(server.socket_path, max_connections=2)
+        images = [np.full((3, 8, 8), i, dtype=np.float32) for i in range(6)]
+        results = await asyncio.gather(*[client.infer(image, "tomato", f"key{i}") for i, image in enumerate(images)])
+        blocks = {connection.block.name for connection in client._idle}
+        client.close()
+        return client, results, blocks
+
+    client, results, blocks = asyncio.run(scenario())
+
+    assert [result["checksum"] for result in results] == [i * 3 * 8 * 8 for i in range(6)]
+    assert results[0]["label"] == "tomato" and results[0]["cam"].shape == (2, 2)
+    assert sorted(server.calls) == [f"key{i}" for i in range(6)]
+    assert client.model_version == "v1"
+    # Connections (and their shared-memory blocks) are reused
+    assert len(blocks) <= 2
+
+
+def test_server_errors_reach_the_worker(server):
+    async def scenario():
+        client = inference_server.InferenceClient(server.socket_path)
+        try:
+            with pytest.raises(InferenceQueueFullError):
+                await client.infer(np.zeros((3, 4, 4), dtype=np.float32), "overloaded")
+            # The connection stays usable after a failed request
+            return await client.infer(np.ones((3, 4, 4), dtype=np.float32), "maize")
+        finally:
+            client.close()
+
+    assert asyncio.run(scenario())["checksum"] == 48.0
+
+
+def test_unreachable_server_raises(tmp_path):
+    async def scenario():
+        await inference_server.InferenceClient(str(tmp_path / "missing.sock")).infer(np.zeros(3, dtype=np.float32))
+
+    with pytest.raises(inference_server.InferenceServerError):
+        asyncio.run(scenario())
+
+
+def test_model_version_is_asked_for_again_after_the_ttl(server, monkeypatch):
+    async def scenario():
+        client = inference_server.InferenceClient(server.socket_path, version_ttl=0.05)
+        try:
+            first = await client.get_model_version()
+            # A hot reload in the server
+            monkeypatch.setattr(inference, "get_model_version", lambda: "v2")
+            cached = await client.get_model_version()
+            await asyncio.sleep(0.06)
+            return first, cached, await client.get_model_version()
+        finally:
+            client.close()
+
+    assert asyncio.run(scenario()) == ("v1", "v1", "v2")
+
+
+def test_served_version_comes_from_the_server_not_the_model_files(monkeypatch):
+    class Client:
+        async def get_model_version(self):
+            return "server-v3"
+
+    def hash_model_files():
+        raise AssertionError("the worker must not hash the model files")
+
+    monkeypatch.setattr(inference_server, "INFERENCE_SERVER", True)
+    monkeypatch.setattr(inference_server, "get_inference_client", Client)
+    monkeypatch.setattr(inference, "get_model_version", hash_model_files)
+    assert asyncio.run(inference_server.get_served_model_version()) == "server-v3"
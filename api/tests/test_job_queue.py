@@ -0,0 +1,251 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from api.app.job_queue import JobQueue, is_transient_error
+
+
+def _queue(tmp_path, **kwargs):
+    kwargs.setdefault("base_delay", 0)
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+
+def test_enqueue_is_idempotent_and_spools_bytes(tmp_path):
+    queue = _queue(tmp_path)
+    assert queue.enqueue("storage:images/1.jpg", "storage_upload", {"path": "images/1.jpg"}, b"jpeg")
+    assert not queue.enqueue("storage:images/1.jpg", "storage_upload", {"path": "images/1.jpg"}, b"jpeg")
+
+    jobs = queue.claim()
+    assert [job.id for job in jobs] == ["storage:images/1.jpg"]
+    assert queue.read_blob(jobs[0]) == b"jpeg"
+    assert queue.claim() == []
+
+    queue.complete(jobs[0])
+    assert os.listdir(queue.spool_dir) == []
+    # Finished work is remembered, so queueing it again is still a no-op
+    assert not queue.enqueue("storage:images/1.jpg", "storage_upload", {"path": "images/1.jpg"}, b"jpeg")
+    assert os.listdir(queue.spool_dir) == []
+    assert queue.counts()["done"] == 1
+
+
+def test_failed_jobs_back_off_and_retry_until_they_succeed(tmp_path):
+    queue = _queue(tmp_path)
+    calls = []
+
+    async def flaky(payload, data):
+        calls.append((payload["row"]["id"], data))
+        if len(calls) < 3:
+            raise ConnectionError("database unavailable")
+
+    queue.register("detection_insert", flaky)
+    queue.enqueue("insert:1", "detection_insert", {"row": {"id": "1"}})
+
+    async def drain():
+        for _ in range(5):
+            await queue.process_due()
+
+    asyncio.run(drain())
+    assert calls == [("1", None)] * 3
+    stats = queue.stats()
+    assert stats["retried"] == 2 and stats["succeeded"] == 1
+    assert stats["jobs"]["done"] == 1 and stats["jobs"]["pending"] == 0
+
+    delays = [queue.retry_delay(attempt) for attempt in (1, 4)]
+    assert delays == [0.0, 0.0]
+    backoff = _queue(tmp_path / "b", base_delay=2, max_delay=10)
+    assert 1.0 <= backoff.retry_delay(1) <= 2.0 and 5.0 <= backoff.retry_delay(6) <= 10.0
+
+
+def test_jobs_give_up_after_max_attempts(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2)
+
+    async def broken(payload, data):
+        raise RuntimeError("bad payload")
+
+    queue.register("llama_enrichment", broken)
+    queue.enqueue("llama:1", "llama_enrichment", {"id": "1"})
+
+    async def drain():
+        return [await queue.process_due() for _ in range(3)]
+
+    assert asyncio.run(drain()) == [1, 1, 0]
+    assert queue.counts()["dead"] == 1 and queue.stats()["dead"] == 1
+
+
+def test_restarted_worker_picks_up_abandoned_jobs(tmp_path):
+    crashed = _queue(tmp_path, lease_seconds=0)
+    crashed.enqueue("storage:images/2.jpg", "storage_upload", {"path": "images/2.jpg"}, b"data")
+    assert len(crashed.claim()) == 1  # ...and the process dies before finishing
+
+    uploaded = []
+
+    async def upload(payload, data):
+        uploaded.append((payload["path"], data))
+
+    restarted = _queue(tmp_path)
+    restarted.register("storage_upload", upload)
+
+    async def run_worker():
+        restarted.start()
+        for _ in range(100):
+            if uploaded:
+                break
+            await asyncio.sleep(0.01)
+        await restarted.stop()
+
+    asyncio.run(run_worker())
+    assert uploaded == [("images/2.jpg", b"data")]
+    assert restarted.counts()["done"] == 1
+
+
+def test_late_completion_keeps_the_new_owners_spool(tmp_path):
+    first = _queue(tmp_path, lease_seconds=0)
+    first.enqueue("storage:images/3.jpg", "storage_upload", {"path": "images/3.jpg"}, b"data")
+    stale = first.claim()[0]
+
+    second = _queue(tmp_path)
+    current = second.claim()[0]
+    # The first worker finishes after its lease expired and the job moved on
+    assert not first.complete(stale)
+    assert second.read_blob(current) == b"data"
+    assert second.complete(current)
+    assert os.listdir(second.spool_dir) == []
+
+
+def test_dead_jobs_drop_their_spool_and_are_pruned(tmp_path):
+    queue = _queue(tmp_path, max_attempts=1, retention_seconds=0)
+
+    async def rejected(payload, data):
+        raise RuntimeError("bucket not found")
+
+    queue.register("storage_upload", rejected)
+    queue.enqueue("storage:images/4.jpg", "storage_upload", {"path": "images/4.jpg"}, b"data")
+    asyncio.run(queue.process_due())
+
+    assert os.listdir(queue.spool_dir) == []
+    assert queue.counts()["dead"] == 1
+    time.sleep(0.01)
+    queue.prune()
+    assert queue.counts()["dead"] == 0 and queue.stats()["dead"] == 1
+
+
+def test_handlers_time_out_before_their_lease(tmp_path):
+    queue = _queue(tmp_path, lease_seconds=0.1, handler_timeout=60)
+    assert queue.handler_timeout == pytest.approx(0.08)
+
+    async def hung(payload, data):
+        await asyncio.sleep(10)
+
+    queue.register("llama_enrichment", hung)
+    queue.enqueue("llama:5", "llama_enrichment", {"id": "5"})
+    assert asyncio.run(queue.process_due()) == 1
+    assert queue.counts()["pending"] == 1 and queue.stats()["retried"] == 1
+
+
+def test_only_outages_are_transient():
+    import httpx
+    from postgrest.exceptions import APIError
+    from storage3.exceptions import StorageApiError
+
+    assert is_transient_error(asyncio.TimeoutError())
+    assert is_transient_error(ConnectionError("reset"))
+    assert is_transient_error(httpx.ConnectError("refused"))
+    assert is_transient_error(StorageApiError("unavailable", "ServiceUnavailable", 503))
+    assert is_transient_error(APIError({"message": "JSON could not be generated", "code": 502}))
+    assert is_transient_error(APIError({"message": "connection refused", "code": "PGRST001"}))
+
+    assert not is_transient_error(StorageApiError("The resource already exists", "Duplicate", 409))
+    assert not is_transient_error(StorageApiError("new row violates row-level security policy", "Unauthorized", "403"))
+    assert not is_transient_error(APIError({"message": "duplicate key", "code": "23505"}))
+    assert not is_transient_error(APIError({"message": "column does not exist", "code": "42703"}))
+    assert not is_transient_error(KeyError("pest_name"))
+
+
+def test_upload_pipeline_queues_outages_but_not_rejections(tmp_path, monkeypatch):
+    from storage3.exceptions import StorageApiError
+
+    from api.app import api
+    from api.app.pipeline import PipelineError
+
+    queue = _queue(tmp_path)
+    failure = {}
+
+    class Bucket:
+        async def upload(self, path, data, options=None):
+            raise failure["error"]
+
+        async def get_public_url(self, path):
+            return f"https://storage/{path}"
+
+    class Client:
+        class storage:
+            @staticmethod
+            def from_(bucket):
+                return Bucket()
+
+    async def fake_client():
+        return Client()
+
+    monkeypatch.setattr(api, "get_supabase_client", fake_client)
+    monkeypatch.setattr(api, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(api, "make_storage_image", lambda data, image: data)
+
+    def store_image(upload_id):
+        pipeline = api.build_upload_pipeline(upload_id, b"jpeg", None, None, {"label": "tomato_blight", "confidence": 0.9},
+                                             "tomato", use_llama=False, insert=False)
+        return asyncio.run(pipeline.run())
+
+    failure["error"] = StorageApiError("unavailable", "ServiceUnavailable", 503)
+    monkeypatch.setattr(api, "render_heatmap", lambda image, tensor, results: None)
+    assert store_image("1")["image_url"] == "https://storage/images/1.jpg"
+    assert queue.counts()["pending"] == 1
+
+    failure["error"] = StorageApiError("new row violates row-level security policy", "Unauthorized", 403)
+    with pytest.raises(PipelineError):
+        store_image("2")
+    assert queue.counts()["pending"] == 1
+
+
+def test_upload_pipeline_queues_llama_when_ollama_is_down(tmp_path, monkeypatch):
+    import httpx
+    from api.app import api, llama_prompt
+
+    queue = _queue(tmp_path)
+
+    class Bucket:
+        async def get_public_url(self, path):
+            return f"https://storage/{path}"
+
+    class Client:
+        class storage:
+            @staticmethod
+            def from_(bucket):
+                return Bucket()
+
+    class Ollama:
+        async def post(self, path, json=None):
+            raise httpx.ConnectError("connection refused")
+
+    async def fake_client():
+        return Client()
+
+    async def store_image(path, data, upsert=False):
+        return f"https://storage/{path}"
+
+    monkeypatch.setattr(api, "get_supabase_client", fake_client)
+    monkeypatch.setattr(api, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(api, "upload_to_storage", store_image)
+    monkeypatch.setattr(api, "make_storage_image", lambda data, image: data)
+    monkeypatch.setattr(api, "render_heatmap", lambda image, tensor, results: None)
+    monkeypatch.setattr(llama_prompt, "get_async_client", lambda: Ollama())
+
+    pipeline = api.build_upload_pipeline("1", b"jpeg", None, None, {"label": "tomato_blight", "confidence": 0.9},
+                                         "tomato", insert=False)
+    results = asyncio.run(pipeline.run())
+
+    assert results["llama"] is None
+    [job] = queue.claim()
+    assert job.kind == "llama_enrichment"
+    assert job.payload["id"] == "1" and job.payload["image_url"] == "https://storage/images/1.jpg"
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from api.app import inference, lifecycle, model_bundle, model_runtime
+from api.app.embedding_cache import EmbeddingCache
+
+
+class FakeRuntime:
+    def __init__(self, model_path, fail=False):
+        self.model_path = model_path
+        self.fail = fail
+        self.loaded = False
+        self.warmed_shapes = []
+
+    def load(self):
+        if self.fail:
+            raise RuntimeError("corrupt model")
+        self.loaded = True
+        return self
+
+    def get_inputs(self):
+        return [type("Input", (), {"name": "image"})()]
+
+    def warm_up(self, feeds_list):
+        self.warmed_shapes = [feeds["image"].shape for feeds in feeds_list]
+        return 1.0
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    active = FakeRuntime("v1.onnx")
+    monkeypatch.setattr(inference, "_model_runtime", active)
+    monkeypatch.setattr(inference, "_model_version", None)
+    monkeypatch.setattr(inference, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(inference, "load_model", lambda: active.load())
+    monkeypatch.setattr(inference, "run_inference_batch", lambda *args, **kwargs: [])
+    monkeypatch.setattr(inference, "get_model_version", lambda: inference._model_runtime.model_path[:2])
+    monkeypatch.setattr(lifecycle, "model_fingerprint", lambda: ())
+    return active
+
+
+def test_ready_only_after_warmup_at_each_batch_size(fake_model):
+    manager = lifecycle.ModelLifecycle(warmup=True, watch_interval=0)
+    assert not manager.ready
+    assert manager.status()["state"] == "starting"
+
+    manager.start()
+    assert manager.wait_until_ready(5)
+
+    status = manager.status()
+    assert status["state"] == "ready" and status["model_version"] == "v1"
+    sizes = lifecycle.get_warmup_batch_sizes()
+    assert [shape[0] for shape in fake_model.warmed_shapes] == sizes
+    assert all(shape[1:] == (3, 160, 160) for shape in fake_model.warmed_shapes)
+
+
+def test_reload_swaps_runtime_and_drops_old_embeddings(fake_model, monkeypatch):
+    manager = lifecycle.ModelLifecycle(warmup=True, watch_interval=0)
+    manager.load_initial()
+    cache = inference.embedding_cache
+    generation = cache.generation
+    cache.set("image", {"embedding": np.zeros(576)})
+
+    monkeypatch.setattr(inference, "get_loose_model_path", lambda: "v2.onnx")
+    monkeypatch.setattr(model_runtime, "ModelRuntime", FakeRuntime)
+    assert manager.reload()
+
+    assert inference._model_runtime.model_path == "v2.onnx"
+    assert manager.status()["model_version"] == "v2" and manager.status()["reloads"] == 1
+    assert cache.get("image") is None
+    # Outputs computed by the old model while the swap happened are not cached
+    cache.set("late", {"embedding": np.zeros(576)}, generation)
+    assert cache.get("late") is None
+
+
+def test_failed_reload_keeps_serving_the_old_model(fake_model, monkeypatch):
+    manager = lifecycle.ModelLifecycle(warmup=False, watch_interval=0)
+    manager.load_initial()
+
+    monkeypatch.setattr(inference, "get_loose_model_path", lambda: "broken.onnx")
+    monkeypatch.setattr(model_runtime, "ModelRuntime", lambda path: FakeRuntime(path, fail=True))
+    assert not manager.reload()
+
+    status = manager.status()
+    assert inference._model_runtime is fake_model
+    assert status["ready"] and status["model_version"] == "v1"
+    assert status["failed_reloads"] == 1 and "corrupt" in status["last_error"]
+
+
+def test_reload_moves_from_the_bundle_to_newer_loose_files(fake_model, monkeypatch, tmp_path):
+    class ActiveBundle:
+        layout = "routed"
+        path = str(tmp_path / "model_bundle.zip")
+
+        def describe(self, variant):
+            return f"{self.path}#model.onnx"
+
+    routed_path, heads_path = tmp_path / "mobilenet_routed.onnx", tmp_path / "crop_heads.npz"
+    routed_path.write_bytes(b"graph")
+    heads_path.write_bytes(b"heads")
+    monkeypatch.setattr(model_bundle, "_bundle", ActiveBundle())
+    monkeypatch.setattr(model_bundle, "_bundle_checked", True)
+    # The loose files are newer than the bundle, so it is skipped
+    monkeypatch.setattr(model_bundle, "open_model_bundle", lambda: None)
+    monkeypatch.setattr(inference, "ROUTED_MODEL_PATH", str(routed_path))
+    monkeypatch.setattr(inference, "HEAD_WEIGHTS_PATH", str(heads_path))
+    monkeypatch.setattr(inference, "load_head_weights", lambda: {"0": None})
+    monkeypatch.setattr(model_runtime, "ModelRuntime", FakeRuntime)
+
+    manager = lifecycle.ModelLifecycle(warmup=False, watch_interval=0)
+    manager.load_initial()
+    assert manager.reload()
+
+    assert inference._model_runtime.model_path == str(routed_path)
+    assert model_bundle.get_model_bundle() is None
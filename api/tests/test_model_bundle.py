@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+import pytest
+
+from api.app import model_bundle
+
+CROP_TO_GLOBAL = {"0": [0, 1, 2], "1": [3, 4], "10": [5, 6, 7, 8]}
+
+
+def _heads(seed=0):
+    rng = np.random.RandomState(seed)
+    return {cid: (rng.randn(len(classes), 576).astype(np.float32), rng.randn(len(classes)).astype(np.float32))
+            for cid, classes in CROP_TO_GLOBAL.items()}
+
+
+def _write(tmp_path, heads=None, **kwargs):
+    model_path = tmp_path / "model.onnx"
+    model_path.write_bytes(b"graph-bytes" * 100)
+    path = str(tmp_path / "model_bundle.zip")
+    model_bundle.write_bundle(
+        path, str(model_path), "routed", CROP_TO_GLOBAL,
+        class_labels=[f"class_{i}" for i in range(9)], crop_labels=["rice", "maize"] + ["crop"] * 9,
+        preprocess_config={"img_size": 160, "normalize_mean": [0.5] * 3, "normalize_std": [0.25] * 3},
+        head_weights=heads, **kwargs)
+    return path
+
+
+def test_bundle_round_trip_maps_tables_without_copying(tmp_path):
+    heads = _heads()
+    bundle = model_bundle.ModelBundle(_write(tmp_path, heads))
+
+    assert bundle.layout == "routed" and bundle.model_version == bundle.checksum[:16]
+    assert bundle.read_bytes("model.onnx") == b"graph-bytes" * 100
+    assert bundle.labels["crop_labels"][:2] == ["rice", "maize"]
+
+    segments = bundle.crop_segments()
+    expected = model_bundle.build_crop_segments(CROP_TO_GLOBAL)
+    assert segments["offsets"] == expected["offsets"]
+    for name in model_bundle.TABLE_NAMES:
+        np.testing.assert_array_equal(segments[name], expected[name])
+
+    weight, _ = bundle.fused_heads()
+    assert not weight.flags.owndata and not weight.flags.writeable and weight.flags.aligned
+    for cid, (w, b) in bundle.head_weights().items():
+        np.testing.assert_array_equal(w, heads[cid][0])
+        np.testing.assert_array_equal(b, heads[cid][1])
+
+
+def test_corrupt_bundle_is_rejected(tmp_path):
+    path = _write(tmp_path, _heads())
+    bundle = model_bundle.ModelBundle(path)
+    start, _ = bundle._members["model.onnx"]
+    del bundle
+
+    with open(path, "r+b") as f:
+        f.seek(start)
+        f.write(b"X")
+    with pytest.raises(ValueError, match="corrupt"):
+        model_bundle.ModelBundle(path)
+
+
+def test_variants_are_added_and_missing_ones_fall_back(tmp_path):
+    path = _write(tmp_path, model_version="v7")
+    assert model_bundle.ModelBundle(path).model_member("int8") == "model.onnx"
+
+    int8_path = tmp_path / "model_int8.onnx"
+    int8_path.write_bytes(b"int8")
+    model_bundle.add_bundle_variant(path, "int8", str(int8_path))
+
+    bundle = model_bundle.ModelBundle(path)
+    assert bundle.variants == ["fp32", "int8"]
+    assert bundle.read_bytes(bundle.model_member("int8")) == b"int8"
+    assert bundle.describe("int8").endswith("#model_int8.onnx")
+    assert bundle.fused_heads() is None and bundle.head_weights() == {}
+
+
+def test_split_layout_needs_head_weights(tmp_path):
+    model_path = tmp_path / "backbone.onnx"
+    model_path.write_bytes(b"graph")
+    with pytest.raises(ValueError):
+        model_bundle.write_bundle(str(tmp_path / "b.zip"), str(model_path), "split", CROP_TO_GLOBAL,
+                                  [], [], {})
+
+
+def test_missing_variant_is_reported_once(tmp_path, capsys):
+    bundle = model_bundle.ModelBundle(_write(tmp_path))
+    for _ in range(3):
+        assert bundle.model_member("int8") == "model.onnx"
+    assert capsys.readouterr().out.count("not in bundle") == 1
+
+
+def _use_loose_files(monkeypatch, tmp_path, mode="auto", variant="fp32"):
+    loose = tmp_path / "loose"
+    loose.mkdir()
+    monkeypatch.setattr(model_bundle, "MODEL_BUNDLE", mode)
+    monkeypatch.setattr(model_bundle, "MODEL_VARIANT", variant)
+    monkeypatch.setattr(model_bundle, "ROUTED_MODEL_PATH", str(loose / "mobilenet_routed.onnx"))
+    monkeypatch.setattr(model_bundle, "BACKBONE_MODEL_PATH", str(loose / "backbone.onnx"))
+    monkeypatch.setattr(model_bundle, "HEAD_WEIGHTS_PATH", str(loose / "crop_heads.npz"))
+    monkeypatch.setattr(model_bundle, "get_model_paths", lambda: [str(loose / "mobilenet.onnx")])
+    return loose
+
+
+def _touch(path, mtime_ns):
+    path.write_bytes(b"graph")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_bundle_is_skipped_when_loose_files_are_newer(tmp_path, monkeypatch):
+    path = _write(tmp_path)
+    bundle_mtime = os.stat(path).st_mtime_ns
+    loose = _use_loose_files(monkeypatch, tmp_path)
+
+    _touch(loose / "mobilenet_routed.onnx", bundle_mtime - 10**9)
+    assert model_bundle.open_model_bundle(path) is not None
+
+    _touch(loose / "mobilenet_routed.onnx", bundle_mtime + 10**9)
+    assert model_bundle.open_model_bundle(path) is None
+
+    monkeypatch.setattr(model_bundle, "MODEL_BUNDLE", "true")
+    assert model_bundle.open_model_bundle(path) is not None
+    monkeypatch.setattr(model_bundle, "MODEL_BUNDLE", "false")
+    assert model_bundle.open_model_bundle(path) is None
+
+
+def test_loose_variant_wins_over_a_bundle_without_it(tmp_path, monkeypatch):
+    path = _write(tmp_path)
+    bundle_mtime = os.stat(path).st_mtime_ns
+    loose = _use_loose_files(monkeypatch, tmp_path, variant="int8")
+    assert model_bundle.open_model_bundle(path) is not None
+
+    # Quantized without --bundle, but stamped older than the bundle
+    _touch(loose / "mobilenet_routed_int8.onnx", bundle_mtime - 10**9)
+    assert model_bundle.open_model_bundle(path) is None
+
+
+def test_importing_inference_does_not_open_the_bundle():
+    import subprocess
+    import sys
+
+    code = ("from api.app import inference, model_bundle\n"
+            "assert model_bundle._bundle_checked is False\n"
+            "assert inference._crop_labels is None and inference._class_labels is None\n"
+            "assert inference.CROP_LABELS == inference.get_crop_labels()\n")
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api.app.model_runtime import ModelRuntime
+
+
+class SlowSession:
+    def __init__(self, run_seconds=0.0):
+        self.run_seconds = run_seconds
+
+    def run(self, output_names, feeds, run_options=None):
+        time.sleep(self.run_seconds)
+        return [feeds["x"]]
+
+
+def _factory(created, load_seconds=0.0, run_seconds=0.0):
+    def create(path):
+        time.sleep(load_seconds)
+        session = SlowSession(run_seconds)
+        created.append(session)
+        return session
+    return create
+
+
+def test_concurrent_first_requests_load_the_model_once():
+    created = []
+    runtime = ModelRuntime("model.onnx", pool_size=2, session_factory=_factory(created, load_seconds=0.05))
+
+    threads = [threading.Thread(target=runtime.run, args=(None, {"x": i})) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 2
+    assert runtime.stats()["runs"] == 8
+
+
+def test_runs_are_bounded_by_slots_and_spread_over_sessions():
+    created = []
+    runtime = ModelRuntime("model.onnx", pool_size=2, max_concurrent_runs=2,
+                           session_factory=_factory(created, run_seconds=0.02))
+
+    threads = [threading.Thread(target=runtime.run, args=(None, {"x": i})) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = runtime.stats()
+    assert stats["max_in_flight"] == 2
+    assert stats["in_flight"] == 0
+    assert all(count > 0 for count in stats["session_runs"])
+    assert 0.0 < stats["utilization"] <= 1.0
+
+
+def test_shared_session_allows_more_slots_than_sessions():
+    created = []
+    runtime = ModelRuntime("model.onnx", pool_size=1, max_concurrent_runs=3,
+                           session_factory=_factory(created, run_seconds=0.02))
+
+    threads = [threading.Thread(target=runtime.run, args=(None, {"x": i})) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert runtime.stats()["max_in_flight"] == 3
+
+
+def test_failed_load_is_retried():
+    attempts = []
+
+    def flaky(path):
+        attempts.append(path)
+        if len(attempts) == 1:
+            raise RuntimeError("disk not ready")
+        return SlowSession()
+
+    runtime = ModelRuntime("model.onnx", session_factory=flaky)
+    with pytest.raises(RuntimeError):
+        runtime.load()
+    assert not runtime.loaded
+
+    assert runtime.run(None, {"x": 1}) == [1]
+    assert len(attempts) == 2
+
+
+def _relu_session(path=None):
+    onnx = pytest.importorskip("onnx")
+    import onnxruntime as ort
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [helper.make_node("Relu", ["image"], ["out"])],
+        "relu",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["batch", 3])],
+        [helper.make_tensor_value_info("out", TensorProto.FLOAT, ["batch", 3])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    return ort.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+
+
+def test_bound_runs_reuse_preallocated_buffers():
+    runtime = ModelRuntime("model.onnx", session_factory=_relu_session, io_binding=True)
+    runtime.warm_up([{"image": np.zeros((4, 3), dtype=np.float32)}])
+    reserved = runtime.stats()["bound_buffer_bytes"]
+    assert reserved > 0
+
+    seen = []
+    for batch_size in (3, 1, 4):
+        with runtime.bind(batch_size) as batch:
+            rows = batch.inputs["image"]
+            rows[:] = np.arange(batch_size * 3, dtype=np.float32).reshape(batch_size, 3) - 4
+            out = batch.run()["out"]
+            np.testing.assert_array_equal(out, np.maximum(rows, 0))
+            seen.append(out)
+
+    # Every batch size wrote into the same memory, and nothing was reallocated
+    assert np.shares_memory(seen[0], seen[2]) and np.shares_memory(seen[1], seen[2])
+    stats = runtime.stats()
+    assert stats["bound_buffer_bytes"] == reserved
+    assert stats["runs"] == 3 and stats["in_flight"] == 0
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from api.app.pipeline import Pipeline, PipelineError, PipelineStats
+
+
+def _sleeper(seconds, value=None, log=None, name=None):
+    async def stage(results):
+        if log is not None:
+            log.append(("start", name))
+        await asyncio.sleep(seconds)
+        if log is not None:
+            log.append(("end", name))
+        return value
+    return stage
+
+
+def test_independent_stages_overlap_and_dependents_wait():
+    log = []
+
+    async def combine(results):
+        return results["a"] + results["b"]
+
+    pipeline = (
+        Pipeline(stats=PipelineStats())
+        .add("a", _sleeper(0.1, 1, log, "a"))
+        .add("b", _sleeper(0.1, 2, log, "b"))
+        .add("c", _sleeper(0.1, 3, log, "c"))
+        .add("sum", combine, after=["a", "b"])
+    )
+    started = time.monotonic()
+    results = asyncio.run(pipeline.run())
+    elapsed = time.monotonic() - started
+
+    assert results["sum"] == 3 and results["c"] == 3
+    assert elapsed < 0.25
+    assert log[:3] == [("start", "a"), ("start", "b"), ("start", "c")]
+    stats = pipeline.stats.stats()
+    assert stats["runs"] == 1 and set(stats["stages"]) == {"a", "b", "c", "sum"}
+
+
+def test_optional_stage_timeout_uses_default():
+    stats = PipelineStats()
+    pipeline = (
+        Pipeline(stats=stats)
+        .add("llm", _sleeper(5.0, "slow answer"), timeout=0.05, required=False, default=None)
+        .add("insert", lambda results: asyncio.sleep(0, result=results["llm"]), after=["llm"])
+    )
+    started = time.monotonic()
+    results = asyncio.run(pipeline.run())
+
+    assert results["llm"] is None and results["insert"] is None
+    assert time.monotonic() - started < 1.0
+    assert stats.stats()["stages"]["llm"]["timeouts"] == 1
+
+
+def test_required_failure_cancels_other_stages():
+    log = []
+
+    async def broken(results):
+        raise ConnectionError("storage down")
+
+    pipeline = (
+        Pipeline()
+        .add("upload", broken)
+        .add("llm", _sleeper(1.0, "text", log, "llm"))
+        .add("insert", _sleeper(0, None, log, "insert"), after=["upload", "llm"])
+    )
+    with pytest.raises(PipelineError) as error:
+        asyncio.run(pipeline.run())
+
+    assert error.value.stage == "upload"
+    assert isinstance(error.value.error, ConnectionError)
+    assert ("end", "llm") not in log and ("start", "insert") not in log
+
+
+def test_unknown_dependencies_and_cycles_are_rejected():
+    noop = _sleeper(0)
+    with pytest.raises(ValueError):
+        asyncio.run(Pipeline().add("a", noop, after=["missing"]).run())
+    with pytest.raises(ValueError):
+        asyncio.run(Pipeline().add("a", noop, after=["b"]).add("b", noop, after=["a"]).run())
+    with pytest.raises(ValueError):
+        Pipeline().add("a", noop).add("a", noop)
+
+
+def test_fallback_replaces_a_failed_required_stage():
+    stats = PipelineStats()
+    queued = []
+
+    async def upload(results):
+        raise ConnectionError("storage down")
+
+    async def queue_upload(results, error):
+        queued.append(str(error))
+        return "https://storage/images/1.jpg"
+
+    pipeline = (
+        Pipeline(stats=stats)
+        .add("image_url", upload, fallback=queue_upload)
+        .add("insert", lambda results: asyncio.sleep(0, result=results["image_url"]), after=["image_url"])
+    )
+    results = asyncio.run(pipeline.run())
+
+    assert results["insert"] == "https://storage/images/1.jpg"
+    assert queued == ["storage down"]
+    assert stats.stats()["stages"]["image_url"]["fallbacks"] == 1
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from api.app import prefork, runtime_profile
+
+
+def test_intra_op_threads_are_split_across_workers():
+    assert prefork.split_intra_op_threads(4, cpus=8) == 2
+    assert prefork.split_intra_op_threads(3, cpus=8) == 2
+    assert prefork.split_intra_op_threads(8, cpus=2) == 1
+    assert prefork.split_intra_op_threads(0, cpus=4) == 4
+
+
+def test_explicit_thread_count_is_kept(monkeypatch):
+    profile = runtime_profile.default_profile()
+    monkeypatch.setattr(runtime_profile, "_profile", profile)
+    server = prefork.PreforkServer("api.app.main:app", "127.0.0.1", 0, workers=2)
+
+    profile["intra_op_threads"] = 3
+    assert server.configure_threads() == 3
+
+    profile["intra_op_threads"] = 0
+    assert server.configure_threads() == prefork.split_intra_op_threads(2)
+    assert prefork.get_worker_id() is None
+
+
+def test_importing_the_app_creates_no_supabase_client():
+    code = ("from api.app import api\n"
+            "from api.app.utils import supabase_client\n"
+            "assert supabase_client.SupabaseClient._instance is None and api._supabase_client is None\n")
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_each_forked_worker_creates_its_own_clients(monkeypatch):
+    import asyncio
+
+    import supabase
+
+    from api.app import api
+    from api.app.utils import supabase_client
+
+    async def fake_acreate_client(url, key):
+        return {"pid": os.getpid()}
+
+    monkeypatch.setattr(supabase_client, "create_client", lambda url, key: {"pid": os.getpid()})
+    monkeypatch.setattr(supabase_client.SupabaseClient, "_instance", None)
+    monkeypatch.setattr(supabase, "acreate_client", fake_acreate_client)
+    monkeypatch.setattr(api, "_supabase_client", None)
+
+    # Clients the parent made before forking (e.g. during preload)
+    parent_sync = supabase_client.get_supabase_client().client
+    parent_async = asyncio.run(api.get_supabase_client())
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child_sync = supabase_client.get_supabase_client().client
+            child_async = asyncio.run(api.get_supabase_client())
+            ok = (child_sync is not parent_sync and child_sync["pid"] == os.getpid()
+                  and child_async is not parent_async and child_async["pid"] == os.getpid()
+                  and supabase_client.get_supabase_client().client is child_sync)
+            os.write(write_end, b"1" if ok else b"0")
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_end, "rb") as f:
+        assert f.read() == b"1"
+
+    # The parent keeps its own
+    assert supabase_client.get_supabase_client().client is parent_sync
+    assert asyncio.run(api.get_supabase_client()) is parent_async
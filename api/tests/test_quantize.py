@@ -0,0 +1,81 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime.quantization")
+
+_SCRIPT = Path(__file__).resolve().parents[2] / "scripts" / "quantize_multicrop_onnx.py"
+
+
+def _load_script():
+    spec = importlib.util.spec_from_file_location("quantize_multicrop_onnx", _SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write_model(path, outputs=("logits", "features")):
+    """Conv backbone -> feature map, then pooled embedding -> MatMul + Add head (unnamed nodes)"""
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.RandomState(0)
+    initializers = [
+        numpy_helper.from_array(rng.randn(8, 3, 3, 3).astype(np.float32), "conv_weight"),
+        numpy_helper.from_array(rng.randn(8).astype(np.float32), "conv_bias"),
+        numpy_helper.from_array(rng.randn(8, 5).astype(np.float32), "head_weight"),
+        numpy_helper.from_array(np.array([0, 0, -1e4, -1e4, -1e4], dtype=np.float32), "head_bias"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["image", "conv_weight", "conv_bias"], ["conv"], pads=[1, 1, 1, 1]),
+        helper.make_node("Relu", ["conv"], ["features"]),
+        helper.make_node("GlobalAveragePool", ["features"], ["pooled"]),
+        helper.make_node("Flatten", ["pooled"], ["embedding"]),
+        helper.make_node("MatMul", ["embedding", "head_weight"], ["scores"]),
+        helper.make_node("Add", ["scores", "head_bias"], ["logits"]),
+    ]
+    shapes = {"logits": ["batch", 5], "features": ["batch", 8, 16, 16], "embedding": ["batch", 8]}
+    graph = helper.make_graph(
+        nodes, "tiny_multicrop",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["batch", 3, 16, 16])],
+        [helper.make_tensor_value_info(name, TensorProto.FLOAT, shapes[name]) for name in outputs],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, str(path))
+
+
+def test_only_the_backbone_is_quantized(tmp_path):
+    script = _load_script()
+    model_path, output_path = tmp_path / "tiny.onnx", tmp_path / "tiny_int8.onnx"
+    _write_model(model_path)
+    images = np.random.RandomState(1).rand(8, 3, 16, 16).astype(np.float32)
+
+    script.quantize_model(str(model_path), str(output_path), script.ImageCalibrationReader(images, "image"))
+
+    graph = onnx.load(str(output_path)).graph
+    producers = {output: node for node in graph.node for output in node.output}
+    conv = next(node for node in graph.node if node.op_type == "Conv")
+    # Pre-processing may fuse the head's MatMul + Add into a Gemm
+    head = [node for node in graph.node if node.op_type in ("MatMul", "Add", "Gemm")]
+    assert producers[conv.input[1]].op_type == "DequantizeLinear"
+    assert head
+    # The head reads FP32 weights and activations, not dequantized tensors
+    for node in head:
+        assert all(name not in producers or producers[name].op_type != "DequantizeLinear" for name in node.input)
+    initializers = {initializer.name: initializer.data_type for initializer in graph.initializer}
+    assert initializers["head_weight"] == initializers["head_bias"] == onnx.TensorProto.FLOAT
+
+
+def test_a_graph_without_a_feature_map_is_rejected(tmp_path):
+    script = _load_script()
+    model_path = tmp_path / "tiny.onnx"
+    _write_model(model_path, outputs=("logits",))
+    images = np.zeros((2, 3, 16, 16), dtype=np.float32)
+
+    with pytest.raises(ValueError, match="features"):
+        script.quantize_model(str(model_path), str(tmp_path / "out.onnx"),
+                              script.ImageCalibrationReader(images, "image"))
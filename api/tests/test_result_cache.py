@@ -0,0 +1,86 @@
+from api.app.result_cache import ResultCache, hash_image, make_cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_normalizes_crop_and_tracks_model_version():
+    image_hash = hash_image(b"leaf-bytes")
+
+    assert make_cache_key(image_hash, " Tomato", "v1") == make_cache_key(image_hash, "tomato", "v1")
+    assert make_cache_key(image_hash, "tomato", "v1") != make_cache_key(image_hash, "potato", "v1")
+    assert make_cache_key(image_hash, "tomato", "v1") != make_cache_key(image_hash, "tomato", "v2")
+    assert make_cache_key(image_hash, "tomato", "v1") != make_cache_key(hash_image(b"other"), "tomato", "v1")
+
+
+def test_lru_eviction_and_counters():
+    cache = ResultCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", {"id": "a"})
+    cache.set("b", {"id": "b"})
+    assert cache.get("a") == {"id": "a"}  # "b" is now least recently used
+
+    cache.set("c", {"id": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"id": "a"}
+    assert cache.get("c") == {"id": "c"}
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_callers_cannot_change_cached_values():
+    cache = ResultCache(max_entries=2, ttl_seconds=60)
+    stored = {"id": "a", "top_k": [{"label": "blight"}]}
+    cache.set("a", stored)
+    stored["id"] = "changed"
+
+    hit = cache.get("a")
+    hit["id"] = "mutated"
+    hit["top_k"][0]["label"] = "mutated"
+
+    assert cache.get("a") == {"id": "a", "top_k": [{"label": "blight"}]}
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ResultCache(max_entries=10, ttl_seconds=30, clock=clock)
+    cache.set("a", {"id": "a"})
+
+    clock.now += 29
+    assert cache.get("a") == {"id": "a"}
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_byte_budget_bounds_memory():
+    cache = ResultCache(max_entries=100, max_bytes=200, ttl_seconds=60)
+    for i in range(10):
+        cache.set(str(i), {"diagnosis": "x" * 50})
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 200
+    assert stats["entries"] < 10
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    clock = FakeClock()
+    first = ResultCache(max_entries=10, ttl_seconds=60, disk_dir=str(tmp_path), clock=clock)
+    first.set("a", {"id": "a", "confidence": 0.9})
+
+    second = ResultCache(max_entries=10, ttl_seconds=60, disk_dir=str(tmp_path), clock=clock)
+    assert second.get("a") == {"id": "a", "confidence": 0.9}
+    assert second.stats()["disk_hits"] == 1
+
+    clock.now += 61
+    third = ResultCache(max_entries=10, ttl_seconds=60, disk_dir=str(tmp_path), clock=clock)
+    assert third.get("a") is None
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,133 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from api.app import runtime_profile
+
+onnx = pytest.importorskip("onnx")
+
+
+def _write_model(path):
+    from onnx import TensorProto, helper, numpy_helper
+
+    weight = numpy_helper.from_array(np.arange(12, dtype=np.float32).reshape(4, 3), "weight")
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["x", "weight"], ["y"]), helper.make_node("Relu", ["y"], ["out"])],
+        "tiny",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, ["batch", 4])],
+        [helper.make_tensor_value_info("out", TensorProto.FLOAT, ["batch", 3])],
+        initializer=[weight],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, str(path))
+
+
+@pytest.fixture
+def profile(tmp_path):
+    profile = runtime_profile.default_profile()
+    profile.update(providers=["CPUExecutionProvider"], optimized_cache_dir=str(tmp_path / "cache"),
+                   intra_op_threads=1, allow_spinning=False)
+    return profile
+
+
+def _run(session):
+    return session.run(None, {"x": np.ones((2, 4), dtype=np.float32)})[0]
+
+
+def test_profile_file_overrides_defaults(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps({"session": {"intra_op_threads": 2, "execution_mode": "parallel"}}))
+
+    profile = runtime_profile.load_runtime_profile(str(path))
+    options = runtime_profile.build_session_options(profile)
+
+    assert options.intra_op_num_threads == 2
+    assert profile["execution_mode"] == "parallel"
+
+    path.write_text(json.dumps({"graph_optimization": "turbo"}))
+    with pytest.raises(ValueError):
+        runtime_profile.load_runtime_profile(str(path))
+
+
+def test_optimized_graph_is_cached_and_reused(tmp_path, profile):
+    model_path = tmp_path / "tiny.onnx"
+    _write_model(model_path)
+    hits = runtime_profile._stats["cache_hits"]
+
+    expected = _run(runtime_profile.create_session(str(model_path), profile))
+    entries = sorted(os.listdir(profile["optimized_cache_dir"]))
+    assert len(entries) == 2 and entries[0].endswith(".json")
+
+    np.testing.assert_allclose(_run(runtime_profile.create_session(str(model_path), profile)), expected)
+    assert runtime_profile._stats["cache_hits"] == hits + 1
+
+
+def test_corrupt_or_stale_entries_are_rebuilt(tmp_path, profile):
+    model_path = tmp_path / "tiny.onnx"
+    _write_model(model_path)
+    runtime_profile.create_session(str(model_path), profile)
+    cache_dir = profile["optimized_cache_dir"]
+    optimized = [name for name in os.listdir(cache_dir) if name.endswith(".onnx")][0]
+
+    with open(os.path.join(cache_dir, optimized), "ab") as f:
+        f.write(b"garbage")
+    assert runtime_profile.validate_optimized_cache(cache_dir) == {"kept": 0, "removed": 1}
+    assert os.listdir(cache_dir) == []
+
+    expected = _run(runtime_profile.create_session(str(model_path), profile))
+    meta_path = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".json")][0]
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta["ort_version"] = "0.0.0"
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+    np.testing.assert_allclose(_run(runtime_profile.create_session(str(model_path), profile)), expected)
+    assert runtime_profile.validate_optimized_cache(cache_dir)["kept"] == 1
+
+
+def test_entries_from_another_cpu_are_not_used(tmp_path, profile, monkeypatch):
+    model_path = tmp_path / "tiny.onnx"
+    _write_model(model_path)
+    runtime_profile.create_session(str(model_path), profile)
+    cache_dir = profile["optimized_cache_dir"]
+
+    # The same cache directory on a machine with other instruction set extensions
+    monkeypatch.setattr(runtime_profile, "_cpu_features", "other-cpu")
+    hits = runtime_profile._stats["cache_hits"]
+    runtime_profile.create_session(str(model_path), profile)
+    assert runtime_profile._stats["cache_hits"] == hits
+    assert len([name for name in os.listdir(cache_dir) if name.endswith(".json")]) == 2
+    assert runtime_profile.validate_optimized_cache(cache_dir) == {"kept": 1, "removed": 1}
+
+
+def test_session_from_model_bytes_shares_the_cache_entry(tmp_path, profile):
+    model_path = tmp_path / "tiny.onnx"
+    _write_model(model_path)
+    expected = _run(runtime_profile.create_session(str(model_path), profile))
+    hits = runtime_profile._stats["cache_hits"]
+
+    session = runtime_profile.create_session("bundle.zip#model.onnx", profile, model_bytes=model_path.read_bytes())
+
+    np.testing.assert_allclose(_run(session), expected)
+    assert runtime_profile._stats["cache_hits"] == hits + 1
+
+
+def test_autotuned_profile_sections_are_applied(tmp_path, monkeypatch):
+    from api.app import batching
+
+    path = tmp_path / "tuned.json"
+    path.write_text(json.dumps({
+        "session": {"intra_op_threads": 2},
+        "batching": {"max_batch_size": 4, "max_wait_ms": 1.5},
+        "server": {"workers": 3},
+    }))
+    monkeypatch.setattr(runtime_profile, "RUNTIME_PROFILE_PATH", str(path))
+
+    assert runtime_profile.load_runtime_profile()["intra_op_threads"] == 2
+    assert batching.get_batch_settings() == {"max_batch_size": 4, "max_wait_ms": 1.5}
+    assert runtime_profile.load_profile_section("server") == {"workers": 3}
+    assert runtime_profile.load_profile_section("missing") == {}
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Make the project root importable so tests can use `api.app...`
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# The app creates a Supabase client at import time - give it placeholder credentials
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
@@ -13,12 +13,35 @@ sys.path.insert(0, current_dir)
 
 # Import the FastAPI app
 from api.app.main import app
+from api.app.config import SERVER_PREFORK, INFERENCE_SERVER
+from api.app.prefork import get_server_workers
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        app,
-        host=os.getenv("API_HOST", "0.0.0.0"),
-        port=int(os.getenv("PORT", 8000)),
-        reload=False
-    )
+    host = os.getenv("API_HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", 8000))
+    workers = get_server_workers()
+    
+    inference_server = None
+    if INFERENCE_SERVER:
+        # One process owns the model and batches for every web worker
+        from api.app.inference_server import start_inference_server
+        inference_server = start_inference_server()
+    
+    try:
+        if workers > 1 and SERVER_PREFORK:
+            # Load the model tables once, then fork workers that share them
+            from api.app.prefork import serve
+            serve("api.app.main:app", host=host, port=port, workers=workers)
+        else:
+            import uvicorn
+            uvicorn.run(
+                "api.app.main:app" if workers > 1 else app,
+                host=host,
+                port=port,
+                workers=workers,
+                reload=False
+            )
+    finally:
+        if inference_server is not None:
+            inference_server.terminate()
+            inference_server.wait(10)
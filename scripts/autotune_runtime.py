@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Autotune ONNX Runtime threads, micro-batching and worker count for this host.
+
+Loads the model the API would serve (the bundle or the loose files in
+api/models), drives it with synthetic 160x160 inputs and sweeps, in order:
+
+  1. session settings: intra-op threads (plus inter-op threads with the
+     parallel execution mode) - single-image latency and full-batch throughput
+  2. micro-batching: maximum batch size and wait window, with concurrent
+     clients going through the real batcher and postprocessing
+  3. worker processes: N independent workers, each with its share of the
+     CPUs, the way the pre-fork server runs them
+
+Each trial reports throughput and p50 / p99 latency. The best configuration
+(highest throughput whose p99 stays within --max-p99-ms, if given) is
+written as a runtime profile the API loads at startup when
+RUNTIME_PROFILE_PATH points at it:
+
+    {"session": {...}, "batching": {...}, "server": {"workers": N}, ...}
+
+Re-run it whenever the instance type changes.
+
+Usage:
+    python scripts/autotune_runtime.py [--output api/models/runtime_profile.json]
+        [--duration 3] [--concurrency 16] [--max-p99-ms 250] [--quick]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root to the path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+
+def summarize(latencies_ms, elapsed, images):
+    """Throughput (images/s) and latency percentiles of one trial"""
+    latencies = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "throughput": images / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+        "requests": int(latencies.size),
+    }
+
+
+def thread_candidates(cpus, quick=False):
+    candidates = {1, cpus} if quick else {1, 2, 4, cpus // 2, cpus}
+    return sorted(count for count in candidates if 1 <= count <= cpus)
+
+
+def model_source():
+    """(label, serialized model or None) of the graph the API would load"""
+    from api.app.config import MODEL_VARIANT
+    from api.app.inference import get_active_model_path
+    from api.app.model_bundle import get_model_bundle
+
+    bundle = get_model_bundle()
+    if bundle is not None:
+        return bundle.describe(MODEL_VARIANT), bundle.read_bytes(bundle.model_member(MODEL_VARIANT))
+    return get_active_model_path(), None
+
+
+def make_session(settings):
+    """InferenceSession for the served model with session settings overridden"""
+    from api.app.runtime_profile import create_session, get_runtime_profile, validate_profile
+
+    profile = validate_profile(dict(get_runtime_profile(), **settings))
+    label, model_bytes = model_source()
+    return create_session(label, profile, model_bytes=model_bytes)
+
+
+def make_feeds(session, batch_size, seed=0):
+    from api.app.inference import get_input_name
+    from api.app.lifecycle import build_warmup_feeds
+
+    feeds = build_warmup_feeds(session, [batch_size])[0]
+    image_input = get_input_name(session)
+    feeds[image_input] = np.random.RandomState(seed).rand(*feeds[image_input].shape).astype(np.float32)
+    return feeds
+
+
+def time_calls(func, duration, warmup=3):
+    """Call func repeatedly for duration seconds; per-call latencies in ms"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        call_started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - call_started) * 1000.0)
+    return latencies, time.perf_counter() - started
+
+
+def drive(infer, concurrency, duration, image_shape, crops):
+    """Closed-loop load: each client sends its next image when the last one returns"""
+    latencies = [[] for _ in range(concurrency)]
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        image = np.random.RandomState(index).rand(*image_shape).astype(np.float32)
+        crop = crops[index % len(crops)]
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            infer(image, crop)
+            latencies[index].append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    merged = [latency for client_latencies in latencies for latency in client_latencies]
+    return merged, time.perf_counter() - started
+
+
+def tune_session(candidates, batch_size, duration):
+    """Stage 1: single-image latency and batch throughput per session setting"""
+    trials = []
+    for settings in candidates:
+        session = make_session(settings)
+        single = make_feeds(session, 1)
+        batch = make_feeds(session, batch_size)
+        latencies, elapsed = time_calls(lambda: session.run(None, single), duration / 2)
+        latency = summarize(latencies, elapsed, len(latencies))
+        latencies, elapsed = time_calls(lambda: session.run(None, batch), duration / 2)
+        throughput = summarize(latencies, elapsed, len(latencies) * batch_size)
+        trials.append({"settings": settings, "single": latency, "batch": throughput})
+        print(f"  {json.dumps(settings):<70} p50 {latency['p50_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms  "
+              f"batch {batch_size}: {throughput['throughput']:8.1f} img/s")
+        del session
+    return trials
+
+
+def make_runtime(settings):
+    from api.app.model_bundle import get_model_bundle
+    from api.app.model_runtime import ModelRuntime
+
+    label, _ = model_source()
+    return ModelRuntime(label, session_factory=lambda _: make_session(settings), bundle=get_model_bundle())
+
+
+def run_batching_trial(batch_size, wait_ms, concurrency, duration, crops):
+    from api.app.batching import InferenceBatcher
+    from api.app.utils.image_utils import get_preprocessor
+
+    batcher = InferenceBatcher(max_batch_size=batch_size, max_wait_ms=wait_ms)
+    try:
+        latencies, elapsed = drive(lambda image, crop: batcher.infer(image, crop), concurrency, duration,
+                                   get_preprocessor().output_shape, crops)
+    finally:
+        batcher.stop(timeout=10)
+    return summarize(latencies, elapsed, len(latencies))
+
+
+def tune_batching(settings, batch_sizes, windows, concurrency, duration, crops):
+    """Stage 2: batch size x wait window through the real batcher"""
+    from api.app import inference
+    from api.app.lifecycle import build_warmup_feeds
+
+    runtime = make_runtime(settings).load()
+    runtime.warm_up(build_warmup_feeds(runtime, batch_sizes))
+    inference.swap_model_runtime(runtime)
+
+    trials = []
+    for batch_size in batch_sizes:
+        for wait_ms in windows:
+            result = run_batching_trial(batch_size, wait_ms, concurrency, duration, crops)
+            trials.append({"batching": {"max_batch_size": batch_size, "max_wait_ms": wait_ms}, **result})
+            print(f"  batch {batch_size:>3}  wait {wait_ms:>5.1f} ms  {result['throughput']:8.1f} img/s  "
+                  f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms")
+    return trials
+
+
+def _worker_main(settings, batching, concurrency, duration, crops, barrier, results):
+    """One worker process of stage 3 (spawned, so it loads its own sessions)"""
+    from api.app import inference
+    from api.app.lifecycle import build_warmup_feeds
+
+    runtime = make_runtime(settings).load()
+    runtime.warm_up(build_warmup_feeds(runtime, [1, batching["max_batch_size"]]))
+    inference.swap_model_runtime(runtime)
+    barrier.wait()
+    from api.app.batching import InferenceBatcher
+    from api.app.utils.image_utils import get_preprocessor
+
+    batcher = InferenceBatcher(**batching)
+    try:
+        latencies, elapsed = drive(lambda image, crop: batcher.infer(image, crop), concurrency, duration,
+                                   get_preprocessor().output_shape, crops)
+    finally:
+        batcher.stop(timeout=10)
+    results.put((latencies, elapsed))
+
+
+def tune_workers(settings, batching, worker_counts, max_threads, concurrency, duration, crops):
+    """Stage 3: N worker processes sharing the CPUs and the client load"""
+    from api.app.prefork import split_intra_op_threads
+
+    context = multiprocessing.get_context("spawn")
+    trials = []
+    for workers in worker_counts:
+        worker_settings = dict(settings, intra_op_threads=min(max_threads, split_intra_op_threads(workers)))
+        clients = max(1, -(-concurrency // workers))
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [
+            context.Process(target=_worker_main,
+                            args=(worker_settings, batching, clients, duration, crops, barrier, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        latencies = [latency for worker_latencies, _ in collected for latency in worker_latencies]
+        elapsed = max(worker_elapsed for _, worker_elapsed in collected)
+        result = summarize(latencies, elapsed, len(latencies))
+        trials.append({"workers": workers, "session": worker_settings, **result})
+        print(f"  {workers:>2} worker(s) x {worker_settings['intra_op_threads']} thread(s)  "
+              f"{result['throughput']:8.1f} img/s  p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms")
+    return trials
+
+
+def pick_best(trials, max_p99_ms=None, key=lambda trial: trial):
+    """Highest throughput within the p99 budget (lowest p99 if nothing fits)"""
+    within = [trial for trial in trials if max_p99_ms is None or key(trial)["p99_ms"] <= max_p99_ms]
+    if not within:
+        return min(trials, key=lambda trial: key(trial)["p99_ms"])
+    return max(within, key=lambda trial: key(trial)["throughput"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune ORT threads, batching and worker count for this host")
+    parser.add_argument("--output", default=str(project_root / "api" / "models" / "runtime_profile.json"),
+                        help="Runtime profile to write (point RUNTIME_PROFILE_PATH at it)")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per trial")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent simulated uploads")
+    parser.add_argument("--max-p99-ms", type=float, help="Latency budget: ignore configurations with a higher p99")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16", help="Comma-separated max batch sizes to try")
+    parser.add_argument("--windows", default="0,2,5,10", help="Comma-separated batch wait windows (ms) to try")
+    parser.add_argument("--max-workers", type=int, help="Largest worker count to try (default: CPU count)")
+    parser.add_argument("--quick", action="store_true", help="Fewer candidates and shorter trials")
+    args = parser.parse_args()
+
+    from api.app.inference import get_crop_labels, get_model_version
+    from api.app.prefork import available_cpus
+    import onnxruntime as ort
+
+    cpus = available_cpus()
+    duration = args.duration / 2 if args.quick else args.duration
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size.strip()]
+    windows = [float(window) for window in args.windows.split(",") if window.strip()]
+    if args.quick:
+        batch_sizes = sorted({batch_sizes[0], batch_sizes[-1]})
+        windows = sorted({windows[0], windows[-1]})
+    crops = get_crop_labels()[:8] or ["auto"]
+    label, _ = model_source()
+    print(f"🔧 Tuning {label} on {cpus} CPU(s), {args.concurrency} concurrent clients, {duration:.1f} s per trial")
+
+    # Stage 1: session settings
+    print("\n1️⃣  Session threads")
+    candidates = [{"execution_mode": "sequential", "intra_op_threads": threads, "inter_op_threads": 1}
+                  for threads in thread_candidates(cpus, args.quick)]
+    if cpus >= 4 and not args.quick:
+        candidates.append({"execution_mode": "parallel", "intra_op_threads": cpus // 2, "inter_op_threads": 2})
+    session_trials = tune_session(candidates, max(batch_sizes), duration)
+    best_session = pick_best(session_trials, args.max_p99_ms, key=lambda trial: {
+        "throughput": trial["batch"]["throughput"], "p99_ms": trial["single"]["p99_ms"]})["settings"]
+
+    # Stage 2: micro-batching
+    print(f"\n2️⃣  Micro-batching with {json.dumps(best_session)}")
+    batching_trials = tune_batching(best_session, batch_sizes, windows, args.concurrency, duration, crops)
+    best_batching = pick_best(batching_trials, args.max_p99_ms)["batching"]
+
+    # Stage 3: worker processes
+    print(f"\n3️⃣  Worker processes with {json.dumps(best_batching)}")
+    max_workers = args.max_workers or cpus
+    worker_counts = sorted({count for count in (1, 2, 4, max_workers // 2, max_workers) if 1 <= count <= max_workers})
+    if args.quick:
+        worker_counts = sorted({1, max_workers})
+    worker_trials = tune_workers(best_session, best_batching, worker_counts, best_session["intra_op_threads"],
+                                 args.concurrency, duration, crops)
+    best = pick_best(worker_trials, args.max_p99_ms)
+
+    profile = {
+        "session": best["session"],
+        "batching": best_batching,
+        "server": {"workers": best["workers"]},
+        "expected": {key: best[key] for key in ("throughput", "p50_ms", "p99_ms")},
+        "host": {
+            "cpus": cpus,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "onnxruntime": ort.__version__,
+            "model": label,
+            "model_version": get_model_version(),
+        },
+        "max_p99_ms": args.max_p99_ms,
+        "created_at": time.time(),
+        "trials": {"session": session_trials, "batching": batching_trials, "workers": worker_trials},
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(profile, f, indent=2)
+
+    print(f"\n✅ Best: {best['workers']} worker(s), {json.dumps(best['session'])}, {json.dumps(best_batching)}")
+    print(f"   {best['throughput']:.1f} img/s, p50 {best['p50_ms']:.2f} ms, p99 {best['p99_ms']:.2f} ms")
+    print(f"✅ Saved runtime profile to: {args.output}")
+    print(f"   Set RUNTIME_PROFILE_PATH={args.output} (and drop WEB_CONCURRENCY) to use it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark full-resolution vs reduced-resolution (JPEG draft) decoding.
+
+Generates synthetic phone-camera-sized JPEGs and times the upload path's
+decode + resize for the model input and the heatmap, with and without
+PIL's draft mode (libjpeg DCT scaling).
+
+Usage:
+    python scripts/benchmark_decode.py [--repeats 5] [--quality 90]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Add the project root to the path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+# Typical phone camera resolutions (label, width, height)
+RESOLUTIONS = [
+    ("12 MP", 4000, 3000),
+    ("24 MP", 6000, 4000),
+    ("48 MP", 8000, 6000),
+    ("50 MP", 8160, 6120),
+]
+
+
+def make_jpeg(width: int, height: int, quality: int) -> bytes:
+    """Create a JPEG with smooth gradients plus noise (compresses like a photo)"""
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    rng = np.random.RandomState(0)
+    noise = rng.randint(0, 24, (height, width), dtype=np.uint8).astype(np.float32)
+    pixels = np.stack([
+        (x + noise) % 256,
+        (y + noise) % 256,
+        ((x + y) / 2) % 256,
+    ], axis=2).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def time_call(func, repeats: int) -> float:
+    """Median wall time of func() in milliseconds"""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JPEG draft-mode decoding")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality of the synthetic photos")
+    args = parser.parse_args()
+
+    os.environ.setdefault("JPEG_DRAFT_DECODE", "true")
+    from api.app.config import HEATMAP_IMAGE_SIZE
+    from api.app.utils.image_utils import decode_image, get_decode_size, preprocess_image
+
+    decode_size = get_decode_size()
+    print(f"Decode target: >= {decode_size}px (model + heatmap {HEATMAP_IMAGE_SIZE}px)")
+    print(f"{'Resolution':<10} {'JPEG MB':>8} {'Full ms':>9} {'Draft ms':>9} {'Speedup':>8} {'Decoded as':>12}")
+
+    for label, width, height in RESOLUTIONS:
+        data = make_jpeg(width, height, args.quality)
+
+        def full():
+            image = decode_image(data)
+            preprocess_image(image)
+            image.resize((HEATMAP_IMAGE_SIZE, HEATMAP_IMAGE_SIZE))
+
+        def draft():
+            image = decode_image(data, decode_size)
+            preprocess_image(image)
+            image.resize((HEATMAP_IMAGE_SIZE, HEATMAP_IMAGE_SIZE))
+
+        full_ms = time_call(full, args.repeats)
+        draft_ms = time_call(draft, args.repeats)
+        decoded = decode_image(data, decode_size).size
+        print(f"{label:<10} {len(data) / 1e6:>8.1f} {full_ms:>9.1f} {draft_ms:>9.1f} "
+              f"{full_ms / draft_ms:>7.1f}x {decoded[0]:>5}x{decoded[1]:<6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,7 @@ project_root = Path(__file__).parent.parent
 sys.path.append(str(project_root))
 
 # Import the model architecture
-from api.app.utils.model_loader import MultiHeadCropDiseaseModel
+from api.app.utils.model_arch import MultiHeadCropDiseaseModel
 
 # Create a simplified model for ONNX export
 class ONNXMultiHeadCropDiseaseModel(nn.Module):
@@ -48,10 +48,14 @@ class ONNXMultiHeadCropDiseaseModel(nn.Module):
         })
 
     def forward(self, image):
-        """Simplified forward pass for ONNX export - only image input"""
+        """Simplified forward pass for ONNX export - only image input
+        
+        Returns the concatenated logits of every crop head and the final
+        backbone feature map, which the API uses for class activation maps.
+        """
         # Extract features
-        x = self.backbone(image)
-        x = self.avgpool(x)
+        feature_map = self.backbone(image)
+        x = self.avgpool(feature_map)
         x = torch.flatten(x, 1)
         
         # For ONNX export, we'll use a simple approach
@@ -67,7 +71,162 @@ class ONNXMultiHeadCropDiseaseModel(nn.Module):
         # Concatenate all outputs
         combined_output = torch.cat(all_outputs, dim=1)
         
-        return combined_output
+        return combined_output, feature_map
+
+
+class ONNXBackboneModel(nn.Module):
+    """Backbone-only graph for the split backbone + heads deployment
+    
+    Outputs the pooled 576-d embedding and the final feature map. The API
+    applies the crop heads from crop_heads.npz itself, so an image's
+    embedding can be re-classified for any crop without another forward pass.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.backbone = model.backbone
+        self.avgpool = model.avgpool
+
+    def forward(self, image):
+        feature_map = self.backbone(image)
+        embedding = torch.flatten(self.avgpool(feature_map), 1)
+        return embedding, feature_map
+
+
+class ONNXRoutedCropDiseaseModel(nn.Module):
+    """Export variant that routes each image to its own crop head inside the graph
+    
+    Takes crop_id alongside the image. All heads are fused into one padded
+    (num_crops, max_classes, 576) weight tensor, so a row's head is a single
+    gather and a batch can mix crops. Softmax, top-k and the local -> global
+    class mapping also run in the graph; padded classes get a large negative
+    bias so their probability is zero.
+    """
+    def __init__(self, model, crop_to_global_classes, top_k=3):
+        super().__init__()
+        self.backbone = model.backbone
+        self.avgpool = model.avgpool
+
+        num_crops = max(int(cid) for cid in crop_to_global_classes) + 1
+        max_classes = max(len(classes) for classes in crop_to_global_classes.values())
+        self.top_k = min(top_k, min(len(classes) for classes in crop_to_global_classes.values()))
+
+        weight = torch.zeros(num_crops, max_classes, 576)
+        bias = torch.full((num_crops, max_classes), -1e4)
+        class_ids = torch.full((num_crops, max_classes), -1, dtype=torch.long)
+        for crop_id_str, classes in crop_to_global_classes.items():
+            head = model.heads[str(crop_id_str)]
+            cid, n = int(crop_id_str), len(classes)
+            weight[cid, :n] = head.weight.detach()
+            bias[cid, :n] = head.bias.detach()
+            class_ids[cid, :n] = torch.tensor([int(c) for c in classes], dtype=torch.long)
+
+        self.register_buffer("head_weight", weight)
+        self.register_buffer("head_bias", bias)
+        self.register_buffer("class_ids", class_ids)
+
+    def forward(self, image, crop_id):
+        feature_map = self.backbone(image)
+        embedding = torch.flatten(self.avgpool(feature_map), 1)
+
+        # Gather each row's head and apply it: (N, C, 576) x (N, 576, 1)
+        weight = self.head_weight[crop_id]
+        logits = torch.bmm(weight, embedding.unsqueeze(-1)).squeeze(-1) + self.head_bias[crop_id]
+        probabilities = torch.softmax(logits, dim=1)
+
+        topk_probabilities, topk_indices = torch.topk(probabilities, self.top_k, dim=1)
+        topk_class_ids = torch.gather(self.class_ids[crop_id], 1, topk_indices)
+
+        return logits, probabilities, topk_probabilities, topk_indices, topk_class_ids, embedding, feature_map
+
+
+def export_routed(model, path, dummy_image, crop_to_global_classes, top_k=3):
+    """Export the crop-routed variant (crop_id input, in-graph postprocessing)"""
+    routed = ONNXRoutedCropDiseaseModel(model, crop_to_global_classes, top_k).eval()
+    output_names = ['logits', 'probabilities', 'topk_probabilities', 'topk_indices',
+                    'topk_class_ids', 'embedding', 'features']
+    torch.onnx.export(
+        routed,
+        (dummy_image, torch.zeros(dummy_image.shape[0], dtype=torch.long)),
+        path,
+        export_params=True,
+        opset_version=11,
+        do_constant_folding=True,
+        input_names=['image', 'crop_id'],
+        output_names=output_names,
+        dynamic_axes={name: {0: 'batch_size'} for name in ['image', 'crop_id'] + output_names}
+    )
+
+
+def export_backbone(model, path, dummy_image):
+    """Export the backbone-only graph (embedding + feature map outputs)"""
+    torch.onnx.export(
+        ONNXBackboneModel(model).eval(),
+        dummy_image,
+        path,
+        export_params=True,
+        opset_version=11,
+        do_constant_folding=True,
+        input_names=['image'],
+        output_names=['embedding', 'features'],
+        dynamic_axes={
+            'image': {0: 'batch_size'},
+            'embedding': {0: 'batch_size'},
+            'features': {0: 'batch_size'}
+        }
+    )
+
+
+def save_head_weights(model, path):
+    """Save every crop head's Linear weights and bias to a NumPy archive
+    
+    The API combines these with the exported feature map to build class
+    activation maps (CAM) without another forward pass.
+    """
+    import numpy as np
+    
+    arrays = {}
+    for crop_id_str, head in model.heads.items():
+        arrays[f"weight_{crop_id_str}"] = head.weight.detach().cpu().numpy().astype(np.float32)
+        arrays[f"bias_{crop_id_str}"] = head.bias.detach().cpu().numpy().astype(np.float32)
+    np.savez(path, **arrays)
+
+
+def load_label_map(*paths):
+    """Index-ordered labels from the first existing {"0": name, ...} JSON map"""
+    import json
+    
+    for path in paths:
+        if path.exists():
+            with open(path, "r") as f:
+                label_map = json.load(f)
+            return [label_map[str(i)] for i in range(len(label_map))]
+    return []
+
+
+def save_model_bundle(model, path, routed_path, crop_to_global_classes, preprocess_config):
+    """Write the single-file bundle the API maps at startup
+    
+    Holds the crop-routed graph, the label tables, the crop mapping, the
+    preprocessing config, the precomputed crop segment tables and the
+    stacked head weights (for crop auto-detection and CAM).
+    """
+    from api.app.model_bundle import write_bundle
+    
+    model_dir = path.parent
+    head_weights = {
+        crop_id_str: (head.weight.detach().cpu().numpy(), head.bias.detach().cpu().numpy())
+        for crop_id_str, head in model.heads.items()
+    }
+    return write_bundle(
+        str(path),
+        str(routed_path),
+        "routed",
+        crop_to_global_classes,
+        class_labels=load_label_map(model_dir / "disease_class_map.json", model_dir / "class_map.json"),
+        crop_labels=load_label_map(model_dir / "crop_map.json"),
+        preprocess_config=preprocess_config,
+        head_weights=head_weights,
+    )
 
 def convert_model_to_onnx():
     """Convert the trained .pth model to ONNX format"""
@@ -117,15 +276,26 @@ def convert_model_to_onnx():
             opset_version=11,
             do_constant_folding=True,
             input_names=['image'],
-            output_names=['logits'],
+            output_names=['logits', 'features'],
             dynamic_axes={
                 'image': {0: 'batch_size'},
-                'logits': {0: 'batch_size'}
+                'logits': {0: 'batch_size'},
+                'features': {0: 'batch_size'}
             }
         )
         
         print(f"✅ Model converted successfully to: {onnx_path}")
         
+        # Also export the backbone on its own for the split backbone + heads mode
+        backbone_path = model_dir / "backbone.onnx"
+        export_backbone(model, backbone_path, dummy_image)
+        print(f"✅ Exported backbone to: {backbone_path}")
+        
+        # And the crop-routed variant with softmax / top-k inside the graph
+        routed_path = model_dir / "mobilenet_routed.onnx"
+        export_routed(model, routed_path, dummy_image, crop_to_global_classes)
+        print(f"✅ Exported crop-routed model to: {routed_path}")
+        
         # Verify the ONNX model
         try:
             import onnx
@@ -162,6 +332,11 @@ def convert_model_to_onnx():
             json.dump(crop_to_global_classes_serializable, f, indent=2)
         print(f"✅ Saved crop mapping to: {crop_mapping_path}")
         
+        # Save the per-crop head weights for class activation maps
+        head_weights_path = model_dir / "crop_heads.npz"
+        save_head_weights(model, head_weights_path)
+        print(f"✅ Saved crop head weights to: {head_weights_path}")
+        
         # Save preprocessing config
         preprocess_config = {
             "img_size": checkpoint.get("img_size", 160),
@@ -174,6 +349,12 @@ def convert_model_to_onnx():
             json.dump(preprocess_config, f, indent=2)
         print(f"✅ Saved preprocessing config to: {config_path}")
         
+        # Everything above in one memory-mappable, checksummed file
+        bundle_path = model_dir / "model_bundle.zip"
+        manifest = save_model_bundle(model, bundle_path, routed_path,
+                                     crop_to_global_classes_serializable, preprocess_config)
+        print(f"✅ Saved model bundle {manifest['model_version']} to: {bundle_path}")
+        
         return True
         
     except Exception as e:
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Static INT8 quantization of the exported multi-crop disease model.
+
+Calibrates activation ranges on a folder of sample leaf images, preprocessed
+exactly like uploads are (decode_image + preprocess_image), writes a
+QDQ-quantized model next to the FP32 one (mobilenet.onnx ->
+mobilenet_int8.onnx, which the API loads with MODEL_VARIANT=int8), then
+reports per-crop top-1 agreement and latency against the FP32 model.
+
+Works with every export layout: the fused all-heads graph, the backbone-only
+graph (heads applied from crop_heads.npz) and the crop-routed graph. With
+--bundle the quantized graph is also added to the model bundle as its int8
+variant.
+
+Usage:
+    python scripts/quantize_multicrop_onnx.py --calibration-dir samples/
+        [--model api/models/mobilenet.onnx] [--eval-dir held_out/]
+        [--output api/models/mobilenet_int8.onnx] [--report report.json]
+        [--min-agreement 0.95] [--bundle api/models/model_bundle.zip]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+
+# Add the project root to the path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def list_images(folder, limit=None):
+    """Image files under a folder (recursively), in a stable order"""
+    paths = sorted(
+        str(path) for path in Path(folder).rglob("*")
+        if path.suffix.lower() in IMAGE_EXTENSIONS
+    )
+    return paths[:limit] if limit else paths
+
+
+def load_images(paths):
+    """Preprocess images the same way the upload endpoint does"""
+    from api.app.utils.image_utils import decode_image, get_decode_size, preprocess_image
+
+    batch = []
+    for path in paths:
+        with open(path, "rb") as f:
+            image = decode_image(f.read(), get_decode_size())
+        batch.append(preprocess_image(image))
+    return np.stack(batch).astype(np.float32)
+
+
+def input_names(session):
+    return [model_input.name for model_input in session.get_inputs()]
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed sample images to the calibrator in small batches
+
+    For the crop-routed graph the crop_id input cycles through every crop so
+    all heads see calibration data.
+    """
+
+    def __init__(self, images, image_input, crop_ids=None, batch_size=8):
+        self.images = images
+        self.image_input = image_input
+        self.crop_ids = crop_ids
+        self.batch_size = batch_size
+        self._position = 0
+
+    def get_next(self):
+        if self._position >= len(self.images):
+            return None
+        start = self._position
+        self._position += self.batch_size
+        batch = self.images[start:self._position]
+        feeds = {self.image_input: batch}
+        if self.crop_ids is not None:
+            feeds["crop_id"] = np.resize(np.roll(self.crop_ids, -start), len(batch)).astype(np.int64)
+        return feeds
+
+    def rewind(self):
+        self._position = 0
+
+
+def name_nodes(graph):
+    """Give unnamed nodes a unique name (nodes are excluded from quantization by name)"""
+    used = {node.name for node in graph.node if node.name}
+    for index, node in enumerate(graph.node):
+        if not node.name:
+            name = f"{node.op_type}_{index}"
+            while name in used:
+                name += "_"
+            node.name = name
+            used.add(name)
+
+
+def backbone_nodes(graph, output="features"):
+    """Names of the nodes that compute the backbone's feature map
+
+    Every export layout has the final feature map as its "features" output;
+    the backbone is exactly what that output depends on, and everything else
+    (pooling, crop heads, softmax, top-k) is head.
+    """
+    if output not in {graph_output.name for graph_output in graph.output}:
+        raise ValueError(f"Model has no '{output}' output - cannot tell the backbone from the heads "
+                         f"(outputs: {[graph_output.name for graph_output in graph.output]})")
+
+    producers = {}
+    for node in graph.node:
+        for node_output in node.output:
+            producers[node_output] = node
+
+    backbone, pending = set(), [output]
+    while pending:
+        node = producers.get(pending.pop())
+        if node is None or node.name in backbone:
+            continue
+        backbone.add(node.name)
+        pending.extend(node.input)
+
+    if not backbone or len(backbone) == len(graph.node):
+        raise ValueError(f"Could not separate the backbone from the heads ({len(backbone)} of "
+                         f"{len(graph.node)} nodes feed '{output}')")
+    return backbone
+
+
+def quantize_model(model_path, output_path, reader, per_channel=True, method="MinMax", quant_format="qdq"):
+    """Static quantization: INT8 weights, UINT8 activations"""
+    model_input = model_path
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        import onnx
+        model = onnx.load(model_path)
+        opset = next((entry.version for entry in model.opset_import if entry.domain in ("", "ai.onnx")), 0)
+        if opset < 13:
+            # Per-channel QuantizeLinear / DequantizeLinear (axis attribute) needs opset 13
+            from onnx import version_converter
+            model_path = os.path.join(tmp_dir, "opset13.onnx")
+            onnx.save(version_converter.convert_version(model, 13), model_path)
+            print(f"🔄 Upgraded model from opset {opset} to 13 for quantization")
+        del model
+
+        try:
+            # Shape inference + graph cleanup improves what the quantizer can fuse
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+            model_input = os.path.join(tmp_dir, "preprocessed.onnx")
+            quant_pre_process(model_path, model_input, skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"⚠️ Quantization pre-processing skipped: {e}")
+            model_input = model_path
+
+        # Quantize the backbone only: the heads are a few small matmuls, and the
+        # routed graph's padded head bias (-1e4) would wreck the activation ranges
+        model = onnx.load(model_input)
+        name_nodes(model.graph)
+        model_input = os.path.join(tmp_dir, "named.onnx")
+        onnx.save(model, model_input)
+        backbone = backbone_nodes(model.graph)
+        nodes_to_exclude = [node.name for node in model.graph.node if node.name not in backbone]
+        print(f"🔍 Quantizing {len(backbone)} backbone nodes, keeping {len(nodes_to_exclude)} head nodes in FP32")
+        del model
+
+        quantize_static(
+            model_input,
+            output_path,
+            reader,
+            quant_format=QuantFormat.QDQ if quant_format == "qdq" else QuantFormat.QOperator,
+            per_channel=per_channel,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=getattr(CalibrationMethod, method),
+            nodes_to_exclude=nodes_to_exclude,
+        )
+
+
+def make_session(path):
+    from api.app.runtime_profile import build_session_options, get_runtime_profile
+
+    profile = get_runtime_profile()
+    return ort.InferenceSession(path, sess_options=build_session_options(profile),
+                                providers=profile["providers"] or None)
+
+
+def crop_top1(session, images):
+    """Top-1 local class of every crop head for every image, shape (N, num_crops)"""
+    from api.app.inference import get_crop_segments, get_fused_heads
+
+    segments = get_crop_segments()
+    image_input = input_names(session)[0]
+    output_names = [output.name for output in session.get_outputs()]
+
+    if "crop_id" in input_names(session):
+        # Routed graph: one pass per crop, the graph already picks the top class
+        columns = []
+        for crop_id in segments["crop_ids"]:
+            crop_ids = np.full(len(images), crop_id, dtype=np.int64)
+            outputs = dict(zip(output_names, session.run(None, {image_input: images, "crop_id": crop_ids})))
+            columns.append(outputs["topk_indices"][:, 0])
+        return np.stack(columns, axis=1)
+
+    outputs = dict(zip(output_names, session.run(None, {image_input: images})))
+    if "embedding" in outputs:
+        weight, bias = get_fused_heads()
+        logits = outputs["embedding"] @ weight.T + bias
+    else:
+        logits = outputs.get("logits", outputs[output_names[0]])
+
+    table = segments["table"]
+    per_crop = np.where(table >= 0, logits[:, np.maximum(table, 0)], -np.inf)
+    return per_crop.argmax(axis=2)
+
+
+def measure_latency(session, image, runs):
+    """p50 / p95 single-image latency in milliseconds"""
+    feeds = {input_names(session)[0]: image[None]}
+    if "crop_id" in input_names(session):
+        feeds["crop_id"] = np.zeros(1, dtype=np.int64)
+    for _ in range(3):
+        session.run(None, feeds)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        session.run(None, feeds)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return {"p50_ms": float(np.percentile(timings, 50)), "p95_ms": float(np.percentile(timings, 95))}
+
+
+def build_report(fp32_path, int8_path, images, latency_runs):
+    from api.app.inference import get_crop_labels, get_crop_segments
+
+    fp32 = make_session(fp32_path)
+    int8 = make_session(int8_path)
+    agree = crop_top1(fp32, images) == crop_top1(int8, images)
+
+    crop_labels = get_crop_labels()
+    crops = {}
+    for column, crop_id in enumerate(get_crop_segments()["crop_ids"]):
+        name = crop_labels[crop_id] if crop_id < len(crop_labels) else str(crop_id)
+        crops[name] = float(agree[:, column].mean())
+
+    return {
+        "fp32_model": fp32_path,
+        "int8_model": int8_path,
+        "images": int(len(images)),
+        "top1_agreement": float(agree.mean()),
+        "min_crop_agreement": min(crops.values()),
+        "crop_agreement": crops,
+        "latency": {
+            "fp32": measure_latency(fp32, images[0], latency_runs),
+            "int8": measure_latency(int8, images[0], latency_runs),
+        },
+        "size_mb": {
+            "fp32": os.path.getsize(fp32_path) / 1e6,
+            "int8": os.path.getsize(int8_path) / 1e6,
+        },
+    }
+
+
+def print_report(report):
+    print(f"\n📊 Top-1 agreement over {report['images']} images: {report['top1_agreement'] * 100:.1f}% "
+          f"(worst crop {report['min_crop_agreement'] * 100:.1f}%)")
+    print(f"{'Crop':<14} {'Agreement':>9}")
+    for name, agreement in sorted(report["crop_agreement"].items(), key=lambda item: item[1]):
+        print(f"{name:<14} {agreement * 100:>8.1f}%")
+    fp32, int8 = report["latency"]["fp32"], report["latency"]["int8"]
+    print(f"\n⏱️  Latency p50 {fp32['p50_ms']:.2f} -> {int8['p50_ms']:.2f} ms "
+          f"({fp32['p50_ms'] / int8['p50_ms']:.2f}x), p95 {fp32['p95_ms']:.2f} -> {int8['p95_ms']:.2f} ms")
+    print(f"📦 Size {report['size_mb']['fp32']:.1f} -> {report['size_mb']['int8']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static INT8 quantization with an accuracy-drift report")
+    parser.add_argument("--model", default=str(project_root / "api" / "models" / "mobilenet.onnx"),
+                        help="FP32 ONNX model (fused, backbone or routed export)")
+    parser.add_argument("--calibration-dir", required=True, help="Folder of sample leaf images")
+    parser.add_argument("--eval-dir", help="Held-out images for the report (defaults to the calibration images)")
+    parser.add_argument("--output", help="Quantized model path (defaults to <model>_int8.onnx)")
+    parser.add_argument("--num-calibration", type=int, default=200, help="Maximum calibration images")
+    parser.add_argument("--num-eval", type=int, default=500, help="Maximum evaluation images")
+    parser.add_argument("--method", default="MinMax", choices=["MinMax", "Entropy", "Percentile"],
+                        help="Calibration method")
+    parser.add_argument("--format", default="qdq", choices=["qdq", "qoperator"],
+                        help="QDQ (portable) or QOperator (QLinear* ops) quantized graph")
+    parser.add_argument("--per-tensor", action="store_true", help="Per-tensor instead of per-channel weights")
+    parser.add_argument("--latency-runs", type=int, default=50, help="Timed single-image runs per model")
+    parser.add_argument("--report", help="Write the report as JSON to this path")
+    parser.add_argument("--min-agreement", type=float, default=0.0,
+                        help="Exit non-zero if any crop's top-1 agreement is below this")
+    parser.add_argument("--bundle", help="Model bundle to add the quantized graph to (as the int8 variant)")
+    args = parser.parse_args()
+
+    from api.app.inference import get_crop_segments, get_variant_path
+
+    output_path = args.output or get_variant_path(args.model, "int8")
+
+    calibration_paths = list_images(args.calibration_dir, args.num_calibration)
+    if not calibration_paths:
+        print(f"❌ No images found in {args.calibration_dir}")
+        sys.exit(1)
+    print(f"📁 Calibrating on {len(calibration_paths)} images from {args.calibration_dir}")
+    calibration_images = load_images(calibration_paths)
+
+    session = make_session(args.model)
+    crop_ids = get_crop_segments()["crop_ids"] if "crop_id" in input_names(session) else None
+    reader = ImageCalibrationReader(calibration_images, input_names(session)[0], crop_ids)
+    del session
+
+    print(f"🔄 Quantizing {args.model} ({args.method}, {'per-tensor' if args.per_tensor else 'per-channel'})...")
+    quantize_model(args.model, output_path, reader, per_channel=not args.per_tensor,
+                   method=args.method, quant_format=args.format)
+    print(f"✅ Saved INT8 model to: {output_path}")
+
+    if args.eval_dir:
+        eval_images = load_images(list_images(args.eval_dir, args.num_eval))
+    else:
+        print("⚠️ No --eval-dir given, reporting agreement on the calibration images")
+        eval_images = calibration_images[:args.num_eval]
+
+    report = build_report(args.model, output_path, eval_images, args.latency_runs)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Saved report to: {args.report}")
+
+    if report["min_crop_agreement"] < args.min_agreement:
+        print(f"💥 Crop agreement below {args.min_agreement:.2f}")
+        sys.exit(1)
+
+    if args.bundle:
+        from api.app.model_bundle import add_bundle_variant
+        manifest = add_bundle_variant(args.bundle, "int8", output_path)
+        print(f"✅ Added int8 variant to bundle {manifest['model_version']}: {args.bundle}")
+
+
+if __name__ == "__main__":
+    main()